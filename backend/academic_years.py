@@ -0,0 +1,175 @@
+"""Academic years: the current year, its dates and the year-end rollover.
+
+A year is named "2025-2026" and runs from ACADEMIC_YEAR_START (MM-DD,
+default 09-01) to the day before the next start. The current year is
+ACADEMIC_YEAR when set, otherwise the year today falls in. Grades carry
+their year; attendance is scoped by the year's date range. Day-to-day
+endpoints only read and write the current year.
+
+`python manage.py rollover-year` closes a past year: its grades and
+attendance move to the `<collection>_archive` collections, and students
+the year's grades promote ("Lên lớp") go up one class. Run it once the
+new year has started; every step is safe to re-run after an interruption.
+"""
+import os
+import re
+from datetime import date
+
+from pymongo import ReplaceOne, UpdateOne
+
+import grading
+import propagation
+import search as student_search
+from repositories import MotorOutboxRepo
+
+YEAR_PATTERN = re.compile(r"^(\d{4})-(\d{4})$")
+ARCHIVE_SUFFIX = "_archive"
+
+# Archived collection -> fields of its unique index, which archive copies are keyed by
+ARCHIVE_KEYS = {
+    "grades": ("student_id", "year", "semester"),
+    "attendance": ("student_id", "date"),
+    "attendance_days": ("class_name", "date"),
+}
+
+
+def year_start():
+    """(month, day) the academic year starts on"""
+    month, day = os.environ.get("ACADEMIC_YEAR_START", "09-01").split("-")
+    return int(month), int(day)
+
+
+def parse_year(year):
+    """First calendar year of a "2025-2026" year name"""
+    match = YEAR_PATTERN.match(year or "")
+    if not match or int(match.group(2)) != int(match.group(1)) + 1:
+        raise ValueError(f"Invalid academic year {year!r}, expected e.g. '2025-2026'")
+    return int(match.group(1))
+
+
+def year_name(first):
+    return f"{first}-{first + 1}"
+
+
+def year_of(day):
+    """The academic year a date falls in"""
+    first = day.year if (day.month, day.day) >= year_start() else day.year - 1
+    return year_name(first)
+
+
+def current_year(today=None):
+    configured = os.environ.get("ACADEMIC_YEAR")
+    if configured:
+        parse_year(configured)
+        return configured
+    return year_of(today or date.today())
+
+
+def previous_year(year):
+    return year_name(parse_year(year) - 1)
+
+
+def date_range(year):
+    """(first day, last day) of a year as YYYY-MM-DD strings"""
+    first = parse_year(year)
+    month, day = year_start()
+    start = date(first, month, day)
+    end = date(first + 1, month, day)
+    return start.isoformat(), date.fromordinal(end.toordinal() - 1).isoformat()
+
+
+def next_class_name(class_name):
+    """Class a promoted student moves up to: "Lớp 1A" -> "Lớp 2A"; unnumbered classes stay"""
+    return re.sub(r"\d+", lambda match: str(int(match.group()) + 1), class_name, count=1)
+
+
+def archive_name(collection_name):
+    return collection_name + ARCHIVE_SUFFIX
+
+
+async def archive_documents(db, collection_name, query, batch_size=1000):
+    """Move the documents matching `query` into the collection's archive; returns the count"""
+    source = db[collection_name]
+    target = db[archive_name(collection_name)]
+    key_fields = ARCHIVE_KEYS[collection_name]
+    moved = 0
+    while True:
+        batch = await source.find(query).limit(batch_size).to_list(None)
+        if not batch:
+            return moved
+        # Copy before deleting, keyed like the unique index, so a re-run never duplicates
+        await target.bulk_write([
+            ReplaceOne(
+                {field: document.get(field) for field in key_fields},
+                {field: value for field, value in document.items() if field != "_id"},
+                upsert=True
+            )
+            for document in batch
+        ], ordered=False)
+        await source.delete_many({"_id": {"$in": [document["_id"] for document in batch]}})
+        moved += len(batch)
+
+
+async def promoted_students(db, year):
+    """{student_id: class graded in} of the students the archived grades of `year` promote"""
+    by_student = {}
+    async for record in db[archive_name("grades")].find({"year": year}, {"_id": 0}):
+        by_student.setdefault(record["student_id"], {})[record["semester"]] = record
+
+    promoted = {}
+    for student_id, semesters in by_student.items():
+        result = grading.student_result(semesters.get(1), semesters.get(2))
+        if result["status"] == grading.STATUS_PASSED:
+            promoted[student_id] = (semesters.get(2) or semesters.get(1))["class_name"]
+    return promoted
+
+
+async def promote_students(db, promoted):
+    """Move promoted students up one class; returns [(student_id, previous class)]"""
+    students = await db.students.find(
+        {"id": {"$in": list(promoted)}},
+        {"_id": 0, "id": 1, "name": 1, "class_name": 1, "parent_name": 1}
+    ).to_list(None)
+
+    operations = []
+    moved = []
+    for student in students:
+        # Only students still in the class they were graded in, so nobody goes up twice
+        previous = student["class_name"]
+        if previous != promoted[student["id"]] or next_class_name(previous) == previous:
+            continue
+        student["class_name"] = next_class_name(previous)
+        operations.append(UpdateOne(
+            {"id": student["id"], "class_name": previous},
+            {"$set": {"class_name": student["class_name"], "search_key": student_search.build_search_key(student)}}
+        ))
+        moved.append((student["id"], previous))
+    if operations:
+        await db.students.bulk_write(operations, ordered=False)
+    return moved
+
+
+async def rollover(db, year, attendance_layout="per_student", batch_size=1000):
+    """Archive a closed year and promote its passing students.
+
+    Returns {collection: archived document count, "promoted": student count}.
+    Promotions are queued for propagation, so grades and attendance already
+    recorded in the new year follow the student's new class.
+    """
+    if parse_year(year) >= parse_year(current_year()):
+        raise ValueError(f"{year} is not closed yet, the current year is {current_year()}")
+
+    first_day, last_day = date_range(year)
+    days = {"date": {"$gte": first_day, "$lte": last_day}}
+    attendance_collection = "attendance_days" if attendance_layout == "class_day" else "attendance"
+    counts = {
+        "grades": await archive_documents(db, "grades", {"year": year}, batch_size),
+        attendance_collection: await archive_documents(db, attendance_collection, days, batch_size),
+    }
+
+    moved = await promote_students(db, await promoted_students(db, year))
+    outbox = MotorOutboxRepo(db)
+    for student_id, previous in moved:
+        await outbox.enqueue(propagation.change_entry(student_id, [previous]))
+    counts["promoted"] = len(moved)
+    return counts
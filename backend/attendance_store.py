@@ -0,0 +1,446 @@
+"""Attendance storage layouts.
+
+per_student (default): one `attendance` document per student per day, the
+original layout.
+
+class_day: one `attendance_days` document per (class_name, date) holding a
+{student_id: entry} map. Names, class and a UUID are no longer repeated on
+every record, the collection holds one document per class per Sunday
+instead of one per child, and a class-day read is a single document fetch.
+
+Both stores take and return records in the original per-student shape, so
+endpoints work the same whichever layout is configured (ATTENDANCE_STORAGE).
+Move existing data between layouts with `python manage.py migrate-attendance`.
+"""
+import uuid
+from datetime import datetime
+
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+ATTENDANCE_LAYOUTS = ("per_student", "class_day")
+
+# Per-student record fields -> short keys of a class_day entry
+ENTRY_KEYS = {
+    "status": "s",
+    "method": "m",
+    "note": "n",
+    "recorded_by": "by",
+    "created_at": "at"
+}
+
+# Compact one-letter codes of the attendance matrix
+ATTENDANCE_CODES = {
+    "present": "P",
+    "absent_with_permission": "E",
+    "absent_without_permission": "A"
+}
+NO_RECORD_CODE = "-"
+UNKNOWN_STATUS_CODE = "?"
+
+# MongoDB error code of a write rejected by a unique index
+DUPLICATE_KEY_ERROR = 11000
+
+
+def new_record(student, date, status, method, note, recorded_by, recorded_at=None):
+    """An attendance record in the per-student shape, ready for store.record()"""
+    return {
+        "student_id": student["id"],
+        "student_name": student["name"],
+        "class_name": student["class_name"],
+        "date": date,
+        "status": status,
+        "method": method,
+        "note": note,
+        "recorded_by": recorded_by,
+        "created_at": recorded_at or datetime.utcnow()
+    }
+
+
+def summarize(records, recent=5):
+    """Counts per status, attendance rate and the latest records of one student.
+
+    `records` are {date, status} dicts, newest first.
+    """
+    counts = {status: 0 for status in ATTENDANCE_CODES}
+    for record in records:
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+    return {
+        "total": len(records),
+        **counts,
+        "attendance_rate": round(counts["present"] / len(records) * 100, 1) if records else None,
+        "recent": records[:recent]
+    }
+
+
+def class_query(class_name, date=None, date_range=None):
+    """Filter on the (class_name, date) index: one day, an inclusive (first, last) range, or all"""
+    query = {"class_name": class_name}
+    if date:
+        query["date"] = date
+    elif date_range:
+        query["date"] = {"$gte": date_range[0], "$lte": date_range[1]}
+    return query
+
+
+def record_id(student_id, date):
+    """Stable id for records that are not stored as their own document"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"attendance:{student_id}:{date}"))
+
+
+async def bulk_upsert(collection, operations, ordered=False):
+    """Run upserts as one bulk_write, unordered unless asked otherwise.
+
+    Returns the indexes of the operations that inserted a new document and
+    a map of operation index -> error message for those that failed.
+    """
+    try:
+        write_result = await collection.bulk_write(operations, ordered=ordered)
+        return set(write_result.upserted_ids), {}
+    except BulkWriteError as e:
+        upserted = {u["index"] for u in e.details.get("upserted", [])}
+        errors = {err["index"]: err["errmsg"] for err in e.details.get("writeErrors", [])}
+        return upserted, errors
+
+
+async def bulk_write_duplicates(collection, operations):
+    """Run operations as one unordered bulk_write.
+
+    Returns the indexes of the operations rejected by a unique index and a
+    map of operation index -> error message for those that failed otherwise.
+    """
+    try:
+        await collection.bulk_write(operations, ordered=False)
+        return set(), {}
+    except BulkWriteError as e:
+        duplicates = set()
+        errors = {}
+        for err in e.details.get("writeErrors", []):
+            if err["code"] == DUPLICATE_KEY_ERROR:
+                duplicates.add(err["index"])
+            else:
+                errors[err["index"]] = err["errmsg"]
+        return duplicates, errors
+
+
+class PerStudentAttendanceStore:
+    collection_name = "attendance"
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db[self.collection_name]
+
+    async def record(self, records, overwrite=True):
+        """Upsert records in one bulk_write.
+
+        With overwrite=False an existing record for that student and day is
+        left untouched. Returns (indexes of newly created records, errors by index).
+        """
+        operations = []
+        for record in records:
+            fields = {key: record[key] for key in ("status", "method", "note", "recorded_by")}
+            insert_fields = {
+                "id": str(uuid.uuid4()),
+                "student_name": record["student_name"],
+                "class_name": record["class_name"],
+                "created_at": record["created_at"]
+            }
+            if overwrite:
+                update = {"$set": fields, "$setOnInsert": insert_fields}
+            else:
+                update = {"$setOnInsert": {**insert_fields, **fields}}
+            operations.append(UpdateOne(
+                {"student_id": record["student_id"], "date": record["date"]},
+                update,
+                upsert=True
+            ))
+        if not operations:
+            return set(), {}
+        return await bulk_upsert(self.collection, operations)
+
+    async def class_records(self, class_name, date=None, date_range=None):
+        query = class_query(class_name, date, date_range)
+        return await self.collection.find(query, {"_id": 0}).to_list(None)
+
+    async def apply_student_changes(self, changes, date_range):
+        """Rewrite the copied student_name and class_name of the changed students' records within `date_range`"""
+        if not changes:
+            return
+        days = {"$gte": date_range[0], "$lte": date_range[1]}
+        await self.collection.bulk_write([
+            UpdateMany(
+                {"student_id": change["student_id"], "date": days},
+                {"$set": {"student_name": change["name"], "class_name": change["class_name"]}}
+            )
+            for change in changes
+        ], ordered=False)
+
+    async def student_records(self, student_id, class_name, date_from):
+        """{date, status} of one student since `date_from`, newest first"""
+        cursor = self.collection.find(
+            {"student_id": student_id, "date": {"$gte": date_from}},
+            {"_id": 0, "date": 1, "status": 1}
+        ).sort("date", -1)
+        return await cursor.to_list(None)
+
+    def records_pipeline(self, match, status=None):
+        """Aggregation stages emitting one {student_id, student_name, date, status} per record"""
+        if status:
+            match = {**match, "status": status}
+        return [
+            {"$match": match},
+            {"$project": {"_id": 0, "student_id": 1, "student_name": 1, "date": 1, "status": 1}}
+        ]
+
+    async def export(self):
+        async for record in self.collection.find({}, {"_id": 0}).sort([("class_name", 1), ("date", 1)]):
+            yield record
+
+
+class ClassDayAttendanceStore:
+    collection_name = "attendance_days"
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db[self.collection_name]
+
+    async def _student_names(self, student_ids):
+        cursor = self.db.students.find({"id": {"$in": list(student_ids)}}, {"_id": 0, "id": 1, "name": 1})
+        return {student["id"]: student["name"] async for student in cursor}
+
+    def _expand(self, day, student_id, entry, student_name):
+        record = {
+            "id": record_id(student_id, day["date"]),
+            "student_id": student_id,
+            "student_name": student_name,
+            "class_name": day["class_name"],
+            "date": day["date"]
+        }
+        record.update({field: entry.get(key) for field, key in ENTRY_KEYS.items()})
+        return record
+
+    async def record(self, records, overwrite=True):
+        """Write records with a guarded upsert per new entry.
+
+        Missing days are created first, then the first record of each
+        student and day gets its own guarded upsert, and whether it was
+        created is read from that operation's own result. With
+        overwrite=False existing entries are kept (first record wins);
+        otherwise entries that existed, and later records of the same
+        student and day, are then written with one update per class-day.
+        Returns (indexes of newly created records, errors by index).
+        """
+        if not records:
+            return set(), {}
+
+        # Which days and entries exist already, in one query over the touched days
+        days = {(record["class_name"], record["date"]) for record in records}
+        existing_days = set()
+        existing = set()
+        days_cursor = self.collection.find(
+            {"$or": [{"class_name": class_name, "date": date} for class_name, date in days]},
+            {"_id": 0, "class_name": 1, "date": 1, "entries": 1}
+        )
+        async for day in days_cursor:
+            existing_days.add((day["class_name"], day["date"]))
+            for student_id in day.get("entries", {}):
+                existing.add((day["class_name"], day["date"], student_id))
+
+        entries_by_day = {}  # (class_name, date) -> {student_id: (record index, entry)}
+        overwrites_by_day = {}  # same, for the entries to overwrite once they exist
+        for index, record in enumerate(records):
+            key = (record["class_name"], record["date"], record["student_id"])
+            if key in existing and not overwrite:
+                continue
+            entry = {key: record[field] for field, key in ENTRY_KEYS.items()}
+            entries = entries_by_day.setdefault(key[:2], {})
+            if record["student_id"] not in entries:
+                entries[record["student_id"]] = (index, entry)
+            elif overwrite:
+                overwrites_by_day.setdefault(key[:2], {})[record["student_id"]] = (index, entry)
+        if not entries_by_day:
+            return set(), {}
+
+        # Create missing days; one created meanwhile by another request is just as good
+        errors = {}
+        missing_days = [day for day in entries_by_day if day not in existing_days]
+        if missing_days:
+            _, day_errors = await bulk_write_duplicates(self.collection, [
+                UpdateOne({"class_name": class_name, "date": date}, {"$setOnInsert": {"entries": {}}}, upsert=True)
+                for class_name, date in missing_days
+            ])
+            for operation, message in day_errors.items():
+                day = missing_days[operation]
+                for index, _ in [*entries_by_day.pop(day).values(), *overwrites_by_day.pop(day, {}).values()]:
+                    errors[index] = message
+        if not entries_by_day:
+            return set(), errors
+
+        # The day exists now, so a guarded upsert that matches nothing only
+        # fails on the unique index: the entry was there already
+        operations = []
+        operation_rows = []  # (day, student_id, record index, entry) of each operation
+        for (class_name, date), entries in entries_by_day.items():
+            for student_id, (index, entry) in entries.items():
+                operations.append(UpdateOne(
+                    {"class_name": class_name, "date": date, f"entries.{student_id}": {"$exists": False}},
+                    {"$set": {f"entries.{student_id}": entry}},
+                    upsert=True
+                ))
+                operation_rows.append(((class_name, date), student_id, index, entry))
+        duplicates, operation_errors = await bulk_write_duplicates(self.collection, operations)
+        errors.update((operation_rows[operation][2], message) for operation, message in operation_errors.items())
+        created = {
+            index
+            for operation, (_, _, index, _) in enumerate(operation_rows)
+            if operation not in operation_errors and operation not in duplicates
+        }
+        if not overwrite:
+            return created, errors
+
+        # Entries that were there already take the new values; a later record of the same student wins
+        for operation in duplicates:
+            day, student_id, index, entry = operation_rows[operation]
+            overwrites_by_day.setdefault(day, {}).setdefault(student_id, (index, entry))
+        if overwrites_by_day:
+            operations = []
+            overwrite_rows = []  # record indexes written by each operation
+            for (class_name, date), entries in overwrites_by_day.items():
+                operations.append(UpdateOne(
+                    {"class_name": class_name, "date": date},
+                    {"$set": {f"entries.{student_id}": entry for student_id, (_, entry) in entries.items()}}
+                ))
+                overwrite_rows.append([index for index, _ in entries.values()])
+            _, overwrite_errors = await bulk_upsert(self.collection, operations)
+            errors.update(
+                (index, message)
+                for operation, message in overwrite_errors.items()
+                for index in overwrite_rows[operation]
+            )
+        return created - errors.keys(), errors
+
+    async def class_records(self, class_name, date=None, date_range=None):
+        query = class_query(class_name, date, date_range)
+        days = await self.collection.find(query, {"_id": 0}).to_list(None)
+        names = await self._student_names({student_id for day in days for student_id in day.get("entries", {})})
+        return [
+            self._expand(day, student_id, entry, names.get(student_id))
+            for day in days
+            for student_id, entry in day.get("entries", {}).items()
+        ]
+
+    async def apply_student_changes(self, changes, date_range):
+        """Move the entries of students who changed class into their new class's days within `date_range`.
+
+        Names are not stored on entries, so renames need nothing. An entry
+        the new class already has for that day is kept; the old one is
+        removed either way. Safe to re-run after an interruption.
+        """
+        moves = [
+            (change, previous)
+            for change in changes
+            for previous in change["previous_class_names"]
+            if previous != change["class_name"]
+        ]
+        if not moves:
+            return
+        days_cursor = self.collection.find(
+            {"date": {"$gte": date_range[0], "$lte": date_range[1]}, "$or": [
+                {"class_name": previous, f"entries.{change['student_id']}": {"$exists": True}}
+                for change, previous in moves
+            ]},
+            {"_id": 0, "class_name": 1, "date": 1, **{f"entries.{change['student_id']}": 1 for change, _ in moves}}
+        )
+        records = []
+        removals = []
+        async for day in days_cursor:
+            for change, previous in moves:
+                entry = day.get("entries", {}).get(change["student_id"])
+                if previous != day["class_name"] or entry is None:
+                    continue
+                record = self._expand(day, change["student_id"], entry, change["name"])
+                record["class_name"] = change["class_name"]
+                records.append(record)
+                removals.append(UpdateOne(
+                    {"class_name": previous, "date": day["date"]},
+                    {"$unset": {f"entries.{change['student_id']}": ""}}
+                ))
+        # Copy first, so an interruption leaves a duplicate to clean up, never a loss
+        _, errors = await self.record(records, overwrite=False)
+        if errors:
+            raise RuntimeError(f"Could not move {len(errors)} attendance entries: {next(iter(errors.values()))}")
+        if removals:
+            await self.collection.bulk_write(removals, ordered=False)
+
+    async def student_records(self, student_id, class_name, date_from):
+        """{date, status} of one student since `date_from`, newest first.
+
+        Days are found through the (class_name, date) index, so only the
+        student's current class is read.
+        """
+        cursor = self.collection.find(
+            {"class_name": class_name, "date": {"$gte": date_from}, f"entries.{student_id}": {"$exists": True}},
+            {"_id": 0, "date": 1, f"entries.{student_id}.s": 1}
+        ).sort("date", -1)
+        return [
+            {"date": day["date"], "status": day["entries"][student_id]["s"]}
+            async for day in cursor
+        ]
+
+    def records_pipeline(self, match, status=None):
+        """Aggregation stages emitting one {student_id, date, status} per entry"""
+        stages = [
+            {"$match": match},
+            {"$project": {"_id": 0, "date": 1, "entry": {"$objectToArray": "$entries"}}},
+            {"$unwind": "$entry"}
+        ]
+        if status:
+            stages.append({"$match": {"entry.v.s": status}})
+        stages.append({"$project": {"student_id": "$entry.k", "date": 1, "status": "$entry.v.s"}})
+        return stages
+
+    async def export(self):
+        names = None
+        async for day in self.collection.find({}, {"_id": 0}).sort([("class_name", 1), ("date", 1)]):
+            if names is None:
+                names = await self._student_names(await self.db.students.distinct("id"))
+            for student_id, entry in day.get("entries", {}).items():
+                yield self._expand(day, student_id, entry, names.get(student_id))
+
+
+def create_attendance_store(db, layout="per_student"):
+    if layout == "class_day":
+        return ClassDayAttendanceStore(db)
+    if layout == "per_student":
+        return PerStudentAttendanceStore(db)
+    raise ValueError(f"Unknown attendance layout {layout!r}, expected one of {ATTENDANCE_LAYOUTS}")
+
+
+async def migrate_attendance(db, source_layout, target_layout, batch_size=1000):
+    """Copy every record from one layout to the other; safe to re-run.
+
+    Returns (number of records written, [{student_id, date, error}] of those that failed).
+    """
+    source = create_attendance_store(db, source_layout)
+    target = create_attendance_store(db, target_layout)
+    copied = 0
+    failed = []
+
+    async def copy(batch):
+        nonlocal copied
+        _, errors = await target.record(batch)
+        copied += len(batch) - len(errors)
+        failed.extend(
+            {"student_id": batch[index]["student_id"], "date": batch[index]["date"], "error": message}
+            for index, message in sorted(errors.items())
+        )
+
+    batch = []
+    async for record in source.export():
+        batch.append(record)
+        if len(batch) >= batch_size:
+            await copy(batch)
+            batch = []
+    if batch:
+        await copy(batch)
+    return copied, failed
@@ -0,0 +1,134 @@
+"""Hot paths of the API: login, student reads, grades, gradebook, parent dashboard, attendance writes, QR codes, stats."""
+import qr_codes
+from conftest import PARENT_PASSWORD, TEACHER, sundays
+
+
+def bench_teacher_login(benchmark, parish):
+    client = parish["client"]
+    response = benchmark.pedantic(
+        client.post, args=("/api/auth/teacher-login",), kwargs={"json": TEACHER}, rounds=5
+    )
+    assert response.status_code == 200
+
+
+def bench_parent_login(benchmark, parish, student):
+    client = parish["client"]
+    credentials = {"phone": student["parent_phone"], "password": PARENT_PASSWORD}
+    response = benchmark.pedantic(
+        client.post, args=("/api/auth/parent-login",), kwargs={"json": credentials}, rounds=5
+    )
+    assert response.status_code == 200
+
+
+def bench_parent_dashboard(benchmark, parish, parent_headers, student):
+    response = benchmark(
+        parish["client"].get, "/api/parent/dashboard", params={"student_id": student["id"]}, headers=parent_headers
+    )
+    dashboard = response.json()
+    assert dashboard["student"]["id"] == student["id"]
+    assert dashboard["attendance"]["total"] > 0 and dashboard["news"]
+
+
+def bench_get_students_all(benchmark, parish, teacher_headers):
+    response = benchmark(parish["client"].get, "/api/students", headers=teacher_headers)
+    assert len(response.json()) == len(parish["students"])
+
+
+def bench_get_students_page(benchmark, parish, teacher_headers):
+    response = benchmark(parish["client"].get, "/api/students?limit=50", headers=teacher_headers)
+    assert "x-next-cursor" in response.headers
+
+
+def bench_get_students_class(benchmark, parish, teacher_headers):
+    params = {"class_name": parish["class_names"][0]}
+    response = benchmark(parish["client"].get, "/api/students", params=params, headers=teacher_headers)
+    assert response.status_code == 200
+
+
+def bench_get_students_class_cold(benchmark, parish, teacher_headers, invalidate):
+    class_name = parish["class_names"][0]
+    response = benchmark.pedantic(
+        parish["client"].get,
+        args=("/api/students",),
+        kwargs={"params": {"class_name": class_name}, "headers": teacher_headers},
+        setup=lambda: invalidate(f"class:{class_name}"),
+        rounds=20
+    )
+    assert all(row["class_name"] == class_name for row in response.json())
+
+
+def bench_get_students_search(benchmark, parish, teacher_headers):
+    params = {"search": "nguyen an"}
+    response = benchmark(parish["client"].get, "/api/students", params=params, headers=teacher_headers)
+    assert response.json()
+
+
+def bench_get_student_grades(benchmark, parish, teacher_headers, student):
+    response = benchmark(parish["client"].get, f"/api/grades/student/{student['id']}", headers=teacher_headers)
+    assert response.json()["semester_2"] is not None
+
+
+def bench_class_gradebook(benchmark, parish, teacher_headers):
+    class_name = parish["class_names"][0]
+    response = benchmark(parish["client"].get, f"/api/grades/class/{class_name}", headers=teacher_headers)
+    assert response.json()["summary"]["count"] == sum(
+        student["class_name"] == class_name for student in parish["students"]
+    )
+
+
+def bench_update_grades(benchmark, parish, teacher_headers, student):
+    response = benchmark(
+        parish["client"].put,
+        f"/api/grades/student/{student['id']}/semester/1",
+        json={"tx1": 8.5, "gk": 7.0},
+        headers=teacher_headers
+    )
+    assert response.status_code == 200
+
+
+def bench_attendance_single(benchmark, parish, teacher_headers, student):
+    attendance = {"student_id": student["id"], "date": sundays(1)[0], "status": "present"}
+    response = benchmark(parish["client"].post, "/api/attendance", json=attendance, headers=teacher_headers)
+    assert response.status_code == 200
+
+
+def bench_attendance_bulk_class(benchmark, parish, teacher_headers):
+    class_name = parish["class_names"][0]
+    bulk = {
+        "class_name": class_name,
+        "date": sundays(1)[0],
+        "entries": [
+            {"student_id": student["id"], "status": "present"}
+            for student in parish["students"] if student["class_name"] == class_name
+        ]
+    }
+    response = benchmark(parish["client"].post, "/api/attendance/bulk", json=bulk, headers=teacher_headers)
+    assert all(result["result"] in ("created", "updated") for result in response.json()["results"])
+
+
+def bench_scan_qr(benchmark, parish, teacher_headers, student):
+    scan = {"data": qr_codes.student_payload(student)}
+    response = benchmark(parish["client"].post, "/api/scan-qr", json=scan, headers=teacher_headers)
+    assert response.status_code == 200
+
+
+def bench_qr_render(benchmark, student):
+    png = benchmark(qr_codes.render_png, qr_codes.student_payload(student))
+    assert png.startswith(b"\x89PNG")
+
+
+def bench_qr_code_cached(benchmark, parish, teacher_headers, student):
+    response = benchmark(parish["client"].get, f"/api/qr-code/{student['id']}", headers=teacher_headers)
+    assert response.json()["qr_code"].startswith("data:image/png;base64,")
+
+
+def bench_stats_overview_cold(benchmark, parish, invalidate):
+    response = benchmark.pedantic(
+        parish["client"].get, args=("/api/stats/overview",), setup=lambda: invalidate("stats"), rounds=20
+    )
+    assert response.json()["total_students"] == len(parish["students"])
+
+
+def bench_stats_overview_cached(benchmark, parish):
+    response = benchmark(parish["client"].get, "/api/stats/overview")
+    assert response.status_code == 200
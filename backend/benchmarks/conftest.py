@@ -0,0 +1,268 @@
+"""Endpoint benchmarks against an in-memory MongoDB stand-in.
+
+The FastAPI app runs in process through TestClient; its lifespan connects to
+a mongomock-motor client whose database is seeded to parish size
+(PARISH_CLASSES x PARISH_CLASS_SIZE students, two semesters of grades,
+PARISH_SUNDAYS Sundays of attendance). No MongoDB server is needed.
+
+mongomock matches every query by scanning the whole collection, so write
+timings grow with the seeded history; keep PARISH_SUNDAYS identical between
+a baseline and the run compared against it.
+
+From backend/benchmarks:
+
+    pytest --benchmark-save=baseline              # record a JSON baseline
+    pytest --benchmark-compare --benchmark-compare-fail=median:25%
+
+Baselines are written under baselines/<machine>/; compare only against one
+recorded on the same machine. baselines/Linux-CPython-3.11-64bit/0001_baseline.json
+is the reference run of the default configuration (mongo engine, per_student
+attendance, memory cache); re-record it when the benchmarks change.
+
+STORAGE_ENGINE=memory runs the same benchmarks on the in-memory repositories
+instead, timing the handlers without any database layer:
+
+    STORAGE_ENGINE=memory pytest
+
+Repeated reads are served by the app's cache. CACHE_BACKEND=redis runs it
+on the Redis backend against the in-process fakeredis stand-in:
+
+    CACHE_BACKEND=redis pytest
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+os.environ.setdefault("QR_CACHE_DIR", tempfile.mkdtemp(prefix="qr-bench-"))
+# Collection scans and routes over their query budget fail the run
+os.environ.setdefault("QUERY_DEBUG", "1")
+
+import fakeredis  # noqa: E402
+import mongomock.aggregate  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+import cache  # noqa: E402
+import grading  # noqa: E402
+import parent_accounts  # noqa: E402
+import server  # noqa: E402
+from attendance_store import ENTRY_KEYS, create_attendance_store, new_record  # noqa: E402
+
+PARISH_CLASSES = int(os.environ.get("PARISH_CLASSES", "12"))
+PARISH_CLASS_SIZE = int(os.environ.get("PARISH_CLASS_SIZE", "40"))
+PARISH_SUNDAYS = int(os.environ.get("PARISH_SUNDAYS", "4"))
+PARISH_NEWS = int(os.environ.get("PARISH_NEWS", "200"))
+ATTENDANCE_STORAGE = os.environ.get("ATTENDANCE_STORAGE", "per_student")
+
+TEACHER = {"username": "admin", "password": "admin123"}
+PARENT_PASSWORD = "phuly2024"
+
+FAMILY_NAMES = ("Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Vũ", "Đặng", "Bùi", "Đỗ", "Ngô")
+MIDDLE_NAMES = ("Văn", "Thị", "Minh", "Thanh", "Ngọc", "Đức")
+GIVEN_NAMES = ("An", "Bình", "Cường", "Dung", "Em", "Giang", "Hà", "Khánh", "Linh", "Phúc", "Quân", "Thảo")
+
+
+def _union_with(in_collection, database, options):
+    # mongomock has no $unionWith; the overview stats pipeline needs it
+    if isinstance(options, str):
+        options = {"coll": options}
+    documents = list(database[options["coll"]].find())
+    pipeline = options.get("pipeline", [])
+    return list(in_collection) + list(mongomock.aggregate.process_pipeline(documents, database, pipeline, None))
+
+
+mongomock.aggregate._PIPELINE_HANDLERS.setdefault("$unionWith", _union_with)
+
+
+def class_names():
+    return [f"Lớp {number // 2 + 1}{'AB'[number % 2]}" for number in range(PARISH_CLASSES)]
+
+
+def sundays(count):
+    last = date.today() - timedelta(days=(date.today().weekday() + 1) % 7)
+    return [(last - timedelta(weeks=week)).isoformat() for week in range(count)][::-1]
+
+
+async def build_parish():
+    """Documents of every collection, keyed by collection name"""
+    admin_hash = await server.passwords.hash(TEACHER["password"])
+    parent_hash = await server.passwords.hash(PARENT_PASSWORD)
+    users = [server.User(
+        username=TEACHER["username"], password_hash=admin_hash, full_name="Quản Trị Viên", role="admin"
+    ).dict()]
+
+    students = []
+    for class_number, class_name in enumerate(class_names()):
+        for seat in range(PARISH_CLASS_SIZE):
+            number = class_number * PARISH_CLASS_SIZE + seat
+            name = " ".join((
+                FAMILY_NAMES[number % len(FAMILY_NAMES)],
+                MIDDLE_NAMES[number // len(FAMILY_NAMES) % len(MIDDLE_NAMES)],
+                GIVEN_NAMES[number % len(GIVEN_NAMES)]
+            ))
+            # One family in three sends two children
+            family = number - 1 if number % 6 == 1 else number
+            students.append(server.Student(
+                name=name,
+                class_name=class_name,
+                parent_name=f"{FAMILY_NAMES[number % len(FAMILY_NAMES)]} Văn Phụ Huynh",
+                parent_phone=f"09{family:08d}"
+            ))
+
+    accounts = {}
+    for student in students:
+        account = accounts.setdefault(
+            student.parent_phone,
+            parent_accounts.new_account(student.parent_phone, student.parent_name, parent_hash)
+        )
+        account.setdefault("student_ids", []).append(student.id)
+
+    # Built in Python and inserted in bulk: mongomock has no indexes, so
+    # seeding through per-document upserts would take minutes
+    grades = []
+    for number, student in enumerate(students):
+        records = []
+        for semester in (1, 2):
+            scores = {
+                field: float(5 + (number * 7 + offset * 3 + semester) % 6)
+                for offset, field in enumerate(grading.SCORE_FIELDS)
+            }
+            records.append(server.Grade(
+                student_id=student.id, student_name=student.name, class_name=student.class_name,
+                semester=semester, **scores
+            ).dict())
+        result = grading.compute_result(*records)
+        for record in records:
+            record.update(
+                semester_average=result[f"semester_{record['semester']}_average"],
+                final_average=result["final_average"],
+                status=result["status"]
+            )
+        grades.extend(records)
+
+    statuses = ("present",) * 8 + ("absent_with_permission", "absent_without_permission")
+    attendance = [
+        new_record(student.dict(), day, statuses[(number + day_number) % len(statuses)], "manual", None, "admin")
+        for day_number, day in enumerate(sundays(PARISH_SUNDAYS))
+        for number, student in enumerate(students)
+    ]
+
+    now = datetime.utcnow()
+    news = [
+        server.News(
+            title=f"Thông báo số {number}", content="Giáo Xứ Phú Lý thông báo lịch sinh hoạt. " * 10,
+            author="Ban Tổ chức", created_at=now - timedelta(hours=number)
+        ).dict()
+        for number in range(PARISH_NEWS)
+    ]
+    return {
+        "users": users,
+        "students": [server.student_document(student) for student in students],
+        "parent_accounts": list(accounts.values()),
+        "grades": grades,
+        "attendance": attendance,
+        "news": news
+    }
+
+
+async def seed(db, documents):
+    """Bulk insert into the mongomock database, in the configured attendance layout"""
+    for collection in ("users", "students", "parent_accounts", "grades", "news"):
+        await db[collection].insert_many([dict(document) for document in documents[collection]])
+
+    store = create_attendance_store(db, ATTENDANCE_STORAGE)
+    if store.collection_name == "attendance_days":
+        days = {}
+        for record in documents["attendance"]:
+            day = days.setdefault((record["class_name"], record["date"]), {
+                "class_name": record["class_name"], "date": record["date"], "entries": {}
+            })
+            day["entries"][record["student_id"]] = {key: record[field] for field, key in ENTRY_KEYS.items()}
+        await store.collection.insert_many(list(days.values()))
+    else:
+        await store.collection.insert_many([{"id": str(uuid.uuid4()), **record} for record in documents["attendance"]])
+
+
+async def seed_repositories(repositories, documents):
+    """Load the in-memory repositories through their public methods"""
+    for user in documents["users"]:
+        await repositories.users.insert(user)
+    for student in documents["students"]:
+        await repositories.students.insert(student)
+    for account in documents["parent_accounts"]:
+        await repositories.users.add_parent_account(account)
+    await repositories.grades.insert_many(documents["grades"])
+    await repositories.attendance.record(documents["attendance"])
+    for news in documents["news"]:
+        await repositories.news.insert(news)
+
+
+@pytest.fixture(scope="session")
+def parish():
+    """Seeded app client; the storage is shared by every benchmark in the session"""
+    documents = asyncio.run(build_parish())
+    students = sorted(
+        (dict(student) for student in documents["students"]),
+        key=lambda student: tuple(student[field] for field, _ in server.STUDENT_SORT)
+    )
+    if server.STORAGE_ENGINE == "mongo":
+        mock_client = AsyncMongoMockClient()
+        asyncio.run(seed(mock_client[os.environ["DB_NAME"]], documents))
+        # The app lifespan connects through this factory
+        server.create_mongo_client = lambda: mock_client
+    if os.environ.get("CACHE_BACKEND") == "redis":
+        cache.create_redis_client = lambda: fakeredis.FakeAsyncRedis()
+
+    with TestClient(server.app) as client:
+        if server.STORAGE_ENGINE == "memory":
+            asyncio.run(seed_repositories(server.app.state.repositories, documents))
+        yield {"client": client, "students": students, "class_names": class_names()}
+
+
+@pytest.fixture(autouse=True)
+def query_violations():
+    """Fail a benchmark whose requests scanned a collection or exceeded a query budget"""
+    if not server.query_debugger:
+        yield
+        return
+    seen = len(server.query_debugger.violations)
+    yield
+    new = server.query_debugger.violations[seen:]
+    assert not new, "\n".join(new)
+
+
+@pytest.fixture(scope="session")
+def teacher_headers(parish):
+    response = parish["client"].post("/api/auth/teacher-login", json=TEACHER)
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture(scope="session")
+def invalidate(parish):
+    """invalidate(*tags) on the app's cache, run on the app's event loop"""
+    def invalidate(*tags):
+        parish["client"].portal.call(server.cache.invalidate, *tags)
+    return invalidate
+
+
+@pytest.fixture
+def student(parish):
+    return parish["students"][len(parish["students"]) // 2]
+
+
+@pytest.fixture(scope="session")
+def parent_headers(parish):
+    """Token of the parent of the middle student"""
+    student = parish["students"][len(parish["students"]) // 2]
+    credentials = {"phone": student["parent_phone"], "password": PARENT_PASSWORD}
+    response = parish["client"].post("/api/auth/parent-login", json=credentials)
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
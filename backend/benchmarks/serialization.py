@@ -0,0 +1,72 @@
+"""Per-row serialization cost of the student list, before and after the shared read layer.
+
+before: whole documents, `_id` deleted in a loop, each row validated into the
+Pydantic model and encoded by FastAPI's jsonable_encoder + json.dumps.
+after: projected dicts serialized directly by orjson (read_layer.dumps).
+
+Run from backend/: python benchmarks/serialization.py [rows]
+"""
+import json
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from bson import ObjectId  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+import read_layer  # noqa: E402
+import search  # noqa: E402
+from server import Student  # noqa: E402
+
+
+def stored_student(number):
+    student = {
+        "_id": ObjectId(),
+        "id": str(uuid.uuid4()),
+        "name": f"Nguyễn Văn Học Sinh {number}",
+        "class_name": f"Lớp {number % 12 + 1}A",
+        "birth_date": "2015-03-19",
+        "parent_name": f"Nguyễn Văn Phụ Huynh {number}",
+        "parent_phone": f"09{number:08d}",
+        "address": "Giáo xứ Phú Lý",
+        "created_at": datetime.utcnow()
+    }
+    student["search_key"] = search.build_search_key(student)
+    return student
+
+
+def before(documents):
+    rows = []
+    for document in documents:
+        document = dict(document)
+        if "_id" in document:
+            del document["_id"]
+        rows.append(Student(**document))
+    return json.dumps(jsonable_encoder(rows), ensure_ascii=False).encode()
+
+
+def after(documents):
+    # What Mongo returns for read_layer.projection(STUDENT_DEFAULT_FIELDS)
+    return read_layer.dumps(documents)
+
+
+def main(rows=1000, repeat=5):
+    stored = [stored_student(number) for number in range(rows)]
+    projected = [
+        {field: document[field] for field in read_layer.STUDENT_DEFAULT_FIELDS}
+        for document in stored
+    ]
+    for name, fn, documents in (("before", before, stored), ("after", after, projected)):
+        best = min(timeit.repeat(lambda: fn(documents), number=1, repeat=repeat))
+        print(f"{name:>6}: {best * 1e6 / rows:8.2f} µs/row  ({best * 1e3:.1f} ms for {rows} rows)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
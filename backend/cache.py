@@ -0,0 +1,274 @@
+"""Shared read cache with tag-based invalidation.
+
+Cached values are tagged (e.g. "class:Lớp 1A", "student:<id>") and a write
+invalidates the tags it affects. Every tag has a version token; an entry
+records the tokens of its tags when it was loaded and is a miss once any of
+them changed. Entry and tokens are read in one round trip, an invalidation
+writes fresh random tokens in one pipelined round trip, and a load that
+raced with an invalidation is stored under the old tokens, so it is never
+served. Tokens expire after CACHE_TAG_TTL (a day), longer than any entry
+lives, and are never reused, so an expired token cannot revive an entry.
+
+Backends (CACHE_BACKEND):
+
+    memory  this process only, the default for a single worker; at most
+            CACHE_MAX_ENTRIES (10000) entries, least recently used first out
+    redis   shared by every worker through REDIS_URL (any Redis-protocol
+            server); tests use the in-process fakeredis stand-in. Under
+            memory pressure Redis must evict entries before tokens, e.g.
+            with maxmemory-policy volatile-ttl
+
+Values are stored as JSON, so datetimes come back as ISO strings and bytes
+are not accepted. A backend failure is logged and the value loaded directly;
+it never fails the request.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKENDS = ("memory", "redis")
+
+
+def class_tag(class_name):
+    """Tag of values derived from a class: its roster and gradebook"""
+    return f"class:{class_name}"
+
+
+def student_tag(student_id):
+    return f"student:{student_id}"
+
+
+class CacheBackend(ABC):
+    """Key-value primitives a Cache needs, as found in the Redis protocol"""
+
+    @abstractmethod
+    async def get_many(self, keys):
+        """Values of `keys` in order, None for missing or expired ones"""
+
+    @abstractmethod
+    async def set(self, key, value, ttl=None):
+        """Store `value` for `ttl` seconds; without a ttl only replace an existing value, keeping its expiry"""
+
+    @abstractmethod
+    async def set_tokens(self, keys, ttl):
+        """Give each key a new, never used value for `ttl` seconds; tokens are not evicted before they expire"""
+
+    async def close(self):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Values bounded to `max_entries`, least recently used evicted first.
+
+    Expired values and tokens are swept on writes at most every
+    `sweep_interval` seconds, so keys that are never read again do not
+    accumulate.
+    """
+
+    def __init__(self, max_entries=10000, sweep_interval=60.0):
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._values = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._tokens = {}  # key -> (expires_at, token)
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def _get(self, key):
+        now = time.monotonic()
+        for store in (self._values, self._tokens):
+            entry = store.get(key)
+            if entry is None:
+                continue
+            if entry[0] <= now:
+                del store[key]
+                return None
+            if store is self._values:
+                self._values.move_to_end(key)
+            return entry[1]
+        return None
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now >= self._next_sweep or len(self._values) > self.max_entries:
+            for store in (self._values, self._tokens):
+                for key in [key for key, (expires_at, _) in store.items() if expires_at <= now]:
+                    del store[key]
+            self._next_sweep = now + self.sweep_interval
+        while len(self._values) > self.max_entries:
+            self._values.popitem(last=False)
+
+    def __len__(self):
+        return len(self._values) + len(self._tokens)
+
+    async def get_many(self, keys):
+        return [self._get(key) for key in keys]
+
+    async def set(self, key, value, ttl=None):
+        if ttl is not None:
+            self._values[key] = (time.monotonic() + ttl, value)
+            self._values.move_to_end(key)
+        elif self._get(key) is not None:
+            self._values[key] = (self._values[key][0], value)
+        self._sweep()
+
+    async def set_tokens(self, keys, ttl):
+        expires_at = time.monotonic() + ttl
+        for key in keys:
+            self._tokens[key] = (expires_at, uuid.uuid4().hex)
+        self._sweep()
+
+
+class RedisCacheBackend(CacheBackend):
+    """Backend over a redis.asyncio client (or a fakeredis one in tests)"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def get_many(self, keys):
+        return await self.client.mget(keys)
+
+    async def set(self, key, value, ttl=None):
+        if ttl is None:
+            await self.client.set(key, value, xx=True, keepttl=True)
+        else:
+            await self.client.set(key, value, px=max(int(ttl * 1000), 1))
+
+    async def set_tokens(self, keys, ttl):
+        async with self.client.pipeline(transaction=False) as pipeline:
+            for key in keys:
+                pipeline.set(key, uuid.uuid4().hex, px=max(int(ttl * 1000), 1))
+            await pipeline.execute()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class Cache:
+    """Tagged loader cache over a CacheBackend.
+
+    Concurrent misses for the same key in this process share one load.
+    invalidate() also detaches in-flight loads of the affected tags, so a
+    request made after a write never joins a read that started before it.
+    """
+
+    def __init__(self, backend, prefix="", ttl=60.0, tag_ttl=86400.0):
+        self.backend = backend
+        self.prefix = prefix
+        self.ttl = ttl
+        self.tag_ttl = tag_ttl
+        self._loading = {}  # key -> (task loading it, its tags)
+
+    def _entry_key(self, key):
+        return f"{self.prefix}entry:{key}"
+
+    def _tag_keys(self, tags):
+        return [f"{self.prefix}tag:{tag}" for tag in tags]
+
+    async def _read(self, key, tags):
+        """(cached value or None, whether it was found, current tag tokens)"""
+        values = await self.backend.get_many([self._entry_key(key), *self._tag_keys(tags)])
+        versions = [version.decode() if isinstance(version, bytes) else version for version in values[1:]]
+        if values[0] is not None:
+            entry = orjson.loads(values[0])
+            if entry["versions"] == versions:
+                return entry["value"], True, versions
+        return None, False, versions
+
+    async def _write(self, key, value, versions, ttl=None):
+        entry = orjson.dumps({"versions": versions, "value": value})
+        await self.backend.set(self._entry_key(key), entry, ttl)
+
+    async def get_or_load(self, key, loader, tags=(), ttl=None):
+        """Cached value of `key`, else the loader's result, stored unless it is None"""
+        tags = tuple(tags)
+        try:
+            value, found, versions = await self._read(key, tags)
+        except Exception:
+            logger.warning("Cache read of %s failed, loading directly", key, exc_info=True)
+            return await loader()
+        if found:
+            return value
+
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = (asyncio.ensure_future(self._load(key, loader, versions, ttl)), tags)
+            self._loading[key] = loading
+        # Shielded so a cancelled caller does not cancel the shared load
+        return await asyncio.shield(loading[0])
+
+    async def _load(self, key, loader, versions, ttl):
+        try:
+            value = await loader()
+            if value is not None:
+                try:
+                    # Entries never outlive their tokens, see the module docstring
+                    await self._write(key, value, versions, min(ttl or self.ttl, self.tag_ttl))
+                except Exception:
+                    logger.warning("Cache write of %s failed", key, exc_info=True)
+            return value
+        finally:
+            loading = self._loading.get(key)
+            if loading and loading[0] is asyncio.current_task():
+                del self._loading[key]
+
+    async def update(self, key, change, tags=()):
+        """Store change(value) in place of reloading a cached value; no-op on a miss.
+
+        The entry keeps its expiry. Not atomic across workers: a concurrent
+        update can be lost until the entry expires, so only use it for
+        approximate values such as counters.
+        """
+        tags = tuple(tags)
+        try:
+            value, found, versions = await self._read(key, tags)
+            if found:
+                await self._write(key, change(value), versions)
+        except Exception:
+            logger.warning("Cache update of %s failed", key, exc_info=True)
+
+    async def invalidate(self, *tags):
+        """Make every entry tagged with any of `tags` a miss, in every process sharing the backend"""
+        tags = set(tags)
+        if not tags:
+            return
+        for key, (_, loading_tags) in list(self._loading.items()):
+            if tags.intersection(loading_tags):
+                del self._loading[key]
+        try:
+            await self.backend.set_tokens(self._tag_keys(sorted(tags)), self.tag_ttl)
+        except Exception:
+            logger.error("Cache invalidation of %s failed, entries expire with their TTL", sorted(tags), exc_info=True)
+
+    async def close(self):
+        await self.backend.close()
+
+
+def create_redis_client():
+    # Imported here so the redis package is only needed with CACHE_BACKEND=redis
+    import redis.asyncio
+    return redis.asyncio.from_url(os.environ["REDIS_URL"])
+
+
+def create_cache():
+    """Cache configured by CACHE_BACKEND, CACHE_PREFIX, CACHE_TTL (seconds, default 60),
+    CACHE_TAG_TTL (seconds, default 86400) and CACHE_MAX_ENTRIES"""
+    backend_name = os.environ.get("CACHE_BACKEND", "memory")
+    if backend_name not in CACHE_BACKENDS:
+        raise ValueError(f"Unknown CACHE_BACKEND {backend_name!r}, expected one of {CACHE_BACKENDS}")
+    if backend_name == "redis":
+        backend = RedisCacheBackend(create_redis_client())
+    else:
+        backend = MemoryCacheBackend(max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", "10000")))
+    return Cache(
+        backend,
+        prefix=os.environ.get("CACHE_PREFIX", "giaoxu:"),
+        ttl=float(os.environ.get("CACHE_TTL", "60")),
+        tag_ttl=float(os.environ.get("CACHE_TAG_TTL", "86400"))
+    )
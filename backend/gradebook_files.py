@@ -0,0 +1,220 @@
+"""Gradebook spreadsheets: streaming CSV/XLSX export and sheet import.
+
+Exports are written row by row while the Motor cursor is read, so memory
+stays flat however many grade records are exported. The XLSX writer emits a
+minimal SpreadsheetML package through a non-seekable zip stream instead of
+building an openpyxl workbook. Imports are parsed with pandas (openpyxl for
+.xlsx) and validated column-wise before any write.
+"""
+import csv
+import io
+import zipfile
+from xml.sax.saxutils import escape
+
+import pandas as pd
+
+from grading import SCORE_FIELDS
+
+EXPORT_COLUMNS = ("student_id", "student_name", "class_name", "year", "semester", *SCORE_FIELDS, "semester_average")
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+}
+MAX_IMPORT_ROWS = 5000
+MAX_IMPORT_BYTES = 5 * 1024 * 1024
+MIN_SCORE = 0
+MAX_SCORE = 10
+
+
+class _Chunks:
+    """Write-only file object collecting bytes until they are drained"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _cell_value(value):
+    return "" if value is None else value
+
+
+async def csv_chunks(records, batch_size=500):
+    """CSV bytes of EXPORT_COLUMNS, one chunk per batch of records"""
+    buffer = io.StringIO()
+    # Byte order mark first so Excel opens the Vietnamese names as UTF-8
+    buffer.write("\ufeff")
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    rows = 0
+    async for record in records:
+        writer.writerow([_cell_value(record.get(column)) for column in EXPORT_COLUMNS])
+        rows += 1
+        if rows % batch_size == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Grades" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    )
+}
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if value is None:
+            cells.append("<c/>")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f"<c><v>{value}</v></c>")
+        else:
+            cells.append(f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>')
+    return f"<row>{''.join(cells)}</row>"
+
+
+async def xlsx_chunks(records, batch_size=500):
+    """XLSX bytes of EXPORT_COLUMNS, streamed as the zip is written"""
+    output = _Chunks()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as package:
+        for name, xml in XLSX_PARTS.items():
+            package.writestr(name, xml)
+        with package.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(EXPORT_COLUMNS).encode())
+            rows = 0
+            async for record in records:
+                sheet.write(_xlsx_row([record.get(column) for column in EXPORT_COLUMNS]).encode())
+                rows += 1
+                if rows % batch_size == 0:
+                    yield output.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield output.drain()
+
+
+def export_chunks(records, export_format):
+    return xlsx_chunks(records) if export_format == "xlsx" else csv_chunks(records)
+
+
+def read_sheet(content, filename):
+    """DataFrame of an uploaded .csv or .xlsx sheet, every cell as text"""
+    if filename.lower().endswith(".csv"):
+        frame = pd.read_csv(io.BytesIO(content), dtype=str, encoding="utf-8-sig")
+    else:
+        frame = pd.read_excel(io.BytesIO(content), dtype=str, engine="openpyxl")
+    frame.columns = [str(column).strip().lower() for column in frame.columns]
+    return frame.dropna(how="all")
+
+
+def validate_rows(frame, year):
+    """Validate a sheet imported into `year` column by column.
+
+    Returns (rows, errors): rows are {row, student_id, semester, class_name,
+    scores} for valid lines, errors are {row, student_id, error}. Row numbers
+    match the spreadsheet, counting the header as row 1. Blank score cells
+    are left unchanged on import. A filled year cell must be `year`, so an
+    old export cannot overwrite the grades of another year; class_name is
+    the filled class cell or None, for the caller to check.
+    """
+    missing = [column for column in ("student_id", "semester") if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    if len(frame) > MAX_IMPORT_ROWS:
+        raise ValueError(f"At most {MAX_IMPORT_ROWS} rows can be imported at once")
+
+    problems = pd.DataFrame(index=frame.index)
+    student_ids = frame["student_id"].fillna("").str.strip()
+    problems["student_id"] = (student_ids == "").map({True: "student_id is required", False: None})
+
+    semesters = pd.to_numeric(frame["semester"], errors="coerce")
+    problems["semester"] = (~semesters.isin([1, 2])).map({True: "semester must be 1 or 2", False: None})
+
+    if "year" in frame.columns:
+        years = frame["year"].fillna("").str.strip()
+        other_year = (years != "") & (years != year)
+        problems["year"] = None
+        problems.loc[other_year, "year"] = "year is " + years[other_year] + ", not the imported year " + year
+
+    if "class_name" in frame.columns:
+        class_names = frame["class_name"].fillna("").str.strip()
+    else:
+        class_names = pd.Series("", index=frame.index)
+
+    scores = pd.DataFrame(index=frame.index)
+    for field in SCORE_FIELDS:
+        if field not in frame.columns:
+            continue
+        text = frame[field].fillna("").str.strip().str.replace(",", ".", regex=False)
+        values = pd.to_numeric(text, errors="coerce")
+        not_number = (text != "") & values.isna()
+        out_of_range = values.notna() & ((values < MIN_SCORE) | (values > MAX_SCORE))
+        problems[field] = None
+        problems.loc[not_number, field] = f"{field} is not a number"
+        problems.loc[out_of_range, field] = f"{field} must be between {MIN_SCORE} and {MAX_SCORE}"
+        scores[field] = values
+
+    # A later line for the same student and semester would silently win
+    duplicated = pd.DataFrame({"student_id": student_ids, "semester": semesters}).duplicated()
+    problems["duplicate"] = duplicated.map({True: "duplicate student_id and semester", False: None})
+
+    rows, errors = [], []
+    for index in frame.index:
+        row_number = index + 2
+        messages = [message for message in problems.loc[index] if isinstance(message, str)]
+        if messages:
+            errors.append({"row": row_number, "student_id": student_ids[index], "error": "; ".join(messages)})
+            continue
+        row_scores = {field: float(value) for field, value in scores.loc[index].items() if pd.notna(value)}
+        rows.append({
+            "row": row_number,
+            "student_id": student_ids[index],
+            "semester": int(semesters[index]),
+            "class_name": class_names[index] or None,
+            "scores": row_scores
+        })
+    return rows, errors
@@ -0,0 +1,211 @@
+"""Grading formula: semester averages, final average and promotion status.
+
+Results are materialized on the grade records (semester_average,
+final_average, status) whenever grades are written; run
+`python manage.py recompute-averages` after changing the formula or the
+PASS_THRESHOLD setting.
+"""
+import os
+
+import pandas as pd
+from pymongo import UpdateOne
+
+TX_FIELDS = ("tx1", "tx2", "tx3", "tx4")
+SCORE_FIELDS = (*TX_FIELDS, "gk", "ck")
+STATUS_PASSED = "Lên lớp"
+STATUS_FAILED = "Học lại"
+
+
+def pass_threshold():
+    return float(os.environ.get("PASS_THRESHOLD", "6.5"))
+
+
+def semester_average(grade_record):
+    """(TX average + GK*2 + CK*3) / 6, counting only the scores entered so far"""
+    if not grade_record:
+        return 0
+
+    scores = [grade_record.get(tx) for tx in TX_FIELDS if grade_record.get(tx) is not None]
+    gk = grade_record.get("gk")
+    ck = grade_record.get("ck")
+
+    if not scores and not gk and not ck:
+        return 0
+
+    total_weight = 0
+    total_score = 0
+
+    if scores:
+        total_score += sum(scores) / len(scores)
+        total_weight += 1
+
+    if gk is not None:
+        total_score += gk * 2
+        total_weight += 2
+
+    if ck is not None:
+        total_score += ck * 3
+        total_weight += 3
+
+    return total_score / total_weight if total_weight > 0 else 0
+
+
+def final_average(sem1_avg, sem2_avg):
+    """Mean of both semesters once both have scores, otherwise the one available"""
+    if sem1_avg > 0 and sem2_avg > 0:
+        return (sem1_avg + sem2_avg) / 2
+    return max(sem1_avg, sem2_avg)
+
+
+def promotion_status(final_avg):
+    return STATUS_PASSED if final_avg >= pass_threshold() else STATUS_FAILED
+
+
+def compute_result(semester_1, semester_2):
+    """Averages and status of one student computed from the raw scores"""
+    sem1_avg = semester_average(semester_1)
+    sem2_avg = semester_average(semester_2)
+    final_avg = final_average(sem1_avg, sem2_avg)
+    return {
+        "semester_1_average": round(sem1_avg, 2),
+        "semester_2_average": round(sem2_avg, 2),
+        "final_average": round(final_avg, 2),
+        "status": promotion_status(final_avg)
+    }
+
+
+def student_result(semester_1, semester_2):
+    """Averages and status of one student, read from the materialized fields.
+
+    Falls back to computing them for records written before materialization.
+    """
+    records = [record for record in (semester_1, semester_2) if record]
+    if not records or not all("final_average" in record for record in records):
+        return compute_result(semester_1, semester_2)
+    return {
+        "semester_1_average": semester_1["semester_average"] if semester_1 else 0,
+        "semester_2_average": semester_2["semester_average"] if semester_2 else 0,
+        "final_average": records[0]["final_average"],
+        "status": records[0]["status"]
+    }
+
+
+def average_fields(grade_records):
+    """(semester, materialized fields) for each of one student's grade records"""
+    by_semester = {record["semester"]: record for record in grade_records}
+    result = compute_result(by_semester.get(1), by_semester.get(2))
+    return [
+        (record["semester"], {
+            "semester_average": result[f"semester_{record['semester']}_average"],
+            "final_average": result["final_average"],
+            "status": result["status"]
+        })
+        for record in grade_records
+        if record["semester"] in (1, 2)
+    ]
+
+
+def average_updates(grade_records):
+    """UpdateOne operations that materialize averages on one student's grade records of one year"""
+    student_id = grade_records[0]["student_id"]
+    year = grade_records[0].get("year")
+    return [
+        UpdateOne({"student_id": student_id, "year": year, "semester": semester}, {"$set": fields})
+        for semester, fields in average_fields(grade_records)
+    ]
+
+
+def records_by_student_year(grade_records):
+    """Grade records grouped by (student_id, year); the averages never mix years"""
+    groups = {}
+    for record in grade_records:
+        groups.setdefault((record["student_id"], record.get("year")), []).append(record)
+    return groups
+
+
+async def recompute_averages(db, student_ids, year=None):
+    """Recompute and store averages for the given students, of one year or all, in one read and one write"""
+    query = {"student_id": {"$in": list(student_ids)}}
+    if year:
+        query["year"] = year
+    groups = records_by_student_year(await db.grades.find(query, {"_id": 0}).to_list(None))
+
+    operations = []
+    for grade_records in groups.values():
+        operations.extend(average_updates(grade_records))
+    if operations:
+        await db.grades.bulk_write(operations, ordered=False)
+    return len({student_id for student_id, _ in groups})
+
+
+async def backfill_averages(db, batch_size=500):
+    """Recompute stored averages for every student; returns the number of students"""
+    student_ids = await db.grades.distinct("student_id")
+    for start in range(0, len(student_ids), batch_size):
+        await recompute_averages(db, student_ids[start:start + batch_size])
+    return len(student_ids)
+
+
+def semester_average_frame(frame):
+    """Vectorized semester_average over a DataFrame with one grade record per row"""
+    tx = frame[list(TX_FIELDS)]
+    has_tx = tx.notna().any(axis=1)
+    gk = frame["gk"]
+    ck = frame["ck"]
+
+    total_score = tx.mean(axis=1).where(has_tx, 0) + gk.fillna(0) * 2 + ck.fillna(0) * 3
+    total_weight = has_tx * 1 + gk.notna() * 2 + ck.notna() * 3
+    return (total_score / total_weight.where(total_weight > 0)).fillna(0)
+
+
+def class_gradebook(grade_records, semester=None):
+    """Column-oriented gradebook of a class: averages, rank, percentile and status.
+
+    With a semester the ranking uses that semester's average, otherwise the
+    final average of the year.
+    """
+    frame = pd.DataFrame(grade_records, columns=["student_id", "student_name", "semester", *SCORE_FIELDS])
+    frame[list(SCORE_FIELDS)] = frame[list(SCORE_FIELDS)].astype(float)
+    frame["average"] = semester_average_frame(frame)
+
+    names = frame.groupby("student_id")["student_name"].first()
+    by_semester = frame.pivot_table(index="student_id", columns="semester", values="average", aggfunc="first")
+    by_semester = by_semester.reindex(index=names.index, columns=[1, 2])
+
+    table = pd.DataFrame({"student_name": names})
+    if semester:
+        table["average"] = by_semester[semester]
+        table = table.dropna(subset=["average"])
+    else:
+        sem1 = by_semester[1].fillna(0)
+        sem2 = by_semester[2].fillna(0)
+        table["semester_1_average"] = sem1
+        table["semester_2_average"] = sem2
+        table["average"] = ((sem1 + sem2) / 2).where((sem1 > 0) & (sem2 > 0), sem1.where(sem1 >= sem2, sem2))
+
+    passed = table["average"] >= pass_threshold()
+    table["rank"] = table["average"].rank(ascending=False, method="min")
+    table["percentile"] = table["average"].rank(pct=True, method="max") * 100
+    table["status"] = passed.map({True: STATUS_PASSED, False: STATUS_FAILED})
+    table = table.sort_values(["rank", "student_name"]).reset_index()
+
+    columns = {
+        "student_id": table["student_id"].tolist(),
+        "student_name": table["student_name"].tolist(),
+    }
+    for column in ("semester_1_average", "semester_2_average", "average", "percentile"):
+        if column in table:
+            columns[column] = table[column].round(2).tolist()
+    columns["rank"] = table["rank"].astype(int).tolist()
+    columns["status"] = table["status"].tolist()
+
+    return {
+        "columns": columns,
+        "summary": {
+            "count": len(table),
+            "passed": int(passed.sum()),
+            "failed": int((~passed).sum()),
+            "mean": round(float(table["average"].mean()), 2) if len(table) else 0,
+            "median": round(float(table["average"].median()), 2) if len(table) else 0
+        }
+    }
@@ -0,0 +1,124 @@
+"""MongoDB index declarations, applied once at application startup."""
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# collection name -> indexes that must exist on it
+INDEXES = {
+    "students": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Roster filter and keyset pagination order of GET /api/students
+        IndexModel(
+            [("class_name", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)],
+            name="class_name_name_id",
+        ),
+        IndexModel([("parent_phone", ASCENDING)], name="parent_phone"),
+        # Anchored prefix search over folded name/class/parent tokens
+        IndexModel([("search_key", ASCENDING)], name="search_key"),
+    ],
+    "grades": [
+        # One grade record per student per year and semester; makes upserts race-free
+        IndexModel(
+            [("student_id", ASCENDING), ("year", ASCENDING), ("semester", ASCENDING)],
+            name="student_year_semester_unique",
+            unique=True,
+        ),
+        # Whole-class gradebook
+        IndexModel(
+            [("class_name", ASCENDING), ("year", ASCENDING), ("semester", ASCENDING)],
+            name="class_year_semester",
+        ),
+    ],
+    "attendance": [
+        # One attendance record per student per day
+        IndexModel(
+            [("student_id", ASCENDING), ("date", ASCENDING)],
+            name="student_date_unique",
+            unique=True,
+        ),
+        IndexModel([("class_name", ASCENDING), ("date", ASCENDING)], name="class_date"),
+        # Today's count in the overview stats
+        IndexModel([("date", ASCENDING), ("status", ASCENDING)], name="date_status"),
+    ],
+    # Compact layout (ATTENDANCE_STORAGE=class_day): one document per class per day
+    "attendance_days": [
+        IndexModel(
+            [("class_name", ASCENDING), ("date", ASCENDING)],
+            name="class_date_unique",
+            unique=True,
+        ),
+        IndexModel([("date", ASCENDING)], name="date"),
+    ],
+    "news": [
+        # Public feed: published items, newest first
+        IndexModel(
+            [("published", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="published_created_at_id",
+        ),
+    ],
+    "parent_accounts": [
+        IndexModel([("phone", ASCENDING)], name="phone_unique", unique=True),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+    ],
+    # Closed academic years (academic_years.py), keyed like their live collections
+    "grades_archive": [
+        IndexModel(
+            [("student_id", ASCENDING), ("year", ASCENDING), ("semester", ASCENDING)],
+            name="student_year_semester_unique",
+            unique=True,
+        ),
+        IndexModel(
+            [("class_name", ASCENDING), ("year", ASCENDING), ("semester", ASCENDING)],
+            name="class_year_semester",
+        ),
+    ],
+    "attendance_archive": [
+        IndexModel(
+            [("student_id", ASCENDING), ("date", ASCENDING)],
+            name="student_date_unique",
+            unique=True,
+        ),
+        IndexModel([("class_name", ASCENDING), ("date", ASCENDING)], name="class_date"),
+    ],
+    "attendance_days_archive": [
+        IndexModel(
+            [("class_name", ASCENDING), ("date", ASCENDING)],
+            name="class_date_unique",
+            unique=True,
+        ),
+    ],
+    # Student changes waiting for propagation, claimed oldest first
+    "student_outbox": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("available_at", ASCENDING)], name="available_at"),
+    ],
+}
+
+# collection name -> indexes replaced by a declaration above, dropped at startup
+RETIRED_INDEXES = {
+    # Unique per student and semester only, which blocks a second academic year
+    "grades": ["student_semester_unique"],
+}
+
+
+async def ensure_indexes(db):
+    """Drop retired indexes and create every declared one; existing indexes are left untouched.
+
+    A failure on one collection (e.g. duplicate rows blocking a unique index)
+    is logged and does not prevent the application from starting.
+    """
+    for collection_name, index_names in RETIRED_INDEXES.items():
+        existing = await db[collection_name].index_information()
+        for index_name in index_names:
+            if index_name in existing:
+                await db[collection_name].drop_index(index_name)
+    for collection_name, indexes in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            logger.error("Could not create indexes on %s: %s", collection_name, e)
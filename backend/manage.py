@@ -0,0 +1,141 @@
+"""Maintenance commands, run from the backend directory: python manage.py --help"""
+import asyncio
+import os
+from pathlib import Path
+
+import typer
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import academic_years
+import attendance_store
+import grading
+import parent_accounts
+import propagation
+import search
+from cache import create_cache
+from passwords import PasswordService
+from repositories import MotorRepositories
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+cli = typer.Typer()
+
+
+def run(task):
+    """Run an async task against the configured database"""
+    async def main():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            return await task(client[os.environ['DB_NAME']])
+        finally:
+            client.close()
+    return asyncio.run(main())
+
+
+async def drain_propagation(repositories):
+    """Process every queued student change, invalidating the app's cache (CACHE_BACKEND=redis)"""
+    cache = create_cache()
+    try:
+        return await propagation.PropagationWorker(repositories, cache=cache).drain()
+    finally:
+        await cache.close()
+
+
+@cli.callback()
+def main():
+    """Giáo Xứ Phú Lý - maintenance commands"""
+
+
+@cli.command()
+def backfill_search_keys():
+    """Recompute the folded search_key of every student"""
+    updated = run(search.backfill_search_keys)
+    typer.echo(f"Updated search_key on {updated} students")
+
+
+@cli.command()
+def recompute_averages():
+    """Recompute stored grade averages and status, e.g. after a formula or threshold change"""
+    students = run(grading.backfill_averages)
+    typer.echo(f"Recomputed averages for {students} students")
+
+
+@cli.command()
+def sync_parent_accounts():
+    """Move plaintext student parent passwords into hashed parent accounts (also done at startup)"""
+    passwords = PasswordService()
+    try:
+        created = run(lambda db: parent_accounts.sync_parent_accounts(db, passwords))
+    finally:
+        passwords.shutdown()
+    typer.echo(f"Created {created} parent accounts")
+
+
+@cli.command()
+def migrate_attendance(
+    source: str = typer.Option("per_student", help="Layout to read from"),
+    target: str = typer.Option("class_day", help="Layout to write to")
+):
+    """Copy attendance between the per_student and class_day layouts; safe to re-run"""
+    copied, failed = run(lambda db: attendance_store.migrate_attendance(db, source, target))
+    typer.echo(f"Copied {copied} attendance records from {source} to {target}")
+    if failed:
+        for failure in failed:
+            typer.echo(f"{failure['student_id']} {failure['date']}: {failure['error']}", err=True)
+        typer.echo(f"{len(failed)} records could not be copied; fix them and re-run", err=True)
+        raise typer.Exit(1)
+
+
+@cli.command()
+def check_propagation(
+    repair: bool = typer.Option(False, help="Queue and propagate the students with stale copies")
+):
+    """Report grade and attendance copies whose student name or class disagrees with students"""
+    layout = os.environ.get("ATTENDANCE_STORAGE", "per_student")
+
+    async def task(db):
+        counts, stale = await propagation.find_stale_copies(db, layout)
+        processed = 0
+        if repair and stale:
+            repositories = MotorRepositories(db, layout)
+            for student_id, class_names in stale.items():
+                await repositories.outbox.enqueue(propagation.change_entry(student_id, class_names))
+            processed = await drain_propagation(repositories)
+        return counts, stale, processed
+
+    counts, stale, processed = run(task)
+    for collection_name, count in sorted(counts.items()):
+        typer.echo(f"{collection_name}: {count} stale copies")
+    typer.echo(f"{len(stale)} students with stale copies")
+    if repair:
+        typer.echo(f"Propagated {processed} queued changes")
+
+
+@cli.command()
+def rollover_year(
+    year: str = typer.Option(None, help="Year to close, e.g. 2024-2025; defaults to the year before the current one")
+):
+    """Archive a closed academic year's grades and attendance and promote the students who passed"""
+    year = year or academic_years.previous_year(academic_years.current_year())
+    layout = os.environ.get("ATTENDANCE_STORAGE", "per_student")
+
+    async def task(db):
+        counts = await academic_years.rollover(db, year, layout)
+        # New-year records of promoted students follow them to their new class
+        await drain_propagation(MotorRepositories(db, layout))
+        return counts
+
+    try:
+        counts = run(task)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    promoted = counts.pop("promoted")
+    for collection_name, count in counts.items():
+        typer.echo(f"Archived {count} {collection_name} documents of {year}")
+    typer.echo(f"Promoted {promoted} students")
+
+
+if __name__ == "__main__":
+    cli()
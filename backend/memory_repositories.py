@@ -0,0 +1,389 @@
+"""Dict-indexed in-memory repositories (STORAGE_ENGINE=memory).
+
+Every collection is a Table: documents by primary key plus secondary
+indexes (field value -> primary keys) on the fields the handlers filter by,
+mirroring indexes.py. Reads return copies shaped by the same projections
+the Motor repositories take, so handlers cannot tell the engines apart.
+Nothing is persisted and there is no locking; the app and its tests run
+every handler on a single event loop.
+"""
+import bisect
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+import grading
+import search as student_search
+from attendance_store import ATTENDANCE_CODES, NO_RECORD_CODE, UNKNOWN_STATUS_CODE
+from repositories import (
+    GRADE_EXPORT_SORT, AttendanceRepo, GradeRepo, NewsRepo, OutboxRepo, Repositories, StudentRepo, UserRepo
+)
+
+
+def project(document, projection=None):
+    """Copy of `document` with a Mongo inclusion or exclusion projection applied"""
+    fields = {field: value for field, value in (projection or {}).items() if field != "_id"}
+    if any(fields.values()):
+        return {field: document[field] for field in fields if field in document}
+    return {field: value for field, value in document.items() if field not in fields}
+
+
+def student_key(student):
+    return (student["class_name"], student["name"], student["id"])
+
+
+def grade_key(record):
+    return (record["student_id"], record.get("year"), record["semester"])
+
+
+def news_key(news):
+    return (news["created_at"], news["id"])
+
+
+def apply_student_changes(table, changes, within):
+    """Rewrite student_name and class_name on the changed students' records `within(record)` accepts"""
+    for change in changes:
+        fields = {"student_name": change["name"], "class_name": change["class_name"]}
+        for record in table.lookup("student_id", change["student_id"]):
+            if within(record):
+                table.update(table.key(record), fields)
+
+
+class Table:
+    """Documents by primary key with secondary indexes on `indexed` fields"""
+
+    def __init__(self, key, indexed=()):
+        self.key = key
+        self.rows = {}
+        self.indexes = {field: defaultdict(set) for field in indexed}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, key):
+        return self.rows.get(key)
+
+    def lookup(self, field, value):
+        return [self.rows[key] for key in self.indexes[field].get(value, ())]
+
+    def values(self):
+        return self.rows.values()
+
+    def _unindex(self, key, document):
+        for field, index in self.indexes.items():
+            keys = index.get(document.get(field))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[document.get(field)]
+
+    def put(self, document):
+        """Insert or replace; returns the stored document"""
+        key = self.key(document)
+        if key in self.rows:
+            self._unindex(key, self.rows[key])
+        self.rows[key] = document = dict(document)
+        for field, index in self.indexes.items():
+            index[document.get(field)].add(key)
+        return document
+
+    def delete(self, key):
+        document = self.rows.pop(key, None)
+        if document is not None:
+            self._unindex(key, document)
+
+    def update(self, key, fields):
+        """Set `fields` on a stored document; returns a copy of it before the update, None when absent"""
+        document = self.rows.get(key)
+        if document is None:
+            return None
+        previous = dict(document)
+        self.put({**document, **fields})
+        return previous
+
+
+class MemoryStudentRepo(StudentRepo):
+    def __init__(self):
+        self.table = Table(lambda student: student["id"], indexed=("class_name", "parent_phone"))
+
+    async def get(self, student_id, projection=None):
+        student = self.table.get(student_id)
+        return project(student, projection) if student else None
+
+    async def get_many(self, student_ids, projection=None):
+        students = (self.table.get(student_id) for student_id in set(student_ids))
+        return [project(student, projection) for student in students if student]
+
+    def _rows(self, class_name, after, limit):
+        students = self.table.lookup("class_name", class_name) if class_name else self.table.values()
+        if after:
+            after = tuple(after)
+            students = [student for student in students if student_key(student) > after]
+        students = sorted(students, key=student_key)
+        return students[:limit] if limit else students
+
+    async def list(self, class_name=None, after=None, limit=None, projection=None):
+        return [project(student, projection) for student in self._rows(class_name, after, limit)]
+
+    async def iterate(self, class_name=None, after=None, limit=None, projection=None):
+        for student in self._rows(class_name, after, limit):
+            yield project(student, projection)
+
+    async def search(self, search, class_name=None, projection=None, limit=student_search.MAX_CANDIDATES):
+        tokens = student_search.tokenize(search)
+        if not tokens:
+            return []
+        kinds = [
+            (student_search.match_kind(student.get("search_key", []), tokens), student)
+            for student in self._rows(class_name, None, None)
+        ]
+        # Stable sort: strongest kind first, STUDENT_SORT order within a kind
+        matches = sorted(((kind, student) for kind, student in kinds if kind is not None), key=lambda match: match[0])
+        return [project(student, projection) for _, student in matches[:limit]]
+
+    async def insert(self, student):
+        if self.table.get(student["id"]):
+            raise DuplicateKeyError(f"duplicate student id {student['id']}")
+        self.table.put(student)
+
+    async def update(self, student_id, fields, projection=None):
+        previous = self.table.update(student_id, fields)
+        return project(previous, projection) if previous else None
+
+    async def count(self):
+        return len(self.table)
+
+
+class MemoryGradeRepo(GradeRepo):
+    def __init__(self):
+        self.table = Table(grade_key, indexed=("student_id", "class_name"))
+
+    async def for_student(self, student_id, year=None, projection=None):
+        return [
+            project(record, projection) for record in self.table.lookup("student_id", student_id)
+            if not year or record.get("year") == year
+        ]
+
+    def _matching(self, class_name=None, year=None, semester=None):
+        records = self.table.lookup("class_name", class_name) if class_name else self.table.values()
+        return [
+            record for record in records
+            if (not year or record.get("year") == year) and (not semester or record["semester"] == semester)
+        ]
+
+    async def class_records(self, class_name, year=None, semester=None, projection=None):
+        return [project(record, projection) for record in self._matching(class_name, year, semester)]
+
+    def _upsert(self, student_id, year, semester, fields, insert_fields):
+        """True when the record was created"""
+        key = (student_id, year, semester)
+        if self.table.update(key, fields) is not None:
+            return False
+        self.table.put({**insert_fields, **fields, "student_id": student_id, "year": year, "semester": semester})
+        return True
+
+    async def upsert(self, student_id, year, semester, fields, insert_fields):
+        self._upsert(student_id, year, semester, fields, insert_fields)
+
+    async def bulk_upsert(self, upserts):
+        created = {index for index, upsert in enumerate(upserts) if self._upsert(*upsert)}
+        return created, {}
+
+    async def export(self, class_name=None, year=None, semester=None, projection=None):
+        records = self._matching(class_name, year, semester)
+        records.sort(key=lambda record: tuple(record.get(field) for field, _ in GRADE_EXPORT_SORT))
+        for record in records:
+            yield project(record, projection)
+
+    async def insert_many(self, records):
+        for record in records:
+            if self.table.get(grade_key(record)):
+                raise DuplicateKeyError(f"duplicate grade record {grade_key(record)}")
+            self.table.put(record)
+
+    async def recompute_averages(self, student_ids, year=None):
+        grade_records = [
+            record for student_id in set(student_ids) for record in self.table.lookup("student_id", student_id)
+            if not year or record.get("year") == year
+        ]
+        groups = grading.records_by_student_year(grade_records)
+        for (student_id, record_year), records in groups.items():
+            for semester, fields in grading.average_fields(records):
+                self.table.update((student_id, record_year, semester), fields)
+        return len({student_id for student_id, _ in groups})
+
+    async def apply_student_changes(self, changes, year):
+        apply_student_changes(self.table, changes, lambda record: record.get("year") == year)
+
+
+class MemoryAttendanceRepo(AttendanceRepo):
+    def __init__(self, students):
+        self.students = students
+        self.table = Table(lambda record: (record["student_id"], record["date"]), indexed=("student_id", "class_name", "date"))
+
+    async def record(self, records, overwrite=True):
+        created = set()
+        for index, record in enumerate(records):
+            key = (record["student_id"], record["date"])
+            if self.table.get(key) is None:
+                self.table.put({"id": str(uuid.uuid4()), **record})
+                created.add(index)
+            elif overwrite:
+                self.table.update(key, {field: record[field] for field in ("status", "method", "note", "recorded_by")})
+        return created, {}
+
+    async def class_records(self, class_name, date=None, date_range=None):
+        return [
+            dict(record) for record in self.table.lookup("class_name", class_name)
+            if (record["date"] == date if date else not date_range or date_range[0] <= record["date"] <= date_range[1])
+        ]
+
+    async def student_records(self, student_id, class_name, date_from):
+        records = [
+            {"date": record["date"], "status": record["status"]}
+            for record in self.table.lookup("student_id", student_id)
+            if record["date"] >= date_from
+        ]
+        return sorted(records, key=lambda record: record["date"], reverse=True)
+
+    async def apply_student_changes(self, changes, date_range):
+        apply_student_changes(self.table, changes, lambda record: date_range[0] <= record["date"] <= date_range[1])
+
+    async def class_matrix(self, class_name, date_from, date_to):
+        rows = {}  # student_id -> {name, codes by date}
+        for student in self.students.table.lookup("class_name", class_name):
+            rows[student["id"]] = {"name": student["name"], "codes": {}}
+        dates = set()
+        for record in self.table.lookup("class_name", class_name):
+            if not date_from <= record["date"] <= date_to:
+                continue
+            dates.add(record["date"])
+            row = rows.setdefault(record["student_id"], {"name": record.get("student_name"), "codes": {}})
+            row["codes"][record["date"]] = ATTENDANCE_CODES.get(record.get("status"), UNKNOWN_STATUS_CODE)
+
+        dates = sorted(dates)
+        ordered = sorted(rows.items(), key=lambda item: (item[1]["name"] or "", item[0]))
+        return {
+            "dates": dates,
+            "student_ids": [student_id for student_id, _ in ordered],
+            "student_names": [row["name"] for _, row in ordered],
+            "grid": ["".join(row["codes"].get(day, NO_RECORD_CODE) for day in dates) for _, row in ordered]
+        }
+
+    def count(self, date, status):
+        return sum(1 for record in self.table.lookup("date", date) if record["status"] == status)
+
+
+class MemoryUserRepo(UserRepo):
+    def __init__(self):
+        self.table = Table(lambda user: user["username"], indexed=("role",))
+        self.parent_accounts = Table(lambda account: account["phone"])
+
+    async def by_username(self, username, projection=None):
+        user = self.table.get(username)
+        return project(user, projection) if user else None
+
+    async def insert(self, user):
+        if self.table.get(user["username"]):
+            raise DuplicateKeyError(f"duplicate username {user['username']}")
+        self.table.put(user)
+
+    async def parent_account(self, phone, projection=None):
+        account = self.parent_accounts.get(phone)
+        return project(account, projection) if account else None
+
+    async def add_parent_account(self, account):
+        stored = self.parent_accounts.get(account["phone"])
+        if stored is None:
+            stored = self.parent_accounts.put({**account, "student_ids": []})
+        for student_id in account.get("student_ids", []):
+            if student_id not in stored["student_ids"]:
+                stored["student_ids"].append(student_id)
+
+    async def set_parent_password(self, phone, password_hash):
+        account = self.parent_accounts.get(phone)
+        if account:
+            account["password_hash"] = password_hash
+
+    async def link_student(self, phone, student_id):
+        account = self.parent_accounts.get(phone)
+        if account and student_id not in account["student_ids"]:
+            account["student_ids"].append(student_id)
+
+    async def unlink_student(self, phone, student_id):
+        account = self.parent_accounts.get(phone)
+        if account:
+            account["student_ids"] = [linked for linked in account["student_ids"] if linked != student_id]
+
+    def count_staff(self):
+        return sum(len(self.table.lookup("role", role)) for role in ("teacher", "admin"))
+
+
+class MemoryNewsRepo(NewsRepo):
+    def __init__(self):
+        self.table = Table(lambda news: news["id"])
+        self.feed = []  # news_key of published news, oldest first
+
+    async def published(self, before=None, limit=100, projection=None):
+        end = bisect.bisect_left(self.feed, tuple(before)) if before else len(self.feed)
+        keys = self.feed[max(end - limit, 0):end][::-1]
+        return [project(self.table.get(news_id), projection) for _, news_id in keys]
+
+    async def insert(self, news):
+        if self.table.get(news["id"]):
+            raise DuplicateKeyError(f"duplicate news id {news['id']}")
+        self.table.put(news)
+        if news.get("published"):
+            bisect.insort(self.feed, news_key(news))
+
+
+class MemoryOutboxRepo(OutboxRepo):
+    def __init__(self):
+        self.table = Table(lambda entry: entry["id"])
+
+    async def enqueue(self, entry):
+        self.table.put(entry)
+
+    async def claim(self, limit, lease):
+        now = datetime.utcnow()
+        due = sorted(
+            (entry for entry in self.table.values() if entry["available_at"] <= now),
+            key=lambda entry: entry["available_at"]
+        )[:limit]
+        for entry in due:
+            self.table.update(entry["id"], {
+                "available_at": now + timedelta(seconds=lease),
+                "attempts": entry.get("attempts", 0) + 1
+            })
+        return [dict(self.table.get(entry["id"])) for entry in due]
+
+    async def complete(self, entry_ids):
+        for entry_id in entry_ids:
+            self.table.delete(entry_id)
+
+    async def retry(self, entry_ids, delay):
+        for entry_id in entry_ids:
+            self.table.update(entry_id, {"available_at": datetime.utcnow() + timedelta(seconds=delay)})
+
+    async def pending(self):
+        return len(self.table)
+
+
+class MemoryRepositories(Repositories):
+    def __init__(self):
+        self.students = MemoryStudentRepo()
+        self.grades = MemoryGradeRepo()
+        self.attendance = MemoryAttendanceRepo(self.students)
+        self.users = MemoryUserRepo()
+        self.news = MemoryNewsRepo()
+        self.outbox = MemoryOutboxRepo()
+
+    async def overview_stats(self, today):
+        return {
+            "total_students": len(self.students.table),
+            "total_classes": len(self.students.table.indexes["class_name"]),
+            "total_teachers": self.users.count_staff(),
+            "today_attendance": self.attendance.count(today, "present")
+        }
@@ -0,0 +1,124 @@
+"""Prometheus metrics: HTTP requests per route template and MongoDB commands.
+
+PrometheusMiddleware records request counts, in-flight requests and latency
+per route template (/api/grades/student/{student_id}, not each id) and
+status. MongoCommandMetrics is a pymongo CommandListener counting and timing
+every command per collection and operation, labelled with the route that
+issued it, so per-endpoint query counts are visible. Both report into
+REGISTRY, served by GET /metrics.
+"""
+import time
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.routing import Match
+
+REGISTRY = CollectorRegistry()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests handled",
+    ["method", "route", "status"], registry=REGISTRY
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests being handled",
+    ["method", "route"], registry=REGISTRY
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time to send the full HTTP response",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+mongo_commands = Counter(
+    "mongo_commands_total", "MongoDB commands issued",
+    ["route", "collection", "command", "outcome"], registry=REGISTRY
+)
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command round trip time",
+    ["collection", "command"], buckets=MONGO_BUCKETS, registry=REGISTRY
+)
+
+# Route template of the request being handled; Motor copies the context into
+# its worker threads, so command listeners see it too
+current_route = ContextVar("current_route", default=None)
+
+
+def route_template(scope):
+    """Path template of the route that will handle `scope`"""
+    partial = None
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or UNMATCHED_ROUTE
+
+
+class PrometheusMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(scope)
+        status = "500"
+        token = current_route.set(route)
+        in_flight = http_requests_in_flight.labels(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            current_route.reset(token)
+            http_requests.labels(method, route, status).inc()
+            http_request_duration.labels(method, route, status).observe(time.perf_counter() - started)
+
+
+def command_collection(event):
+    """Collection a command runs against, "" for database-level commands"""
+    if event.command_name == "getMore":
+        target = event.command.get("collection")
+    else:
+        target = event.command.get(event.command_name)
+    return target if isinstance(target, str) else ""
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}  # (connection, request_id) -> (route, collection)
+
+    def _finish(self, event, outcome):
+        route, collection = self._pending.pop((event.connection_id, event.request_id), (None, ""))
+        mongo_commands.labels(route or "", collection, event.command_name, outcome).inc()
+        mongo_command_duration.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def started(self, event):
+        self._pending[(event.connection_id, event.request_id)] = (current_route.get(), command_collection(event))
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+
+def render():
+    """(body, content type) of the Prometheus text exposition"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
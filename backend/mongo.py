@@ -0,0 +1,104 @@
+"""MongoDB client lifecycle: pool settings, warm-up and health checks.
+
+The client is created by the app lifespan, not at import time. Pool size and
+timeouts come from the environment:
+
+    MONGO_MAX_POOL_SIZE (100), MONGO_MIN_POOL_SIZE (10),
+    MONGO_SERVER_SELECTION_TIMEOUT_MS (5000), MONGO_CONNECT_TIMEOUT_MS (5000),
+    MONGO_SOCKET_TIMEOUT_MS (30000), MONGO_WAIT_QUEUE_TIMEOUT_MS (5000),
+    MONGO_MAX_IDLE_TIME_MS (300000)
+
+warm_pool() opens MONGO_MIN_POOL_SIZE connections before the first request,
+so a freshly started instance does not pay connection setup on live traffic.
+"""
+import asyncio
+import os
+import threading
+import time
+
+from pymongo import monitoring
+
+# Client option -> (environment variable, default)
+POOL_SETTINGS = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", 100),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", 10),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", 5000),
+    "socketTimeoutMS": ("MONGO_SOCKET_TIMEOUT_MS", 30000),
+    "waitQueueTimeoutMS": ("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", 300000),
+}
+
+
+def client_options():
+    return {option: int(os.environ.get(variable, default)) for option, (variable, default) in POOL_SETTINGS.items()}
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Open, checked-out and waiting connection counts across the client's pools"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+
+    def _add(self, **changes):
+        with self._lock:
+            for name, change in changes.items():
+                setattr(self, name, max(getattr(self, name) + change, 0))
+
+    def connection_created(self, event):
+        self._add(open=1)
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, in_use=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self, max_pool_size):
+        return {
+            "open": self.open,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "max_pool_size": max_pool_size,
+            "saturation": round(self.in_use / max_pool_size, 3) if max_pool_size else 0
+        }
+
+
+async def ping(client, timeout=2.0):
+    """Round trip time of a ping in milliseconds; raises when the server is unreachable"""
+    started = time.perf_counter()
+    await asyncio.wait_for(client.admin.command("ping"), timeout)
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+async def warm_pool(client, connections):
+    """Open `connections` pooled connections by running that many pings at once"""
+    if connections > 0:
+        await asyncio.gather(*(client.admin.command("ping") for _ in range(connections)))
@@ -0,0 +1,96 @@
+"""Parent login accounts: one per phone number, linked to every child of that parent.
+
+Documents in `parent_accounts` look like
+{id, phone, parent_name, password_hash, student_ids, created_at} and are
+looked up through the unique `phone` index. Request handlers reach them
+through the UserRepo of repositories.py; sync_parent_accounts() migrates
+older students and works on the database directly.
+
+A parent password is only ever stored as the account's hash. It is shown
+once, when the account is created or its password reset; students no longer
+carry a plaintext parent_password.
+"""
+import uuid
+from datetime import datetime
+
+
+def new_account(phone, parent_name, password_hash):
+    return {
+        "id": str(uuid.uuid4()),
+        "phone": phone,
+        "parent_name": parent_name,
+        "password_hash": password_hash,
+        "created_at": datetime.utcnow()
+    }
+
+
+async def attach_student(user_repo, passwords, student_id, phone, parent_name, new_password):
+    """Link a student to the account of `phone`, creating the account if needed.
+
+    Returns `new_password` when it created the account, None when the phone
+    had one already: siblings share one login, and the password handed out
+    for it is only kept as a hash.
+    """
+    if await user_repo.parent_account(phone, {"_id": 0, "id": 1}):
+        await user_repo.link_student(phone, student_id)
+        return None
+
+    password_hash = await passwords.hash(new_password)
+    await user_repo.add_parent_account({**new_account(phone, parent_name, password_hash), "student_ids": [student_id]})
+    return new_password
+
+
+async def reset_password(user_repo, passwords, student, new_password):
+    """Give the account of a student's parent a new password; returns it.
+
+    Creates the account when the phone has none yet.
+    """
+    phone = student["parent_phone"]
+    if not await user_repo.parent_account(phone, {"_id": 0, "id": 1}):
+        return await attach_student(user_repo, passwords, student["id"], phone, student["parent_name"], new_password)
+    await user_repo.set_parent_password(phone, await passwords.hash(new_password))
+    return new_password
+
+
+async def detach_student(user_repo, student_id, phone):
+    await user_repo.unlink_student(phone, student_id)
+
+
+async def sync_parent_accounts(db, passwords):
+    """Move the plaintext parent_password of older student documents into accounts.
+
+    Students created before parent accounts existed carry the password their
+    parent logs in with. A phone without an account gets one with the hashed
+    password of its first such student (by creation date), an existing
+    account only gains the links, and the plaintext is then removed from the
+    students. Runs at startup; safe to re-run, and a no-op once no student
+    has a parent_password. Returns the number of accounts created.
+    """
+    students_by_phone = {}
+    projection = {"_id": 0, "id": 1, "parent_phone": 1, "parent_name": 1, "parent_password": 1}
+    async for student in db.students.find({"parent_password": {"$exists": True}}, projection).sort("created_at", 1):
+        students_by_phone.setdefault(student["parent_phone"], []).append(student)
+    if not students_by_phone:
+        return 0
+
+    existing = set(await db.parent_accounts.distinct("phone", {"phone": {"$in": list(students_by_phone)}}))
+    created = 0
+    for phone, students in students_by_phone.items():
+        student_ids = [student["id"] for student in students]
+        password = next((student["parent_password"] for student in students if student["parent_password"]), None)
+        if phone in existing or password is None:
+            # A phone without any usable password gets its account from a reset
+            await db.parent_accounts.update_one(
+                {"phone": phone}, {"$addToSet": {"student_ids": {"$each": student_ids}}}
+            )
+        else:
+            # Upserted, so workers syncing at the same startup create it once
+            account = new_account(phone, students[0]["parent_name"], await passwords.hash(password))
+            result = await db.parent_accounts.update_one(
+                {"phone": phone},
+                {"$setOnInsert": account, "$addToSet": {"student_ids": {"$each": student_ids}}},
+                upsert=True
+            )
+            created += result.upserted_id is not None
+        await db.students.update_many({"id": {"$in": student_ids}}, {"$unset": {"parent_password": ""}})
+    return created
@@ -0,0 +1,47 @@
+"""Password hashing and verification off the event loop.
+
+bcrypt deliberately burns 100-300 ms of CPU per call; running it inside an
+async handler stalls every other request. PasswordService runs it in its own
+size-limited thread pool, and callers beyond capacity wait for a free slot
+for at most `queue_timeout` seconds.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.hash import bcrypt
+
+
+class PasswordServiceBusy(Exception):
+    """No hashing slot became free within the queue timeout"""
+
+
+class PasswordService:
+    def __init__(self, workers=4, queue_timeout=5.0):
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        self._slots = asyncio.Semaphore(workers)
+
+    async def _run(self, fn, *args):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise PasswordServiceBusy()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._slots.release()
+
+    async def hash(self, password):
+        return await self._run(bcrypt.hash, password)
+
+    async def verify(self, password, password_hash):
+        return await self._run(bcrypt.verify, password, password_hash)
+
+    def shutdown(self):
+        """Stop the pool; the next call starts a new one, so a restarted app keeps working"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,180 @@
+"""Propagation of student renames and class changes to denormalized copies.
+
+`grades` and `attendance` copy student_name and class_name so reads avoid
+joins. update_student queues an entry in the `student_outbox` collection
+whenever either changes; PropagationWorker, started by the app lifespan,
+claims entries in batches and rewrites the copies with one bulk write of
+update_many operations per collection. Entries carry only the student id
+and the classes it left: the current name and class are read from
+`students` when the entry is processed, so replaying an entry is harmless
+and a later change supersedes an earlier one. Only the current academic
+year's copies are rewritten: closed years keep the class the student was in
+then, which is what rollover promotes from. Once a batch is written the
+cache tags of its students and of their old and new classes are invalidated.
+
+Claims are leased (PROPAGATION_LEASE seconds) so several app processes can
+run workers side by side; an entry whose processing failed becomes due again
+after PROPAGATION_RETRY_DELAY seconds. `python manage.py check-propagation`
+reports copies that disagree with `students` and, with --repair, queues and
+processes the affected students.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+
+import academic_years
+from cache import class_tag, student_tag
+
+logger = logging.getLogger(__name__)
+
+
+def change_entry(student_id, previous_class_names):
+    """Outbox entry for a student whose name or class changed"""
+    now = datetime.utcnow()
+    return {
+        "id": str(uuid.uuid4()),
+        "student_id": student_id,
+        "previous_class_names": sorted(set(previous_class_names)),
+        "created_at": now,
+        "available_at": now,
+        "attempts": 0
+    }
+
+
+class PropagationWorker:
+    def __init__(self, repositories, cache=None, batch_size=100, interval=5.0, lease=60.0, retry_delay=30.0):
+        self.repositories = repositories
+        self.cache = cache
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def notify(self):
+        """Process new entries now instead of at the next poll"""
+        self._wake.set()
+
+    async def run_once(self):
+        """Propagate one batch of due entries; returns the number of entries claimed"""
+        entries = await self.repositories.outbox.claim(self.batch_size, self.lease)
+        if not entries:
+            return 0
+
+        # One change per student, towards its current name and class
+        previous_classes = {}
+        for entry in entries:
+            previous_classes.setdefault(entry["student_id"], set()).update(entry["previous_class_names"])
+        students = await self.repositories.students.get_many(
+            previous_classes, {"_id": 0, "id": 1, "name": 1, "class_name": 1}
+        )
+        changes = [
+            {
+                "student_id": student["id"],
+                "name": student["name"],
+                "class_name": student["class_name"],
+                "previous_class_names": sorted(previous_classes[student["id"]])
+            }
+            for student in students
+        ]
+
+        entry_ids = [entry["id"] for entry in entries]
+        year = academic_years.current_year()
+        try:
+            await asyncio.gather(
+                self.repositories.grades.apply_student_changes(changes, year),
+                self.repositories.attendance.apply_student_changes(changes, academic_years.date_range(year))
+            )
+        except Exception:
+            logger.exception("Propagating %d student changes failed, retrying in %ss", len(changes), self.retry_delay)
+            await self.repositories.outbox.retry(entry_ids, self.retry_delay)
+            return len(entries)
+        await self.repositories.outbox.complete(entry_ids)
+        if self.cache:
+            # Gradebooks cached while the copies were being rewritten show the old names
+            await self.cache.invalidate(*{
+                tag
+                for change in changes
+                for tag in (
+                    student_tag(change["student_id"]),
+                    *map(class_tag, [change["class_name"], *change["previous_class_names"]])
+                )
+            })
+        return len(entries)
+
+    async def drain(self):
+        """Process batches until nothing is due; returns the number of entries processed"""
+        processed = 0
+        while True:
+            claimed = await self.run_once()
+            if not claimed:
+                return processed
+            processed += claimed
+
+    async def run(self):
+        while True:
+            try:
+                claimed = await self.run_once()
+            except Exception:
+                logger.exception("Student change propagation failed")
+                claimed = 0
+            if claimed >= self.batch_size:
+                continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def find_stale_copies(db, attendance_layout="per_student"):
+    """Current-year grade and attendance copies that disagree with `students`.
+
+    Returns ({collection: number of stale documents or entries},
+    {student_id: classes its stale copies are filed under}).
+    """
+    students = {
+        student["id"]: student
+        async for student in db.students.find({}, {"_id": 0, "id": 1, "name": 1, "class_name": 1})
+    }
+    counts = {}
+    stale = {}
+
+    def check(collection_name, student_id, name, class_name):
+        student = students.get(student_id)
+        if not student:
+            return
+        if class_name != student["class_name"] or (name is not None and name != student["name"]):
+            counts[collection_name] = counts.get(collection_name, 0) + 1
+            stale.setdefault(student_id, set()).add(class_name)
+
+    year = academic_years.current_year()
+    first_day, last_day = academic_years.date_range(year)
+    days = {"date": {"$gte": first_day, "$lte": last_day}}
+    copy_fields = {"_id": 0, "student_id": 1, "student_name": 1, "class_name": 1}
+    async for record in db.grades.find({"year": year}, copy_fields):
+        check("grades", record["student_id"], record.get("student_name"), record.get("class_name"))
+
+    if attendance_layout == "class_day":
+        # Entries store no name, only the class of the day they are filed under
+        async for day in db.attendance_days.find(days, {"_id": 0, "class_name": 1, "entries": 1}):
+            for student_id in day.get("entries", {}):
+                check("attendance_days", student_id, None, day["class_name"])
+    else:
+        async for record in db.attendance.find(days, copy_fields):
+            check("attendance", record["student_id"], record.get("student_name"), record.get("class_name"))
+    return counts, stale
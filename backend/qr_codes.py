@@ -0,0 +1,163 @@
+"""QR code rendering with a content-addressed cache.
+
+PNGs are keyed by a hash of their payload and render options, kept in an
+in-memory LRU backed by an on-disk store, and rendered in a process pool
+so the event loop never does image work.
+"""
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+QR_OPTIONS = {"version": 1, "box_size": 10, "border": 5}
+
+# Printable sheet: A4 at 150 dpi, 3 x 4 badges per page
+PAGE_SIZE = (1240, 1754)
+SHEET_COLUMNS = 3
+SHEET_ROWS = 4
+BADGE_QR_SIZE = 320
+
+
+def student_payload(student):
+    return f"STUDENT:{student['id']}:{student['name']}"
+
+
+def render_png(data):
+    """Render one QR code to PNG bytes"""
+    qr = qrcode.QRCode(**QR_OPTIONS)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def zip_sheet(badges):
+    """ZIP archive with one PNG per (filename, png) badge"""
+    buffered = io.BytesIO()
+    with zipfile.ZipFile(buffered, "w", zipfile.ZIP_STORED) as archive:
+        for filename, png in badges:
+            archive.writestr(filename, png)
+    return buffered.getvalue()
+
+
+def _label_font(size=26):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def pdf_sheet(badges):
+    """Multi-page PDF laying out (label, png) badges in a printable grid"""
+    font = _label_font()
+    cell_width = PAGE_SIZE[0] // SHEET_COLUMNS
+    cell_height = PAGE_SIZE[1] // SHEET_ROWS
+    per_page = SHEET_COLUMNS * SHEET_ROWS
+
+    pages = []
+    for start in range(0, max(len(badges), 1), per_page):
+        page = Image.new("RGB", PAGE_SIZE, "white")
+        draw = ImageDraw.Draw(page)
+        for position, (label, png) in enumerate(badges[start:start + per_page]):
+            left = (position % SHEET_COLUMNS) * cell_width
+            top = (position // SHEET_COLUMNS) * cell_height
+            qr_image = Image.open(io.BytesIO(png)).convert("RGB").resize((BADGE_QR_SIZE, BADGE_QR_SIZE))
+            page.paste(qr_image, (left + (cell_width - BADGE_QR_SIZE) // 2, top + 20))
+            draw.text(
+                (left + cell_width // 2, top + BADGE_QR_SIZE + 40),
+                label, fill="black", font=font, anchor="mt"
+            )
+        pages.append(page)
+
+    buffered = io.BytesIO()
+    pages[0].save(buffered, format="PDF", save_all=True, append_images=pages[1:], resolution=150)
+    return buffered.getvalue()
+
+
+class QRCodeService:
+    def __init__(self, cache_dir, memory_items=2048, workers=2):
+        self.cache_dir = Path(cache_dir)
+        self.memory_items = memory_items
+        self.workers = workers
+        self._memory = OrderedDict()
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            # Spawned, not forked: a fork would copy the event loop, Motor's threads and their locks
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _key(self, data):
+        return hashlib.sha256(f"{sorted(QR_OPTIONS.items())}|{data}".encode()).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.png"
+
+    def _read_disk(self, path):
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, path, png):
+        # Write then rename so concurrent workers never read a partial file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        temp_path.write_bytes(png)
+        os.replace(temp_path, path)
+
+    def _remember(self, key, png):
+        self._memory[key] = png
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    async def png(self, data):
+        """PNG bytes of the QR code for `data`, from cache when possible"""
+        key = self._key(data)
+        png = self._memory.get(key)
+        if png is not None:
+            self._memory.move_to_end(key)
+            return png
+
+        loop = asyncio.get_running_loop()
+        path = self._path(key)
+        png = await loop.run_in_executor(None, self._read_disk, path)
+        if png is None:
+            png = await loop.run_in_executor(self._pool(), render_png, data)
+            await loop.run_in_executor(None, self._write_disk, path, png)
+        self._remember(key, png)
+        return png
+
+    async def pngs(self, payloads):
+        return await asyncio.gather(*(self.png(data) for data in payloads))
+
+    async def sheet(self, badges, sheet_format):
+        """Render a whole class as 'zip' or 'pdf' from (label, payload) pairs"""
+        pngs = await self.pngs([data for _, data in badges])
+        if sheet_format == "zip":
+            items = [
+                (f"{number:03d} {label}.png", png)
+                for number, ((label, _), png) in enumerate(zip(badges, pngs), start=1)
+            ]
+            build = zip_sheet
+        else:
+            items = [(label, png) for (label, _), png in zip(badges, pngs)]
+            build = pdf_sheet
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), build, items)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
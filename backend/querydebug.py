@@ -0,0 +1,240 @@
+"""Development-mode query budget and collection-scan detector (QUERY_DEBUG=1).
+
+QueryDebugger.database() wraps a Motor database so every operation issued
+while handling a request is counted against that request. The count is sent
+back as X-Query-Count; going over the route's budget logs a warning. Each
+distinct query shape (collection, operation, filter keys and operators, sort)
+is explained once with queryPlanner verbosity; shapes whose winning plan
+scans the collection are logged as well. Servers without the explain command
+(such as the mongomock stand-in of the benchmarks) are checked against the
+declared INDEXES instead. Every warning is also kept in `violations`, so a
+test run can fail on it.
+"""
+import json
+import logging
+from contextvars import ContextVar
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from indexes import INDEXES
+from metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+# Collection methods that issue an operation, and the position of their filter argument
+QUERY_METHODS = {
+    "find": 0,
+    "find_one": 0,
+    "find_one_and_update": 0,
+    "find_one_and_replace": 0,
+    "find_one_and_delete": 0,
+    "count_documents": 0,
+    "update_one": 0,
+    "update_many": 0,
+    "replace_one": 0,
+    "delete_one": 0,
+    "delete_many": 0,
+    "distinct": 1,
+}
+OTHER_METHODS = ("insert_one", "insert_many", "estimated_document_count")
+
+current_queries = ContextVar("current_queries", default=None)
+
+
+def shape(value):
+    """Filter with every value replaced by 1, keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+        return [shape(item) for item in value]
+    return 1
+
+
+def filter_fields(query):
+    """Top-level field names of a filter, without operators"""
+    return {key for key in query if not key.startswith("$")}
+
+
+def uses_index(collection_name, query):
+    """Whether the declared indexes can serve `query`, as the planner would"""
+    leading = {next(iter(model.document["key"])) for model in INDEXES.get(collection_name, [])}
+    if filter_fields(query) & leading:
+        return True
+    if any(uses_index(collection_name, branch) for branch in query.get("$and", [])):
+        return True
+    branches = query.get("$or", [])
+    return bool(branches) and all(uses_index(collection_name, branch) for branch in branches)
+
+
+def has_collscan(plan):
+    if isinstance(plan, dict):
+        return plan.get("stage") == "COLLSCAN" or any(has_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(has_collscan(item) for item in plan)
+    return False
+
+
+class RequestQueries:
+    def __init__(self, route):
+        self.route = route
+        self.count = 0
+        self.shapes = {}  # shape key -> (collection, query, sort)
+
+
+class DebugCursor:
+    """Cursor wrapper that records the sort applied before the query runs"""
+
+    def __init__(self, cursor, queries, key):
+        self._cursor = cursor
+        self._queries = queries
+        self._key = key
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        if self._queries and self._key in self._queries.shapes:
+            collection, query, _ = self._queries.shapes[self._key]
+            self._queries.shapes[self._key] = (collection, query, args[0] if args else None)
+        return self
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if callable(attribute) and name in ("limit", "skip", "batch_size", "hint"):
+            def chain(*args, **kwargs):
+                self._cursor = attribute(*args, **kwargs)
+                return self
+            return chain
+        return attribute
+
+    def __aiter__(self):
+        return self._cursor.__aiter__()
+
+
+class DebugCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def _record(self, operation, query, count=True):
+        """Count the operation on the current request and remember its query shape"""
+        queries = current_queries.get()
+        if queries is None:
+            return None, None
+        if count:
+            queries.count += 1
+        if not query:
+            return queries, None
+        key = json.dumps([self._collection.name, operation, shape(query)], sort_keys=True, default=str)
+        queries.shapes.setdefault(key, (self._collection, query, None))
+        return queries, key
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name in QUERY_METHODS:
+            position = QUERY_METHODS[name]
+
+            def query_method(*args, **kwargs):
+                query = args[position] if len(args) > position else kwargs.get("filter")
+                queries, key = self._record(name, query)
+                result = attribute(*args, **kwargs)
+                return DebugCursor(result, queries, key) if name == "find" else result
+            return query_method
+        if name == "aggregate":
+            def aggregate(pipeline, *args, **kwargs):
+                first = pipeline[0] if pipeline else {}
+                self._record("aggregate", first.get("$match"))
+                return attribute(pipeline, *args, **kwargs)
+            return aggregate
+        if name == "bulk_write":
+            def bulk_write(operations, *args, **kwargs):
+                # One round trip, but every filter in it is checked
+                self._record("bulk_write", None)
+                for operation in operations:
+                    self._record(type(operation).__name__, getattr(operation, "_filter", None), count=False)
+                return attribute(operations, *args, **kwargs)
+            return bulk_write
+        if name in OTHER_METHODS:
+            def operation(*args, **kwargs):
+                self._record(name, None)
+                return attribute(*args, **kwargs)
+            return operation
+        return attribute
+
+
+class DebugDatabase:
+    def __init__(self, db):
+        self._db = db
+
+    def __getitem__(self, name):
+        return DebugCollection(self._db[name])
+
+    def __getattr__(self, name):
+        attribute = getattr(self._db, name)
+        if isinstance(attribute, AsyncIOMotorCollection):
+            return DebugCollection(attribute)
+        return attribute
+
+
+class QueryDebugger:
+    def __init__(self, default_budget=10, budgets=None):
+        self.default_budget = default_budget
+        self.budgets = budgets or {}
+        self.violations = []
+        self._plans = {}  # shape key -> "COLLSCAN" / "IXSCAN"
+
+    def database(self, db):
+        return DebugDatabase(db)
+
+    def budget(self, route):
+        return self.budgets.get(route, self.default_budget)
+
+    def _warn(self, message):
+        logger.warning(message)
+        self.violations.append(message)
+
+    async def _plan(self, collection, query, sort):
+        explain = {"find": collection.name, "filter": query}
+        if sort:
+            explain["sort"] = dict(sort) if isinstance(sort, list) else {sort: 1}
+        try:
+            result = await collection.database.command({"explain": explain, "verbosity": "queryPlanner"})
+        except Exception:
+            return "IXSCAN" if uses_index(collection.name, query) else "COLLSCAN"
+        return "COLLSCAN" if has_collscan(result.get("queryPlanner", {}).get("winningPlan")) else "IXSCAN"
+
+    async def check(self, method, queries):
+        """Explain the request's unseen query shapes and enforce its budget"""
+        for key, (collection, query, sort) in queries.shapes.items():
+            if key in self._plans:
+                continue
+            self._plans[key] = await self._plan(collection, query, sort)
+            if self._plans[key] == "COLLSCAN":
+                self._warn(f"{method} {queries.route}: collection scan on {collection.name} for {key}")
+        if queries.count > self.budget(queries.route):
+            self._warn(
+                f"{method} {queries.route}: {queries.count} queries, budget {self.budget(queries.route)}"
+            )
+
+
+class QueryDebugMiddleware:
+    def __init__(self, app, debugger):
+        self.app = app
+        self.debugger = debugger
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        queries = RequestQueries(route_template(scope))
+        token = current_queries.set(queries)
+
+        async def send_with_count(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (b"x-query-count", str(queries.count).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            current_queries.reset(token)
+        await self.debugger.check(scope["method"], queries)
@@ -0,0 +1,69 @@
+"""Shared read path of the list endpoints.
+
+Documents are fetched with a Mongo projection (never `_id`, search keys or
+credentials unless asked for) and handed to orjson as they come from Motor,
+without per-row cleanup or Pydantic re-validation. Callers pick columns with
+`?fields=a,b,c` from the fields each resource allows.
+"""
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+
+# Fields a caller may select per resource
+STUDENT_FIELDS = (
+    "id", "name", "class_name", "birth_date", "parent_name", "parent_phone",
+    "address", "created_at"
+)
+NEWS_FIELDS = ("id", "title", "content", "author", "created_at", "published")
+
+# Returned when ?fields= is absent
+STUDENT_DEFAULT_FIELDS = STUDENT_FIELDS
+NEWS_DEFAULT_FIELDS = NEWS_FIELDS
+
+# Only for reads that must never expose them; parent_password remains on
+# students that parent_accounts.sync_parent_accounts() has not migrated yet
+STUDENT_PRIVATE_FIELDS = ("parent_password", "search_key")
+
+
+def select_fields(fields, allowed, default):
+    """Field names from a comma-separated ?fields= value, 400 on unknown names"""
+    if not fields:
+        return tuple(default)
+    selected = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in selected if field not in allowed]
+    if unknown or not selected:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(allowed)}"
+        )
+    return selected
+
+
+def projection(selected, required=()):
+    """Mongo projection returning `selected` plus the `required` keys (e.g. for cursors)"""
+    fields = {"_id": 0}
+    fields.update({field: 1 for field in (*selected, *required)})
+    return fields
+
+
+def exclude(*fields):
+    return {"_id": 0, **{field: 0 for field in fields}}
+
+
+def drop_unselected(rows, selected, required):
+    """Remove keys fetched only for internal use; a no-op when all were selected"""
+    extra = [field for field in required if field not in selected]
+    if extra:
+        for row in rows:
+            for field in extra:
+                row.pop(field, None)
+    return rows
+
+
+def dumps(content):
+    return orjson.dumps(content)
+
+
+def json_response(content, headers=None):
+    """Serialize Motor documents straight to JSON, skipping FastAPI's encoder"""
+    return ORJSONResponse(content, headers=headers)
@@ -0,0 +1,587 @@
+"""Storage repositories used by the request handlers.
+
+Handlers never touch collections directly; they receive a StudentRepo,
+GradeRepo, AttendanceRepo, UserRepo or NewsRepo through FastAPI dependencies
+that read `app.state.repositories`. STORAGE_ENGINE selects the implementation
+created by the app lifespan:
+
+mongo (default): the Motor implementations below, one per collection group.
+Queries are the ones the handlers used to issue, backed by the INDEXES of
+indexes.py; attendance goes through the configured attendance_store layout.
+
+memory: the dict-indexed implementations of memory_repositories.py. Nothing
+is persisted; used to run and benchmark the app without a MongoDB server.
+
+Reads take Mongo-style projections ({"_id": 0, "name": 1} or
+{"_id": 0, "search_key": 0}) so both engines return the same documents;
+`_id` is never returned. Keyset cursors are passed as the sort key of the
+last row seen, not as a query.
+"""
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+
+import grading
+import search as student_search
+from attendance_store import (
+    ATTENDANCE_CODES, NO_RECORD_CODE, UNKNOWN_STATUS_CODE, bulk_upsert, create_attendance_store
+)
+
+STORAGE_ENGINES = ("mongo", "memory")
+
+# Student listing order; backed by the (class_name, name, id) index
+STUDENT_SORT = [("class_name", 1), ("name", 1), ("id", 1)]
+
+# News feed order, newest first; backed by the (published, created_at, id) index
+NEWS_SORT = [("created_at", -1), ("id", -1)]
+
+# Grade export order
+GRADE_EXPORT_SORT = [("class_name", 1), ("semester", 1), ("student_name", 1)]
+
+NO_ID = {"_id": 0}
+
+
+class StudentRepo(ABC):
+    @abstractmethod
+    async def get(self, student_id, projection=None):
+        """One student, None when the id is unknown"""
+
+    @abstractmethod
+    async def get_many(self, student_ids, projection=None):
+        """The known students among `student_ids`, in no particular order"""
+
+    @abstractmethod
+    async def list(self, class_name=None, after=None, limit=None, projection=None):
+        """Students in STUDENT_SORT order, optionally after a (class_name, name, id) key"""
+
+    @abstractmethod
+    def iterate(self, class_name=None, after=None, limit=None, projection=None):
+        """Async iterator over the same rows as list(), read as they are consumed"""
+
+    @abstractmethod
+    async def search(self, search, class_name=None, projection=None, limit=student_search.MAX_CANDIDATES):
+        """Students whose search_key has a prefix match for every token of `search`.
+
+        The strongest kinds of match (search.match_kinds) come first, each in
+        STUDENT_SORT order, so `limit` cuts the weakest candidates.
+        """
+
+    @abstractmethod
+    async def insert(self, student):
+        ...
+
+    @abstractmethod
+    async def update(self, student_id, fields, projection=None):
+        """Set `fields` on a student; returns the document before the update, None when unknown"""
+
+    @abstractmethod
+    async def count(self):
+        ...
+
+
+class GradeRepo(ABC):
+    @abstractmethod
+    async def for_student(self, student_id, year=None, projection=None):
+        ...
+
+    @abstractmethod
+    async def class_records(self, class_name, year=None, semester=None, projection=None):
+        ...
+
+    @abstractmethod
+    async def upsert(self, student_id, year, semester, fields, insert_fields):
+        """Set `fields` on the (student_id, year, semester) record, created from `insert_fields` when missing"""
+
+    @abstractmethod
+    async def bulk_upsert(self, upserts):
+        """Many (student_id, year, semester, fields, insert_fields) upserts in one write.
+
+        Returns (indexes of the upserts that created a record, errors by index).
+        """
+
+    @abstractmethod
+    def export(self, class_name=None, year=None, semester=None, projection=None):
+        """Async iterator over matching records in GRADE_EXPORT_SORT order"""
+
+    @abstractmethod
+    async def insert_many(self, records):
+        ...
+
+    @abstractmethod
+    async def recompute_averages(self, student_ids, year=None):
+        """Materialize averages and status on the grade records of the given students, of one year or all"""
+
+    @abstractmethod
+    async def apply_student_changes(self, changes, year):
+        """Copy each change's name and class_name onto the student's grade records of `year`.
+
+        A change is {student_id, name, class_name, previous_class_names}.
+        Closed years keep the class the student had then.
+        """
+
+
+class AttendanceRepo(ABC):
+    @abstractmethod
+    async def record(self, records, overwrite=True):
+        """Write attendance_store.new_record() records.
+
+        With overwrite=False an existing record for that student and day is
+        kept. Returns (indexes of newly created records, errors by index).
+        """
+
+    @abstractmethod
+    async def class_records(self, class_name, date=None, date_range=None):
+        """Records of a class on `date`, or within an inclusive (first, last) `date_range`"""
+
+    @abstractmethod
+    async def student_records(self, student_id, class_name, date_from):
+        """{date, status} of one student of `class_name` since `date_from`, newest first"""
+
+    @abstractmethod
+    async def apply_student_changes(self, changes, date_range):
+        """Bring the student's attendance within an inclusive (first, last) `date_range` in line with a GradeRepo.apply_student_changes() change"""
+
+    @abstractmethod
+    async def class_matrix(self, class_name, date_from, date_to):
+        """Student x date grid of a class as {dates, student_ids, student_names, grid}.
+
+        Every student of the current roster gets a row, plus former members
+        with records in the range; grid holds one ATTENDANCE_CODES string per
+        student, one character per date.
+        """
+
+
+class UserRepo(ABC):
+    @abstractmethod
+    async def by_username(self, username, projection=None):
+        ...
+
+    @abstractmethod
+    async def insert(self, user):
+        """Raises DuplicateKeyError when the username is taken"""
+
+    @abstractmethod
+    async def parent_account(self, phone, projection=None):
+        ...
+
+    @abstractmethod
+    async def add_parent_account(self, account):
+        """Create the account of account["phone"] unless it exists, then link its student_ids"""
+
+    @abstractmethod
+    async def set_parent_password(self, phone, password_hash):
+        ...
+
+    @abstractmethod
+    async def link_student(self, phone, student_id):
+        ...
+
+    @abstractmethod
+    async def unlink_student(self, phone, student_id):
+        ...
+
+
+class NewsRepo(ABC):
+    @abstractmethod
+    async def published(self, before=None, limit=100, projection=None):
+        """Published news in NEWS_SORT order, optionally before a (created_at, id) key"""
+
+    @abstractmethod
+    async def insert(self, news):
+        ...
+
+
+class OutboxRepo(ABC):
+    """Durable queue of student changes waiting to be propagated (see propagation.py)"""
+
+    @abstractmethod
+    async def enqueue(self, entry):
+        ...
+
+    @abstractmethod
+    async def claim(self, limit, lease):
+        """Up to `limit` due entries, hidden from other claims for `lease` seconds"""
+
+    @abstractmethod
+    async def complete(self, entry_ids):
+        ...
+
+    @abstractmethod
+    async def retry(self, entry_ids, delay):
+        """Make claimed entries due again after `delay` seconds"""
+
+    @abstractmethod
+    async def pending(self):
+        ...
+
+
+class Repositories(ABC):
+    """One repository per collection group, plus reads spanning several of them"""
+
+    students: StudentRepo
+    grades: GradeRepo
+    attendance: AttendanceRepo
+    users: UserRepo
+    news: NewsRepo
+    outbox: OutboxRepo
+
+    @abstractmethod
+    async def overview_stats(self, today):
+        """{total_students, total_classes, total_teachers, today_attendance}"""
+
+
+# Motor implementation
+
+def student_keyset(after):
+    """Rows sorting after a (class_name, name, id) key"""
+    class_name, name, student_id = after
+    return {"$or": [
+        {"class_name": {"$gt": class_name}},
+        {"class_name": class_name, "name": {"$gt": name}},
+        {"class_name": class_name, "name": name, "id": {"$gt": student_id}}
+    ]}
+
+
+def news_keyset(before):
+    """Rows sorting after a (created_at, id) key in the newest-first feed"""
+    created_at, news_id = before
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": news_id}}
+    ]}
+
+
+def grade_update(fields, insert_fields):
+    update = {"$setOnInsert": insert_fields}
+    if fields:
+        update["$set"] = fields
+    return update
+
+
+def grade_upsert(student_id, year, semester, fields, insert_fields):
+    return UpdateOne(
+        {"student_id": student_id, "year": year, "semester": semester},
+        grade_update(fields, insert_fields),
+        upsert=True
+    )
+
+
+def grade_query(class_name=None, year=None, semester=None):
+    query = {}
+    if class_name:
+        query["class_name"] = class_name
+    if year:
+        query["year"] = year
+    if semester:
+        query["semester"] = semester
+    return query
+
+
+class MotorStudentRepo(StudentRepo):
+    def __init__(self, db):
+        self.collection = db.students
+
+    async def get(self, student_id, projection=None):
+        return await self.collection.find_one({"id": student_id}, projection or NO_ID)
+
+    async def get_many(self, student_ids, projection=None):
+        return await self.collection.find({"id": {"$in": list(student_ids)}}, projection or NO_ID).to_list(None)
+
+    def _find(self, class_name, after, limit, projection):
+        filters = []
+        if class_name:
+            filters.append({"class_name": class_name})
+        if after:
+            filters.append(student_keyset(after))
+        query = {"$and": filters} if filters else {}
+        cursor = self.collection.find(query, projection or NO_ID).sort(STUDENT_SORT)
+        return cursor.limit(limit) if limit else cursor
+
+    async def list(self, class_name=None, after=None, limit=None, projection=None):
+        return await self._find(class_name, after, limit, projection).to_list(None)
+
+    async def iterate(self, class_name=None, after=None, limit=None, projection=None):
+        async for student in self._find(class_name, after, limit, projection):
+            yield student
+
+    async def search(self, search, class_name=None, projection=None, limit=student_search.MAX_CANDIDATES):
+        students = []
+        for kind in student_search.match_kinds(search):
+            filters = [{"class_name": class_name}] if class_name else []
+            filters.append(kind)
+            if students:
+                filters.append({"id": {"$nin": [student["id"] for student in students]}})
+            cursor = self.collection.find({"$and": filters}, projection or NO_ID).sort(STUDENT_SORT)
+            students.extend(await cursor.limit(limit - len(students)).to_list(None))
+            if len(students) >= limit:
+                break
+        return students
+
+    async def insert(self, student):
+        await self.collection.insert_one(student)
+
+    async def update(self, student_id, fields, projection=None):
+        return await self.collection.find_one_and_update(
+            {"id": student_id},
+            {"$set": fields},
+            projection=projection or NO_ID,
+            return_document=ReturnDocument.BEFORE
+        )
+
+    async def count(self):
+        return await self.collection.count_documents({})
+
+
+class MotorGradeRepo(GradeRepo):
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.grades
+
+    async def for_student(self, student_id, year=None, projection=None):
+        query = {"student_id": student_id}
+        if year:
+            query["year"] = year
+        return await self.collection.find(query, projection or NO_ID).to_list(None)
+
+    async def class_records(self, class_name, year=None, semester=None, projection=None):
+        query = grade_query(class_name, year, semester)
+        return await self.collection.find(query, projection or NO_ID).to_list(None)
+
+    async def upsert(self, student_id, year, semester, fields, insert_fields):
+        await self.collection.update_one(
+            {"student_id": student_id, "year": year, "semester": semester},
+            grade_update(fields, insert_fields),
+            upsert=True
+        )
+
+    async def bulk_upsert(self, upserts):
+        if not upserts:
+            return set(), {}
+        return await bulk_upsert(self.collection, [grade_upsert(*upsert) for upsert in upserts])
+
+    async def export(self, class_name=None, year=None, semester=None, projection=None):
+        cursor = self.collection.find(
+            grade_query(class_name, year, semester), projection or NO_ID
+        ).sort(GRADE_EXPORT_SORT).batch_size(500)
+        async for record in cursor:
+            yield record
+
+    async def insert_many(self, records):
+        if records:
+            await self.collection.insert_many(records)
+
+    async def recompute_averages(self, student_ids, year=None):
+        return await grading.recompute_averages(self.db, student_ids, year)
+
+    async def apply_student_changes(self, changes, year):
+        if not changes:
+            return
+        await self.collection.bulk_write([
+            UpdateMany(
+                {"student_id": change["student_id"], "year": year},
+                {"$set": {"student_name": change["name"], "class_name": change["class_name"]}}
+            )
+            for change in changes
+        ], ordered=False)
+
+
+class MotorAttendanceRepo(AttendanceRepo):
+    def __init__(self, db, layout="per_student"):
+        self.store = create_attendance_store(db, layout)
+
+    async def record(self, records, overwrite=True):
+        return await self.store.record(records, overwrite=overwrite)
+
+    async def class_records(self, class_name, date=None, date_range=None):
+        return await self.store.class_records(class_name, date, date_range)
+
+    async def student_records(self, student_id, class_name, date_from):
+        return await self.store.student_records(student_id, class_name, date_from)
+
+    async def apply_student_changes(self, changes, date_range):
+        await self.store.apply_student_changes(changes, date_range)
+
+    async def class_matrix(self, class_name, date_from, date_to):
+        status_code = {"$switch": {
+            "branches": [{"case": {"$eq": ["$status", status]}, "then": code} for status, code in ATTENDANCE_CODES.items()],
+            "default": UNKNOWN_STATUS_CODE
+        }}
+        pipeline = [
+            # Range predicate on the (class_name, date) index
+            *self.store.records_pipeline({"class_name": class_name, "date": {"$gte": date_from, "$lte": date_to}}),
+            {"$project": {"student_id": 1, "name": "$student_name", "date": 1, "code": status_code}},
+            # The current roster, so students without records still get a row
+            {"$unionWith": {"coll": "students", "pipeline": [
+                {"$match": {"class_name": class_name}},
+                {"$project": {"_id": 0, "student_id": "$id", "roster_name": "$name"}}
+            ]}},
+            {"$facet": {
+                "dates": [
+                    {"$match": {"date": {"$exists": True}}},
+                    {"$group": {"_id": "$date"}},
+                    {"$sort": {"_id": 1}}
+                ],
+                "students": [
+                    {"$group": {
+                        "_id": "$student_id",
+                        "roster_name": {"$max": "$roster_name"},
+                        "name": {"$max": "$name"},
+                        "dates": {"$push": "$date"},
+                        "codes": {"$push": "$code"}
+                    }},
+                    {"$project": {"name": {"$ifNull": ["$roster_name", "$name"]}, "dates": 1, "codes": 1}},
+                    {"$sort": {"name": 1, "_id": 1}}
+                ]
+            }},
+            # One code string per student, one character per date
+            {"$project": {
+                "dates": "$dates._id",
+                "student_ids": "$students._id",
+                "student_names": "$students.name",
+                "grid": {"$map": {
+                    "input": "$students",
+                    "as": "student",
+                    "in": {"$reduce": {
+                        "input": "$dates._id",
+                        "initialValue": "",
+                        "in": {"$let": {
+                            "vars": {"position": {"$indexOfArray": ["$$student.dates", "$$this"]}},
+                            "in": {"$concat": ["$$value", {"$cond": [
+                                {"$eq": ["$$position", -1]},
+                                NO_RECORD_CODE,
+                                {"$arrayElemAt": ["$$student.codes", "$$position"]}
+                            ]}]}
+                        }}
+                    }}
+                }}
+            }}
+        ]
+        return (await self.store.collection.aggregate(pipeline).to_list(1))[0]
+
+
+class MotorUserRepo(UserRepo):
+    def __init__(self, db):
+        self.collection = db.users
+        self.parent_accounts = db.parent_accounts
+
+    async def by_username(self, username, projection=None):
+        return await self.collection.find_one({"username": username}, projection or NO_ID)
+
+    async def insert(self, user):
+        await self.collection.insert_one(user)
+
+    async def parent_account(self, phone, projection=None):
+        return await self.parent_accounts.find_one({"phone": phone}, projection or NO_ID)
+
+    async def add_parent_account(self, account):
+        fields = {key: value for key, value in account.items() if key != "student_ids"}
+        await self.parent_accounts.update_one(
+            {"phone": account["phone"]},
+            {
+                "$setOnInsert": fields,
+                "$addToSet": {"student_ids": {"$each": account.get("student_ids", [])}}
+            },
+            upsert=True
+        )
+
+    async def set_parent_password(self, phone, password_hash):
+        await self.parent_accounts.update_one({"phone": phone}, {"$set": {"password_hash": password_hash}})
+
+    async def link_student(self, phone, student_id):
+        await self.parent_accounts.update_one({"phone": phone}, {"$addToSet": {"student_ids": student_id}})
+
+    async def unlink_student(self, phone, student_id):
+        await self.parent_accounts.update_one({"phone": phone}, {"$pull": {"student_ids": student_id}})
+
+
+class MotorNewsRepo(NewsRepo):
+    def __init__(self, db):
+        self.collection = db.news
+
+    async def published(self, before=None, limit=100, projection=None):
+        query = {"published": True}
+        if before:
+            query.update(news_keyset(before))
+        cursor = self.collection.find(query, projection or NO_ID).sort(NEWS_SORT).limit(limit)
+        return await cursor.to_list(None)
+
+    async def insert(self, news):
+        await self.collection.insert_one(news)
+
+
+class MotorOutboxRepo(OutboxRepo):
+    collection_name = "student_outbox"
+
+    def __init__(self, db):
+        self.collection = db[self.collection_name]
+
+    async def enqueue(self, entry):
+        await self.collection.insert_one(entry)
+
+    async def claim(self, limit, lease):
+        now = datetime.utcnow()
+        due = await self.collection.find(
+            {"available_at": {"$lte": now}}, {"_id": 0, "id": 1}
+        ).sort("available_at", 1).limit(limit).to_list(None)
+        if not due:
+            return []
+        # Only entries still due are taken, so concurrent workers never share one
+        claim_id = str(uuid.uuid4())
+        entry_ids = [entry["id"] for entry in due]
+        await self.collection.update_many(
+            {"id": {"$in": entry_ids}, "available_at": {"$lte": now}},
+            {"$set": {"available_at": now + timedelta(seconds=lease), "claim_id": claim_id}, "$inc": {"attempts": 1}}
+        )
+        return await self.collection.find({"id": {"$in": entry_ids}, "claim_id": claim_id}, NO_ID).to_list(None)
+
+    async def complete(self, entry_ids):
+        await self.collection.delete_many({"id": {"$in": list(entry_ids)}})
+
+    async def retry(self, entry_ids, delay):
+        await self.collection.update_many(
+            {"id": {"$in": list(entry_ids)}},
+            {"$set": {"available_at": datetime.utcnow() + timedelta(seconds=delay)}}
+        )
+
+    async def pending(self):
+        return await self.collection.count_documents({})
+
+
+class MotorRepositories(Repositories):
+    def __init__(self, db, attendance_layout="per_student"):
+        self.db = db
+        self.students = MotorStudentRepo(db)
+        self.grades = MotorGradeRepo(db)
+        self.attendance = MotorAttendanceRepo(db, attendance_layout)
+        self.users = MotorUserRepo(db)
+        self.news = MotorNewsRepo(db)
+        self.outbox = MotorOutboxRepo(db)
+
+    async def overview_stats(self, today):
+        """All overview counters in a single aggregation round trip"""
+        store = self.attendance.store
+        pipeline = [
+            {"$project": {"_id": 0, "kind": {"$literal": "student"}, "class_name": 1}},
+            {"$unionWith": {"coll": "users", "pipeline": [
+                {"$match": {"role": {"$in": ["teacher", "admin"]}}},
+                {"$project": {"_id": 0, "kind": {"$literal": "teacher"}}}
+            ]}},
+            {"$unionWith": {"coll": store.collection_name, "pipeline": [
+                *store.records_pipeline({"date": today}, status="present"),
+                {"$project": {"kind": {"$literal": "attendance"}}}
+            ]}},
+            {"$facet": {
+                "total_students": [{"$match": {"kind": "student"}}, {"$count": "n"}],
+                "total_classes": [
+                    {"$match": {"kind": "student"}},
+                    {"$group": {"_id": "$class_name"}},
+                    {"$count": "n"}
+                ],
+                "total_teachers": [{"$match": {"kind": "teacher"}}, {"$count": "n"}],
+                "today_attendance": [{"$match": {"kind": "attendance"}}, {"$count": "n"}]
+            }}
+        ]
+        facets = (await self.db.students.aggregate(pipeline).to_list(1))[0]
+        return {name: counts[0]["n"] if counts else 0 for name, counts in facets.items()}
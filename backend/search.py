@@ -0,0 +1,120 @@
+"""Accent-insensitive student search backed by a precomputed search_key."""
+import re
+import unicodedata
+
+from pymongo import UpdateOne
+
+# Student fields folded into search_key, in ranking order
+SEARCH_FIELDS = ("name", "class_name", "parent_name")
+
+# Upper bound on candidates ranked for one query; past it the weaker kinds
+# of match (see match_kinds) are the ones left out
+MAX_CANDIDATES = 500
+
+
+def fold(text):
+    """Lowercase and strip Vietnamese diacritics: "Nguyễn Văn An" -> "nguyen van an" """
+    # đ/Đ is a distinct letter, not d + combining mark, so NFD leaves it alone
+    text = text.replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    return re.findall(r"\w+", fold(text or ""))
+
+
+def build_search_key(student):
+    """Distinct folded tokens of the searchable fields, stored on the student"""
+    tokens = []
+    for field in SEARCH_FIELDS:
+        for token in tokenize(student.get(field)):
+            if token not in tokens:
+                tokens.append(token)
+    return tokens
+
+
+def search_filter(search):
+    """Anchored prefix match of every query token against the indexed search_key"""
+    tokens = tokenize(search)
+    if not tokens:
+        return None
+    return {"$and": [{"search_key": re.compile("^" + re.escape(token))} for token in tokens]}
+
+
+def match_kinds(search):
+    """Filters of the matches of `search`, strongest kind first.
+
+    The name starting with the query, then every token matched exactly, then
+    any prefix match: the order match_score mostly ranks them in. Each
+    filter includes the ones after it, so callers exclude what they already
+    fetched. search_key starts with the name tokens, which makes its first
+    positions the name's first words.
+    """
+    tokens = tokenize(search)
+    if not tokens:
+        return []
+    prefix_match = search_filter(search)["$and"]
+    name_start = {f"search_key.{position}": token for position, token in enumerate(tokens[:-1])}
+    name_start[f"search_key.{len(tokens) - 1}"] = re.compile("^" + re.escape(tokens[-1]))
+    return [
+        {"$and": [*prefix_match, name_start]},
+        {"$and": [*prefix_match, {"search_key": {"$all": tokens}}]},
+        {"$and": prefix_match}
+    ]
+
+
+def match_kind(search_key, tokens):
+    """Position in match_kinds() of the strongest kind a search_key matches, None for no match"""
+    if not all(any(key.startswith(token) for key in search_key) for token in tokens):
+        return None
+    last = len(tokens) - 1
+    if len(search_key) > last and search_key[:last] == tokens[:last] and search_key[last].startswith(tokens[last]):
+        return 0
+    if all(token in search_key for token in tokens):
+        return 1
+    return 2
+
+
+def match_score(student, search):
+    """Rank a candidate: exact token hits beat prefix hits, name beats other fields"""
+    query_tokens = tokenize(search)
+    score = 0
+    for weight, field in zip((3, 2, 1), SEARCH_FIELDS):
+        field_tokens = tokenize(student.get(field))
+        for token in query_tokens:
+            if token in field_tokens:
+                score += 2 * weight
+            elif any(t.startswith(token) for t in field_tokens):
+                score += weight
+    if fold(student.get("name") or "").startswith(" ".join(query_tokens)):
+        score += 10
+    return score
+
+
+def rank_students(students, search):
+    return sorted(students, key=lambda student: -match_score(student, search))
+
+
+async def backfill_search_keys(db, batch_size=500, missing_only=False):
+    """Recompute search_key for every student, or only those without one.
+
+    Returns the number of students updated.
+    """
+    projection = {"_id": 0, "id": 1, **{field: 1 for field in SEARCH_FIELDS}}
+    query = {"search_key": {"$exists": False}} if missing_only else {}
+    operations = []
+    updated = 0
+    async for student in db.students.find(query, projection):
+        operations.append(UpdateOne(
+            {"id": student["id"]},
+            {"$set": {"search_key": build_search_key(student)}}
+        ))
+        if len(operations) >= batch_size:
+            await db.students.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await db.students.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    return updated
@@ -1,38 +1,174 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends, Header, Request, Response, UploadFile, File
+from fastapi.responses import JSONResponse, StreamingResponse
+from urllib.parse import quote
+from email.utils import format_datetime
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+import asyncio
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
-from datetime import datetime, date
-import qrcode
+from datetime import datetime, date, timezone
 import base64
-from io import BytesIO
+import binascii
+import hashlib
+import json
 import jwt
-from passlib.hash import bcrypt
 import secrets
 import string
 
+from attendance_store import ATTENDANCE_CODES, NO_RECORD_CODE, new_record, summarize
+from cache import class_tag, create_cache, student_tag
+from indexes import ensure_indexes
+from memory_repositories import MemoryRepositories
+import academic_years
+import grading
+import gradebook_files
+import metrics
+import mongo
+import parent_accounts
+import propagation
+import querydebug
+import read_layer
+from passwords import PasswordService, PasswordServiceBusy
+from qr_codes import QRCodeService, student_payload
+from repositories import (
+    NEWS_SORT, STORAGE_ENGINES, STUDENT_SORT, AttendanceRepo, GradeRepo, MotorRepositories, NewsRepo,
+    OutboxRepo, Repositories, StudentRepo, UserRepo
+)
+import search as student_search
+
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Storage behind the repositories: "mongo", or "memory" to run without a server
+STORAGE_ENGINE = os.environ.get("STORAGE_ENGINE", "mongo")
+if STORAGE_ENGINE not in STORAGE_ENGINES:
+    raise ValueError(f"Unknown STORAGE_ENGINE {STORAGE_ENGINE!r}, expected one of {STORAGE_ENGINES}")
+
+# MongoDB connection, opened and closed by the app lifespan
+MONGO_OPTIONS = mongo.client_options()
+mongo_pool = mongo.PoolMonitor()
+client = None
+
+# Attendance layout: "per_student" documents or compact "class_day" documents
+ATTENDANCE_STORAGE = os.environ.get("ATTENDANCE_STORAGE", "per_student")
+
+# Student renames and class changes are copied to grades and attendance in the background
+PROPAGATION_WORKER = os.environ.get("PROPAGATION_WORKER", "1") == "1"
+propagation_worker = None
+
+# Development mode: count queries per request, warn on collection scans and
+# routes over their query budget (QUERY_BUDGETS is a JSON {route: budget} map)
+query_debugger = None
+if os.environ.get("QUERY_DEBUG") == "1":
+    query_debugger = querydebug.QueryDebugger(
+        default_budget=int(os.environ.get("QUERY_BUDGET", "10")),
+        budgets=json.loads(os.environ.get("QUERY_BUDGETS", "{}"))
+    )
+
+def create_mongo_client():
+    return AsyncIOMotorClient(
+        os.environ['MONGO_URL'],
+        event_listeners=[metrics.MongoCommandMetrics(), mongo_pool],
+        **MONGO_OPTIONS
+    )
 
 # JWT settings
 JWT_SECRET = "phuly_parish_secret_key_2024"
 JWT_ALGORITHM = "HS256"
 
+# Password hashing runs in its own bounded thread pool, never on the event loop
+passwords = PasswordService(
+    workers=int(os.environ.get("PASSWORD_WORKERS", "4")),
+    queue_timeout=float(os.environ.get("PASSWORD_QUEUE_TIMEOUT", "5"))
+)
+
+# QR codes are cached by content and rendered in a process pool
+qr_codes = QRCodeService(
+    cache_dir=os.environ.get("QR_CACHE_DIR", ROOT_DIR / ".qr_cache"),
+    workers=int(os.environ.get("QR_WORKERS", "2"))
+)
+
+# Read cache of rosters, student lookups, gradebooks, stats and news, created by
+# the app lifespan; CACHE_BACKEND=redis shares it (and its invalidations) across workers
+cache = None
+
+# Overview stats are public and hit on every landing page visit
+STATS_CACHE_TTL = float(os.environ.get("STATS_CACHE_TTL", "30"))
+
+# Serialized first page of the public news feed, dropped whenever news is created
+NEWS_CACHE_TTL = float(os.environ.get("NEWS_CACHE_TTL", "300"))
+NEWS_PAGE_SIZE = 100
+
+# Scans one offline device may upload at once, each resolved and written in a single request
+MAX_SCAN_BATCH = int(os.environ.get("MAX_SCAN_BATCH", "500"))
+
+@asynccontextmanager
+async def lifespan(app):
+    """Connect, ensure indexes and warm the pool before serving; close everything after"""
+    global client, cache
+    cache = create_cache()
+    # A malformed ACADEMIC_YEAR fails startup rather than the first request
+    academic_years.current_year()
+    if STORAGE_ENGINE == "memory":
+        app.state.repositories = MemoryRepositories()
+    else:
+        client = create_mongo_client()
+        db = client[os.environ['DB_NAME']]
+        if query_debugger:
+            db = query_debugger.database(db)
+        app.state.repositories = MotorRepositories(db, ATTENDANCE_STORAGE)
+        
+        await ensure_indexes(db)
+        await mongo.warm_pool(client, MONGO_OPTIONS["minPoolSize"])
+        # Students from before parent accounts can only log in once migrated
+        migrated = await parent_accounts.sync_parent_accounts(db, passwords)
+        if migrated:
+            logger.info("Created %d parent accounts from student passwords", migrated)
+        # Students from before search_key are invisible to search until they have one
+        backfilled = await student_search.backfill_search_keys(db, missing_only=True)
+        if backfilled:
+            logger.info("Added search_key to %d students", backfilled)
+    
+    global propagation_worker
+    if PROPAGATION_WORKER:
+        propagation_worker = propagation.PropagationWorker(
+            app.state.repositories,
+            cache=cache,
+            batch_size=int(os.environ.get("PROPAGATION_BATCH_SIZE", "100")),
+            interval=float(os.environ.get("PROPAGATION_INTERVAL", "5")),
+            lease=float(os.environ.get("PROPAGATION_LEASE", "60")),
+            retry_delay=float(os.environ.get("PROPAGATION_RETRY_DELAY", "30"))
+        )
+        propagation_worker.start()
+    app.state.ready = True
+    
+    yield
+    
+    # Fail readiness first so the load balancer drains this instance
+    app.state.ready = False
+    if propagation_worker:
+        await propagation_worker.stop()
+        propagation_worker = None
+    await cache.close()
+    if client:
+        client.close()
+        client = None
+    passwords.shutdown()
+    qr_codes.shutdown()
+
 # Create the main app
-app = FastAPI(title="Giáo Xứ Phú Lý - Hệ Thống Quản Lý")
+app = FastAPI(title="Giáo Xứ Phú Lý - Hệ Thống Quản Lý", lifespan=lifespan)
+app.state.ready = False
 api_router = APIRouter(prefix="/api")
 
 # Security
@@ -61,7 +197,7 @@ class Student(BaseModel):
     birth_date: Optional[str] = None
     parent_name: str
     parent_phone: str
-    parent_password: str  # Password for parent login
+    parent_password: Optional[str] = None  # New parent login, returned once and never stored
     address: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -79,7 +215,7 @@ class Grade(BaseModel):
     student_id: str
     student_name: str
     class_name: str
-    year: str = "2024-2025"
+    year: str = Field(default_factory=academic_years.current_year)
     semester: int = 1  # 1 or 2
     # Excel columns: TX1, TX2, TX3, TX4, GK (Giữa Kỳ), CK (Cuối Kỳ)
     tx1: Optional[float] = None
@@ -118,6 +254,22 @@ class AttendanceCreate(BaseModel):
     method: str = "manual"
     note: Optional[str] = None
 
+class AttendanceBulkEntry(BaseModel):
+    student_id: str
+    status: str = "present"
+    note: Optional[str] = None
+
+class AttendanceBulkCreate(BaseModel):
+    class_name: str
+    date: str
+    method: str = "manual"
+    entries: List[AttendanceBulkEntry]
+
+class QRScan(BaseModel):
+    data: str
+    scanned_at: Optional[datetime] = None
+    device_id: Optional[str] = None
+
 # User Models
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -163,21 +315,108 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# Storage dependencies; override them in app.dependency_overrides to swap a repository
+def get_repositories(request: Request) -> Repositories:
+    return request.app.state.repositories
+
+def get_student_repo(repositories: Repositories = Depends(get_repositories)) -> StudentRepo:
+    return repositories.students
+
+def get_grade_repo(repositories: Repositories = Depends(get_repositories)) -> GradeRepo:
+    return repositories.grades
+
+def get_attendance_repo(repositories: Repositories = Depends(get_repositories)) -> AttendanceRepo:
+    return repositories.attendance
+
+def get_user_repo(repositories: Repositories = Depends(get_repositories)) -> UserRepo:
+    return repositories.users
+
+def get_news_repo(repositories: Repositories = Depends(get_repositories)) -> NewsRepo:
+    return repositories.news
+
+def get_outbox_repo(repositories: Repositories = Depends(get_repositories)) -> OutboxRepo:
+    return repositories.outbox
+
 def generate_password(length=8):
     """Generate random password for parents"""
     characters = string.ascii_letters + string.digits
     return ''.join(secrets.choice(characters) for _ in range(length))
 
+def parse_student_qr(data):
+    """Student id of a STUDENT:{id}:{name} payload, or None when malformed"""
+    parts = data.split(":", 2)
+    if len(parts) < 2 or parts[0] != "STUDENT" or not parts[1]:
+        return None
+    return parts[1]
+
+def requested_year(year):
+    """Academic year of a ?year= value, the current one when omitted; 400 when malformed"""
+    if not year:
+        return academic_years.current_year()
+    try:
+        academic_years.parse_year(year)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return year
+
+def attendance_date(scanned_at):
+    """Local YYYY-MM-DD of a scan, today when the time is unknown"""
+    if not scanned_at:
+        return datetime.now().strftime("%Y-%m-%d")
+    if scanned_at.tzinfo:
+        scanned_at = scanned_at.astimezone()
+    return scanned_at.strftime("%Y-%m-%d")
+
+def encode_cursor(key):
+    """Opaque keyset cursor from the sort key of the last row of a page"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor, size):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, list) or len(key) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+STUDENT_CURSOR_FIELDS = tuple(field for field, _ in STUDENT_SORT)
+
+def encode_student_cursor(student):
+    """Opaque keyset cursor pointing just after the given student"""
+    return encode_cursor([student["class_name"], student["name"], student["id"]])
+
+def decode_student_cursor(cursor):
+    """Turn an opaque cursor back into the (class_name, name, id) key it points after"""
+    return tuple(decode_cursor(cursor, 3))
+
+NEWS_CURSOR_FIELDS = tuple(field for field, _ in NEWS_SORT)
+
+def encode_news_cursor(news):
+    return encode_cursor([news["created_at"].isoformat(), news["id"]])
+
+def decode_news_cursor(cursor):
+    created_at, news_id = decode_cursor(cursor, 2)
+    try:
+        created_at = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, news_id
+
+def student_document(student_obj):
+    """Stored form of a student, including its folded search_key"""
+    student_doc = student_obj.dict(exclude={"parent_password"})
+    student_doc["search_key"] = student_search.build_search_key(student_doc)
+    return student_doc
+
 # Auth endpoints
 @api_router.post("/auth/teacher-login", response_model=TokenResponse)
-async def teacher_login(login_data: UserLogin):
-    user = await db.users.find_one({"username": login_data.username})
-    if not user or not bcrypt.verify(login_data.password, user["password_hash"]):
+async def teacher_login(login_data: UserLogin, user_repo: UserRepo = Depends(get_user_repo)):
+    user = await user_repo.by_username(login_data.username)
+    if not user or not await passwords.verify(login_data.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    # Clean up ObjectId
-    if "_id" in user:
-        del user["_id"]
+    user_info = {key: value for key, value in user.items() if key != "password_hash"}
     
     token_data = {
         "user_id": user["id"],
@@ -192,26 +431,31 @@ async def teacher_login(login_data: UserLogin):
         access_token=token,
         token_type="bearer",
         user_type="teacher",
-        user_info=user
+        user_info=user_info
     )
 
 @api_router.post("/auth/parent-login", response_model=TokenResponse)
-async def parent_login(login_data: ParentLogin):
-    student = await db.students.find_one({
-        "parent_phone": login_data.phone,
-        "parent_password": login_data.password
-    })
-    
-    if not student:
+async def parent_login(
+    login_data: ParentLogin,
+    user_repo: UserRepo = Depends(get_user_repo),
+    student_repo: StudentRepo = Depends(get_student_repo)
+):
+    account = await user_repo.parent_account(login_data.phone)
+    if not account or not await passwords.verify(login_data.password, account["password_hash"]):
         raise HTTPException(status_code=401, detail="Số điện thoại hoặc mật khẩu không đúng")
     
-    # Clean up ObjectId
-    if "_id" in student:
-        del student["_id"]
+    students = await student_repo.get_many(
+        account["student_ids"], read_layer.exclude(*read_layer.STUDENT_PRIVATE_FIELDS)
+    )
+    students.sort(key=lambda student: student["name"])
+    if not students:
+        raise HTTPException(status_code=401, detail="Số điện thoại hoặc mật khẩu không đúng")
     
+    # Every linked child goes into the token so later requests authorize from claims
     token_data = {
-        "student_id": student["id"],
-        "parent_phone": student["parent_phone"],
+        "student_id": students[0]["id"],
+        "student_ids": [student["id"] for student in students],
+        "parent_phone": account["phone"],
         "user_type": "parent"
     }
     
@@ -222,169 +466,264 @@ async def parent_login(login_data: ParentLogin):
         token_type="bearer",
         user_type="parent",
         user_info={
-            "student": student,
-            "parent_name": student["parent_name"],
-            "parent_phone": student["parent_phone"]
+            "student": students[0],
+            "students": students,
+            "parent_name": account["parent_name"],
+            "parent_phone": account["phone"]
         }
     )
 
+# User endpoints
+@api_router.post("/users")
+async def create_user(
+    user: UserCreate,
+    token_data: dict = Depends(verify_token),
+    user_repo: UserRepo = Depends(get_user_repo)
+):
+    if token_data["user_type"] != "teacher" or token_data.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can create users")
+    
+    user_dict = user.dict(exclude={"password"})
+    user_dict["password_hash"] = await passwords.hash(user.password)
+    user_obj = User(**user_dict)
+    
+    try:
+        await user_repo.insert(user_obj.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    await cache.invalidate("stats")
+    
+    return user_obj.dict(exclude={"password_hash"})
+
 # Student endpoints
 @api_router.post("/students", response_model=Student)
-async def create_student(student: StudentCreate, token_data: dict = Depends(verify_token)):
+async def create_student(
+    student: StudentCreate,
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    user_repo: UserRepo = Depends(get_user_repo)
+):
     if token_data["user_type"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can create students")
     
-    # Generate password for parent
-    parent_password = generate_password()
+    student_obj = Student(**student.dict())
     
-    student_dict = student.dict()
-    student_dict["parent_password"] = parent_password
-    student_obj = Student(**student_dict)
+    # Siblings share one parent login; a new phone gets a generated password, shown only now
+    student_obj.parent_password = await parent_accounts.attach_student(
+        user_repo, passwords, student_obj.id, student.parent_phone, student.parent_name, generate_password()
+    )
     
-    await db.students.insert_one(student_obj.dict())
+    await student_repo.insert(student_document(student_obj))
+    await cache.invalidate("stats", class_tag(student_obj.class_name))
     return student_obj
 
+async def load_student_page(student_repo, class_name, key, limit, selected):
+    """One page of the student list, with the cursor of the next page when there is one"""
+    projection = read_layer.projection(selected, STUDENT_CURSOR_FIELDS)
+    
+    # Fetch one extra row to know whether another page exists
+    students = await student_repo.list(class_name, key, limit + 1 if limit else None, projection)
+    next_cursor = None
+    if limit and len(students) > limit:
+        students = students[:limit]
+        next_cursor = encode_student_cursor(students[-1])
+    
+    return {
+        "students": read_layer.drop_unselected(students, selected, STUDENT_CURSOR_FIELDS),
+        "next_cursor": next_cursor
+    }
+
+async def cached_student(student_repo, student_id):
+    """Public student profile, cached for the lookups every scan, mark and grade entry repeat"""
+    return await cache.get_or_load(
+        f"student:{student_id}",
+        lambda: student_repo.get(student_id, read_layer.exclude(*read_layer.STUDENT_PRIVATE_FIELDS)),
+        tags=[student_tag(student_id)]
+    )
+
 @api_router.get("/students", response_model=List[Student])
 async def get_students(
     class_name: Optional[str] = Query(None),
     search: Optional[str] = Query(None),
-    token_data: dict = Depends(verify_token)
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = Query(None),
+    stream: Optional[str] = Query(None, pattern="^ndjson$"),
+    fields: Optional[str] = Query(None),
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo)
 ):
     if token_data["user_type"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can access student list")
     
-    query = {}
-    if class_name:
-        query["class_name"] = class_name
+    selected = read_layer.select_fields(fields, read_layer.STUDENT_FIELDS, read_layer.STUDENT_DEFAULT_FIELDS)
+    
     if search:
-        query["$or"] = [
-            {"name": {"$regex": search, "$options": "i"}},
-            {"class_name": {"$regex": search, "$options": "i"}},
-            {"parent_name": {"$regex": search, "$options": "i"}}
-        ]
+        # Results are ranked, not in cursor order, so they come as one page
+        if after or stream:
+            raise HTTPException(status_code=400, detail="after and stream cannot be combined with search")
+        # Indexed prefix lookup on the folded search_key, then rank by match quality
+        required = (*STUDENT_CURSOR_FIELDS, *student_search.SEARCH_FIELDS)
+        candidates = await student_repo.search(search, class_name, read_layer.projection(selected, required))
+        students = student_search.rank_students(candidates, search)[:limit or 50]
+        return read_layer.json_response(read_layer.drop_unselected(students, selected, required))
+    
+    key = decode_student_cursor(after) if after else None
+    projection = read_layer.projection(selected, STUDENT_CURSOR_FIELDS)
+    
+    if stream:
+        # Yield rows as the cursor delivers them so memory stays flat
+        async def student_lines():
+            async for student in student_repo.iterate(class_name, key, limit, projection):
+                read_layer.drop_unselected([student], selected, STUDENT_CURSOR_FIELDS)
+                yield read_layer.dumps(student) + b"\n"
+        
+        return StreamingResponse(student_lines(), media_type="application/x-ndjson")
     
-    students_cursor = db.students.find(query)
-    students = await students_cursor.to_list(1000)
+    async def load_page():
+        return await load_student_page(student_repo, class_name, key, limit, selected)
     
-    # Clean up ObjectId
-    cleaned_students = []
-    for student in students:
-        if "_id" in student:
-            del student["_id"]
-        cleaned_students.append(Student(**student))
+    # Class rosters are the most repeated read; cached until the class changes
+    if class_name:
+        page = await cache.get_or_load(
+            f"roster:{class_name}:{','.join(selected)}:{limit or ''}:{after or ''}",
+            load_page,
+            tags=[class_tag(class_name)]
+        )
+    else:
+        page = await load_page()
     
-    return cleaned_students
+    headers = {"X-Next-Cursor": page["next_cursor"]} if page["next_cursor"] else None
+    return read_layer.json_response(page["students"], headers=headers)
 
 @api_router.put("/students/{student_id}")
 async def update_student(
     student_id: str,
     student_update: StudentCreate,
-    token_data: dict = Depends(verify_token)
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    user_repo: UserRepo = Depends(get_user_repo),
+    outbox_repo: OutboxRepo = Depends(get_outbox_repo)
 ):
     if token_data["user_type"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can update students")
     
-    result = await db.students.update_one(
-        {"id": student_id},
-        {"$set": student_update.dict(exclude_unset=True)}
+    student_fields = student_update.dict(exclude_unset=True)
+    student_fields["search_key"] = student_search.build_search_key(student_update.dict())
+    previous = await student_repo.update(
+        student_id,
+        student_fields,
+        projection={"_id": 0, "name": 1, "class_name": 1, "parent_phone": 1}
     )
     
-    if result.matched_count == 0:
+    if not previous:
         raise HTTPException(status_code=404, detail="Student not found")
     
+    # Grades and attendance copy the name and class; the worker rewrites them
+    if student_update.name != previous["name"] or student_update.class_name != previous["class_name"]:
+        await outbox_repo.enqueue(propagation.change_entry(student_id, [previous["class_name"]]))
+        if propagation_worker:
+            propagation_worker.notify()
+    
+    # Move the student to the parent account of the new phone
+    parent_password = None
+    if student_update.parent_phone != previous["parent_phone"]:
+        await parent_accounts.detach_student(user_repo, student_id, previous["parent_phone"])
+        parent_password = await parent_accounts.attach_student(
+            user_repo, passwords, student_id, student_update.parent_phone,
+            student_update.parent_name, generate_password()
+        )
+    
+    await cache.invalidate(
+        "stats", student_tag(student_id), class_tag(previous["class_name"]), class_tag(student_update.class_name)
+    )
+    
+    if parent_password:
+        return {"message": "Student updated successfully", "parent_password": parent_password}
     return {"message": "Student updated successfully"}
 
+@api_router.post("/students/{student_id}/parent-password")
+async def reset_parent_password(
+    student_id: str,
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    user_repo: UserRepo = Depends(get_user_repo)
+):
+    """New password for the parent login of a student and its siblings, shown only in this response"""
+    if token_data["user_type"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can reset parent passwords")
+    
+    student = await student_repo.get(student_id, {"_id": 0, "id": 1, "parent_name": 1, "parent_phone": 1})
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    parent_password = await parent_accounts.reset_password(user_repo, passwords, student, generate_password())
+    return {"parent_phone": student["parent_phone"], "parent_password": parent_password}
+
 # Grade endpoints
+def semester_grades(grades):
+    """A student's grade records by semester, with averages and status"""
+    by_semester = {grade["semester"]: grade for grade in grades}
+    semester_1 = by_semester.get(1)
+    semester_2 = by_semester.get(2)
+    return {
+        "semester_1": semester_1,
+        "semester_2": semester_2,
+        **grading.student_result(semester_1, semester_2)
+    }
+
 @api_router.get("/grades/student/{student_id}")
-async def get_student_grades(student_id: str, token_data: dict = Depends(verify_token)):
+async def get_student_grades(
+    student_id: str,
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    grade_repo: GradeRepo = Depends(get_grade_repo)
+):
     # Allow both teachers and parents (if it's their child)
     if token_data["user_type"] == "parent":
-        if token_data["student_id"] != student_id:
+        if student_id not in token_data.get("student_ids", [token_data["student_id"]]):
             raise HTTPException(status_code=403, detail="Parents can only view their own child's grades")
     elif token_data["user_type"] != "teacher":
         raise HTTPException(status_code=403, detail="Access denied")
     
     # Get student info
-    student = await db.students.find_one({"id": student_id})
+    student = await student_repo.get(student_id, read_layer.exclude(*read_layer.STUDENT_PRIVATE_FIELDS))
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    # Clean up ObjectId
-    if "_id" in student:
-        del student["_id"]
-    
-    # Get grades for both semesters
-    grades_cursor = db.grades.find({"student_id": student_id})
-    grades = await grades_cursor.to_list(1000)
+    # Get grades for both semesters of the current year
+    grades = await grade_repo.for_student(student_id, academic_years.current_year())
     
-    # Clean up ObjectId and organize by semester
-    semester_1 = None
-    semester_2 = None
-    
-    for grade in grades:
-        if "_id" in grade:
-            del grade["_id"]
-        
-        if grade["semester"] == 1:
-            semester_1 = grade
-        elif grade["semester"] == 2:
-            semester_2 = grade
-    
-    # Calculate averages and final result
-    def calculate_semester_average(grade_record):
-        if not grade_record:
-            return 0
-        
-        scores = []
-        # TX scores (if available)
-        for tx in [grade_record.get("tx1"), grade_record.get("tx2"), 
-                   grade_record.get("tx3"), grade_record.get("tx4")]:
-            if tx is not None:
-                scores.append(tx)
-        
-        gk = grade_record.get("gk")
-        ck = grade_record.get("ck")
-        
-        if not scores and not gk and not ck:
-            return 0
-        
-        # Calculate average: TX average + GK*2 + CK*3 / 6
-        tx_avg = sum(scores) / len(scores) if scores else 0
-        
-        total_weight = 0
-        total_score = 0
-        
-        if scores:
-            total_score += tx_avg * 1
-            total_weight += 1
-        
-        if gk is not None:
-            total_score += gk * 2
-            total_weight += 2
-        
-        if ck is not None:
-            total_score += ck * 3
-            total_weight += 3
-        
-        return total_score / total_weight if total_weight > 0 else 0
+    return read_layer.json_response({"student": student, **semester_grades(grades)})
+
+@api_router.get("/grades/class/{class_name}")
+async def get_class_gradebook(
+    class_name: str,
+    year: Optional[str] = Query(None),
+    semester: Optional[int] = Query(None, ge=1, le=2),
+    token_data: dict = Depends(verify_token),
+    grade_repo: GradeRepo = Depends(get_grade_repo)
+):
+    if token_data["user_type"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can view the class gradebook")
     
-    sem1_avg = calculate_semester_average(semester_1)
-    sem2_avg = calculate_semester_average(semester_2)
+    # The whole class in one indexed query, only the columns the batch needs
+    year = requested_year(year)
+    projection = {"_id": 0, "student_id": 1, "student_name": 1, "semester": 1}
+    projection.update({field: 1 for field in grading.SCORE_FIELDS})
     
-    # Final average
-    final_avg = (sem1_avg + sem2_avg) / 2 if sem1_avg > 0 and sem2_avg > 0 else max(sem1_avg, sem2_avg)
+    async def load_gradebook():
+        grade_records = await grade_repo.class_records(class_name, year, semester, projection)
+        return grading.class_gradebook(grade_records, semester)
     
-    # Determine status
-    status = "Lên lớp" if final_avg >= 6.5 else "Học lại"
+    gradebook = await cache.get_or_load(
+        f"gradebook:{class_name}:{year}:{semester or ''}", load_gradebook, tags=[class_tag(class_name)]
+    )
     
     return {
-        "student": student,
-        "semester_1": semester_1,
-        "semester_2": semester_2,
-        "semester_1_average": round(sem1_avg, 2),
-        "semester_2_average": round(sem2_avg, 2),
-        "final_average": round(final_avg, 2),
-        "status": status
+        "class_name": class_name,
+        "year": year,
+        "semester": semester,
+        **gradebook
     }
 
 @api_router.put("/grades/student/{student_id}/semester/{semester}")
@@ -392,287 +731,632 @@ async def update_grades(
     student_id: str,
     semester: int,
     grade_update: GradeUpdate,
-    token_data: dict = Depends(verify_token)
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    grade_repo: GradeRepo = Depends(get_grade_repo)
 ):
     if token_data["user_type"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can update grades")
     
     # Get student info
-    student = await db.students.find_one({"id": student_id})
+    student = await cached_student(student_repo, student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    # Check if grade record exists
-    existing_grade = await db.grades.find_one({
-        "student_id": student_id,
-        "semester": semester
-    })
+    # Single upsert; the unique (student_id, year, semester) index keeps it race-free
+    grade_fields = grade_update.dict(exclude_unset=True)
+    new_grade = Grade(
+        student_id=student_id,
+        student_name=student["name"],
+        class_name=student["class_name"],
+        semester=semester
+    ).dict()
+    await grade_repo.upsert(
+        student_id,
+        new_grade["year"],
+        semester,
+        grade_fields,
+        {k: v for k, v in new_grade.items() if k not in grade_fields}
+    )
     
-    if existing_grade:
-        # Update existing record
-        await db.grades.update_one(
-            {"student_id": student_id, "semester": semester},
-            {"$set": grade_update.dict(exclude_unset=True)}
-        )
-    else:
-        # Create new record
-        grade_dict = grade_update.dict(exclude_unset=True)
-        grade_dict.update({
-            "student_id": student_id,
-            "student_name": student["name"],
-            "class_name": student["class_name"],
-            "semester": semester
-        })
-        grade_obj = Grade(**grade_dict)
-        await db.grades.insert_one(grade_obj.dict())
+    # Materialize averages and status so reads never recompute them
+    await grade_repo.recompute_averages([student_id], new_grade["year"])
+    await cache.invalidate(class_tag(student["class_name"]))
     
     return {"message": "Grades updated successfully"}
 
+@api_router.get("/grades/export")
+async def export_grades(
+    class_name: Optional[str] = Query(None),
+    year: Optional[str] = Query(None),
+    semester: Optional[int] = Query(None, ge=1, le=2),
+    format: str = Query("xlsx", pattern="^(xlsx|csv)$"),
+    token_data: dict = Depends(verify_token),
+    grade_repo: GradeRepo = Depends(get_grade_repo)
+):
+    if token_data["user_type"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can export grades")
+    
+    year = requested_year(year)
+    projection = {"_id": 0}
+    projection.update({column: 1 for column in gradebook_files.EXPORT_COLUMNS})
+    
+    # Rows are written as the cursor is read; nothing is held for the whole export
+    grades_cursor = grade_repo.export(class_name, year, semester, projection)
+    filename = quote(f"Điểm {class_name or 'tất cả'} {year}.{format}")
+    return StreamingResponse(
+        gradebook_files.export_chunks(grades_cursor, format),
+        media_type=gradebook_files.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{filename}"}
+    )
+
+async def read_upload(file, limit):
+    """Bytes of an uploaded file, read in chunks and refused with a 413 past `limit`"""
+    too_large = HTTPException(status_code=413, detail=f"The file is larger than {limit // (1024 * 1024)} MB")
+    if file.size is not None and file.size > limit:
+        raise too_large
+    content = bytearray()
+    while chunk := await file.read(64 * 1024):
+        content += chunk
+        if len(content) > limit:
+            raise too_large
+    return bytes(content)
+
+@api_router.post("/grades/import")
+async def import_grades(
+    file: UploadFile = File(...),
+    year: Optional[str] = Query(None),
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    grade_repo: GradeRepo = Depends(get_grade_repo)
+):
+    if token_data["user_type"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can import grades")
+    
+    year = requested_year(year)
+    
+    # Parse and validate the whole sheet off the event loop
+    content = await read_upload(file, gradebook_files.MAX_IMPORT_BYTES)
+    loop = asyncio.get_running_loop()
+    try:
+        frame = await loop.run_in_executor(None, gradebook_files.read_sheet, content, file.filename or "")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Could not read the sheet, upload a .xlsx or .csv file")
+    try:
+        rows, errors = await loop.run_in_executor(None, gradebook_files.validate_rows, frame, year)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    total = len(rows) + len(errors)
+    
+    # Every student of the sheet in one query
+    students = {
+        student["id"]: student
+        for student in await student_repo.get_many(
+            {row["student_id"] for row in rows}, {"_id": 0, "id": 1, "name": 1, "class_name": 1}
+        )
+    }
+    
+    upserts = []
+    applied_rows = []
+    for row in rows:
+        student = students.get(row["student_id"])
+        if not student:
+            errors.append({"row": row["row"], "student_id": row["student_id"], "error": "Student not found"})
+            continue
+        # Students change class at rollover, so only a current-year class must match
+        if row["class_name"] and year == academic_years.current_year() and row["class_name"] != student["class_name"]:
+            errors.append({
+                "row": row["row"],
+                "student_id": row["student_id"],
+                "error": f"class_name is {row['class_name']}, the student is in {student['class_name']}"
+            })
+            continue
+        # Same upsert as update_grades; blank cells leave stored scores unchanged
+        new_grade = Grade(
+            student_id=student["id"],
+            student_name=student["name"],
+            class_name=student["class_name"],
+            year=year,
+            semester=row["semester"]
+        ).dict()
+        upserts.append((
+            student["id"],
+            year,
+            row["semester"],
+            row["scores"],
+            {k: v for k, v in new_grade.items() if k not in row["scores"]}
+        ))
+        applied_rows.append(row)
+    
+    created = set()
+    write_errors = {}
+    if upserts:
+        created, write_errors = await grade_repo.bulk_upsert(upserts)
+        for index, message in write_errors.items():
+            row = applied_rows[index]
+            errors.append({"row": row["row"], "student_id": row["student_id"], "error": message})
+        await grade_repo.recompute_averages({row["student_id"] for row in applied_rows}, year)
+        await cache.invalidate(*{class_tag(students[row["student_id"]]["class_name"]) for row in applied_rows})
+    
+    errors.sort(key=lambda error: error["row"])
+    return {
+        "total": total,
+        "applied": len(applied_rows) - len(write_errors),
+        "created": len(created),
+        "errors": errors
+    }
+
 # Attendance endpoints
 @api_router.get("/attendance/class/{class_name}")
 async def get_class_attendance(
     class_name: str,
     date: Optional[str] = Query(None),
-    token_data: dict = Depends(verify_token)
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    attendance_repo: AttendanceRepo = Depends(get_attendance_repo)
 ):
     if token_data["user_type"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can view attendance")
     
     # Get all students in class
-    students_cursor = db.students.find({"class_name": class_name})
-    students = await students_cursor.to_list(1000)
+    students = await student_repo.list(class_name, projection=read_layer.projection(read_layer.STUDENT_DEFAULT_FIELDS))
     
-    query = {"class_name": class_name}
-    if date:
-        query["date"] = date
+    # Get attendance records of the day, or of the current year
+    attendance_records = await attendance_repo.class_records(
+        class_name, date, academic_years.date_range(academic_years.current_year())
+    )
     
-    # Get attendance records
-    attendance_cursor = db.attendance.find(query)
-    attendance_records = await attendance_cursor.to_list(1000)
+    return read_layer.json_response({
+        "students": students,
+        "attendance_records": attendance_records,
+        "class_name": class_name,
+        "date": date
+    })
+
+def parse_day(value, name):
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} date, expected YYYY-MM-DD")
+
+@api_router.get("/attendance/class/{class_name}/matrix")
+async def get_class_attendance_matrix(
+    class_name: str,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    token_data: dict = Depends(verify_token),
+    attendance_repo: AttendanceRepo = Depends(get_attendance_repo)
+):
+    if token_data["user_type"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can view attendance")
     
-    # Clean up ObjectId
-    for record in attendance_records:
-        if "_id" in record:
-            del record["_id"]
+    # Defaults to the academic year up to today
+    date_to = parse_day(date_to, "to") if date_to else attendance_date(None)
+    if date_from:
+        date_from = parse_day(date_from, "from")
+    else:
+        date_from, _ = academic_years.date_range(academic_years.year_of(date.fromisoformat(date_to)))
     
-    # Create attendance matrix
-    attendance_dict = {}
-    for record in attendance_records:
-        key = f"{record['student_id']}_{record['date']}"
-        attendance_dict[key] = record
+    matrix = await attendance_repo.class_matrix(class_name, date_from, date_to)
     
     return {
-        "students": students,
-        "attendance_records": attendance_records,
         "class_name": class_name,
-        "date": date
+        "from": date_from,
+        "to": date_to,
+        "codes": {**{code: status for status, code in ATTENDANCE_CODES.items()}, NO_RECORD_CODE: None},
+        **matrix
     }
 
 @api_router.post("/attendance")
 async def create_attendance(
     attendance: AttendanceCreate,
-    token_data: dict = Depends(verify_token)
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    attendance_repo: AttendanceRepo = Depends(get_attendance_repo)
 ):
     if token_data["user_type"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can mark attendance")
     
     # Get student info
-    student = await db.students.find_one({"id": attendance.student_id})
+    student = await cached_student(student_repo, attendance.student_id)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    # Check if attendance already exists for this date
-    existing = await db.attendance.find_one({
-        "student_id": attendance.student_id,
-        "date": attendance.date
-    })
+    _, errors = await attendance_repo.record([new_record(
+        student,
+        attendance.date,
+        attendance.status,
+        attendance.method,
+        attendance.note,
+        token_data["username"]
+    )])
+    if errors:
+        raise HTTPException(status_code=400, detail=errors[0])
+    if attendance.date == attendance_date(None):
+        await cache.invalidate("stats")
+    
+    return {"message": "Attendance recorded successfully"}
+
+@api_router.post("/attendance/bulk")
+async def create_attendance_bulk(
+    bulk: AttendanceBulkCreate,
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    attendance_repo: AttendanceRepo = Depends(get_attendance_repo)
+):
+    if token_data["user_type"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can mark attendance")
     
-    if existing:
-        # Update existing
-        await db.attendance.update_one(
-            {"student_id": attendance.student_id, "date": attendance.date},
-            {"$set": {
-                "status": attendance.status,
-                "method": attendance.method,
-                "note": attendance.note,
-                "recorded_by": token_data["username"]
-            }}
+    # Resolve every student of the request in one query
+    students = {
+        student["id"]: student
+        for student in await student_repo.get_many(
+            {entry.student_id for entry in bulk.entries}, {"_id": 0, "id": 1, "name": 1, "class_name": 1}
         )
-    else:
-        # Create new
-        attendance_dict = attendance.dict()
-        attendance_dict.update({
-            "student_name": student["name"],
-            "class_name": student["class_name"],
-            "recorded_by": token_data["username"]
-        })
-        attendance_obj = Attendance(**attendance_dict)
-        await db.attendance.insert_one(attendance_obj.dict())
+    }
     
-    return {"message": "Attendance recorded successfully"}
+    results = []
+    records = []
+    record_rows = []  # results index of each record
+    for entry in bulk.entries:
+        student = students.get(entry.student_id)
+        if not student:
+            results.append({"student_id": entry.student_id, "result": "error", "detail": "Student not found"})
+            continue
+        if student["class_name"] != bulk.class_name:
+            results.append({"student_id": entry.student_id, "result": "error", "detail": "Student is not in this class"})
+            continue
+        
+        records.append(new_record(
+            student, bulk.date, entry.status, bulk.method, entry.note, token_data["username"]
+        ))
+        record_rows.append(len(results))
+        results.append({"student_id": entry.student_id, "result": "updated"})
+    
+    if records:
+        # One unordered bulk write; a failing row does not stop the rest
+        created, errors = await attendance_repo.record(records)
+        for index, row in enumerate(record_rows):
+            if index in errors:
+                results[row].update(result="error", detail=errors[index])
+            elif index in created:
+                results[row]["result"] = "created"
+        if bulk.date == attendance_date(None):
+            await cache.invalidate("stats")
+    
+    return {
+        "class_name": bulk.class_name,
+        "date": bulk.date,
+        "results": results
+    }
 
 # QR Code endpoints
 @api_router.get("/qr-code/{student_id}")
-async def generate_qr_code(student_id: str, token_data: dict = Depends(verify_token)):
+async def generate_qr_code(
+    student_id: str,
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo)
+):
     if token_data["user_type"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can generate QR codes")
     
-    student = await db.students.find_one({"id": student_id})
+    # Public profile only; the payload needs just id and name
+    student = await student_repo.get(student_id, read_layer.exclude(*read_layer.STUDENT_PRIVATE_FIELDS))
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    # Clean up ObjectId
-    if "_id" in student:
-        del student["_id"]
-    
-    # Generate QR code data
-    qr_data = f"STUDENT:{student_id}:{student['name']}"
-    
-    # Create QR code
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(qr_data)
-    qr.make(fit=True)
-    
-    # Create image
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
+    png = await qr_codes.png(student_payload(student))
+    img_str = base64.b64encode(png).decode()
     
     return {
         "qr_code": f"data:image/png;base64,{img_str}",
         "student": student
     }
 
+@api_router.get("/qr-code/class/{class_name}")
+async def generate_class_qr_codes(
+    class_name: str,
+    format: str = Query("pdf", pattern="^(pdf|zip)$"),
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo)
+):
+    if token_data["user_type"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can generate QR codes")
+    
+    students = await student_repo.list(class_name, projection={"_id": 0, "id": 1, "name": 1, "class_name": 1})
+    if not students:
+        raise HTTPException(status_code=404, detail="No students in this class")
+    
+    sheet = await qr_codes.sheet(
+        [(student["name"], student_payload(student)) for student in students],
+        format
+    )
+    
+    media_type = "application/pdf" if format == "pdf" else "application/zip"
+    filename = quote(f"QR {class_name}.{format}")
+    return Response(
+        content=sheet,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{filename}"}
+    )
+
 @api_router.post("/scan-qr")
-async def scan_qr_attendance(qr_data: dict, token_data: dict = Depends(verify_token)):
+async def scan_qr_attendance(
+    qr_data: dict,
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    attendance_repo: AttendanceRepo = Depends(get_attendance_repo)
+):
     if token_data["user_type"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can scan QR codes")
     
-    try:
-        data = qr_data.get("data", "")
-        if not data.startswith("STUDENT:"):
-            raise HTTPException(status_code=400, detail="Invalid QR code")
-        
-        parts = data.split(":")
-        student_id = parts[1]
-        
-        # Check if student exists
-        student = await db.students.find_one({"id": student_id})
-        if not student:
-            raise HTTPException(status_code=404, detail="Student not found")
-        
-        # Clean up ObjectId
-        if "_id" in student:
-            del student["_id"]
-        
-        # Create attendance record for today
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        # Check if already marked today
-        existing = await db.attendance.find_one({
-            "student_id": student_id,
-            "date": today
-        })
-        
-        if existing:
-            return {"message": "Đã điểm danh hôm nay", "student": student}
-        
-        # Create attendance record
-        attendance_obj = Attendance(
-            student_id=student_id,
-            student_name=student["name"],
-            class_name=student["class_name"],
-            date=today,
-            status="present",
-            method="qr_code",
-            recorded_by=token_data["username"]
+    student_id = parse_student_qr(str(qr_data.get("data", "")))
+    if not student_id:
+        raise HTTPException(status_code=400, detail="Invalid QR code")
+    
+    student = await cached_student(student_repo, student_id)
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    # First scan of the day wins; a repeat scan leaves the record as is
+    today = attendance_date(None)
+    created, errors = await attendance_repo.record(
+        [new_record(student, today, "present", "qr_code", None, token_data["username"])],
+        overwrite=False
+    )
+    if errors:
+        raise HTTPException(status_code=400, detail=errors[0])
+    
+    if not created:
+        return {"message": "Đã điểm danh hôm nay", "student": student}
+    await count_today_scans(today, 1)
+    
+    return {"message": f"Điểm danh thành công cho {student['name']}", "student": student}
+
+@api_router.post("/scan-qr/batch")
+async def scan_qr_attendance_batch(
+    scans: List[QRScan],
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    attendance_repo: AttendanceRepo = Depends(get_attendance_repo)
+):
+    if token_data["user_type"] != "teacher":
+        raise HTTPException(status_code=403, detail="Only teachers can scan QR codes")
+    if len(scans) > MAX_SCAN_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_SCAN_BATCH} scans per batch")
+    
+    # Validate and dedupe in memory; the first scan of a student per day wins
+    results = []
+    scan_times = []  # aware UTC; a time without an offset is the device's, i.e. local, time
+    pending = {}  # (student_id, date) -> results index
+    for index, scan in enumerate(scans):
+        result = {"index": index, "device_id": scan.device_id}
+        results.append(result)
+        scan_times.append(scan.scanned_at.astimezone(timezone.utc) if scan.scanned_at else None)
+        student_id = parse_student_qr(scan.data)
+        if not student_id:
+            result["status"] = "invalid"
+            continue
+        key = (student_id, attendance_date(scan_times[index]))
+        result.update(student_id=student_id, date=key[1])
+        if key in pending:
+            result["status"] = "duplicate"
+            continue
+        pending[key] = index
+    
+    students = {
+        student["id"]: student
+        for student in await student_repo.get_many(
+            {student_id for student_id, _ in pending}, {"_id": 0, "id": 1, "name": 1, "class_name": 1}
         )
-        await db.attendance.insert_one(attendance_obj.dict())
-        
-        return {"message": f"Điểm danh thành công cho {student['name']}", "student": student}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing QR code: {str(e)}")
+    }
+    
+    records = []
+    record_rows = []
+    for (student_id, scan_date), index in pending.items():
+        student = students.get(student_id)
+        if not student:
+            results[index]["status"] = "not_found"
+            continue
+        # Stored naive UTC, like every created_at
+        scanned_at = scan_times[index] and scan_times[index].replace(tzinfo=None)
+        records.append(new_record(
+            student, scan_date, "present", "qr_code", None, token_data["username"], recorded_at=scanned_at
+        ))
+        record_rows.append(index)
+        results[index].update(status="already_marked", student_name=student["name"])
+    
+    if records:
+        created, errors = await attendance_repo.record(records, overwrite=False)
+        for record_index, index in enumerate(record_rows):
+            if record_index in errors:
+                results[index].update(status="error", detail=errors[record_index])
+            elif record_index in created:
+                results[index]["status"] = "recorded"
+        today = attendance_date(None)
+        await count_today_scans(today, sum(
+            1 for result in results if result.get("status") == "recorded" and result["date"] == today
+        ))
+    
+    return {"results": results}
 
 # News endpoints
+async def load_news_page(news_repo, before, limit, selected):
+    """One serialized feed page with its validators"""
+    news_list = await news_repo.published(
+        decode_news_cursor(before) if before else None,
+        limit + 1,
+        read_layer.projection(selected, NEWS_CURSOR_FIELDS)
+    )
+    
+    next_cursor = None
+    if len(news_list) > limit:
+        news_list = news_list[:limit]
+        next_cursor = encode_news_cursor(news_list[-1])
+    
+    last_modified = max((news["created_at"] for news in news_list), default=None)
+    body = read_layer.dumps(read_layer.drop_unselected(news_list, selected, NEWS_CURSOR_FIELDS))
+    return {
+        "body": body.decode(),
+        "etag": '"' + hashlib.sha1(body).hexdigest() + '"',
+        "last_modified": format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True) if last_modified else None,
+        "next_cursor": next_cursor
+    }
+
 @api_router.get("/news", response_model=List[News])
-async def get_news():
-    news_cursor = db.news.find({"published": True}).sort("created_at", -1)
-    news_list = await news_cursor.to_list(100)
+async def get_news(
+    before: Optional[str] = Query(None),
+    limit: int = Query(NEWS_PAGE_SIZE, ge=1, le=NEWS_PAGE_SIZE),
+    fields: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None),
+    news_repo: NewsRepo = Depends(get_news_repo)
+):
+    if before:
+        decode_news_cursor(before)  # reject a malformed cursor before it reaches the database
+    selected = read_layer.select_fields(fields, read_layer.NEWS_FIELDS, read_layer.NEWS_DEFAULT_FIELDS)
+    
+    # Only the first page at the default size is cached, once per field set:
+    # cursors and limits come from anonymous callers, so caching every page
+    # would let anyone add entries without bound
+    if before or limit != NEWS_PAGE_SIZE:
+        page = await load_news_page(news_repo, before, limit, selected)
+    else:
+        page = await cache.get_or_load(
+            f"news:{','.join(sorted(selected))}",
+            lambda: load_news_page(news_repo, None, limit, selected),
+            tags=["news"],
+            ttl=NEWS_CACHE_TTL
+        )
     
-    # Clean up ObjectId
-    cleaned_news = []
-    for news in news_list:
-        if "_id" in news:
-            del news["_id"]
-        cleaned_news.append(News(**news))
+    headers = {"ETag": page["etag"], "Cache-Control": "no-cache"}
+    if page["last_modified"]:
+        headers["Last-Modified"] = page["last_modified"]
+    if page["next_cursor"]:
+        headers["X-Next-Cursor"] = page["next_cursor"]
     
-    return cleaned_news
+    if if_none_match and (if_none_match.strip() == "*" or page["etag"] in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=page["body"], media_type="application/json", headers=headers)
 
 @api_router.post("/news", response_model=News)
-async def create_news(news: NewsCreate, token_data: dict = Depends(verify_token)):
+async def create_news(
+    news: NewsCreate,
+    token_data: dict = Depends(verify_token),
+    news_repo: NewsRepo = Depends(get_news_repo)
+):
     if token_data["user_type"] != "teacher":
         raise HTTPException(status_code=403, detail="Only teachers can create news")
     
     news_obj = News(**news.dict())
-    await db.news.insert_one(news_obj.dict())
+    await news_repo.insert(news_obj.dict())
+    await cache.invalidate("news")
     return news_obj
 
+# Parent endpoints
+@api_router.get("/parent/dashboard")
+async def get_parent_dashboard(
+    student_id: Optional[str] = Query(None),
+    news_limit: int = Query(5, ge=1, le=20),
+    token_data: dict = Depends(verify_token),
+    student_repo: StudentRepo = Depends(get_student_repo),
+    grade_repo: GradeRepo = Depends(get_grade_repo),
+    attendance_repo: AttendanceRepo = Depends(get_attendance_repo),
+    news_repo: NewsRepo = Depends(get_news_repo)
+):
+    """Everything the parent home screen shows, in one round trip"""
+    if token_data["user_type"] != "parent":
+        raise HTTPException(status_code=403, detail="Only parents can view the dashboard")
+    
+    student_id = student_id or token_data["student_id"]
+    if student_id not in token_data.get("student_ids", [token_data["student_id"]]):
+        raise HTTPException(status_code=403, detail="Parents can only view their own child's dashboard")
+    
+    # Grades and attendance of the current academic year
+    year = academic_years.current_year()
+    since, _ = academic_years.date_range(year)
+    
+    # Every read runs at once; only attendance waits for the profile, which gives the class
+    profile = asyncio.ensure_future(
+        student_repo.get(student_id, read_layer.exclude(*read_layer.STUDENT_PRIVATE_FIELDS))
+    )
+    
+    async def attendance_records():
+        student = await profile
+        return await attendance_repo.student_records(student_id, student["class_name"], since) if student else []
+    
+    student, grades, records, news_list = await asyncio.gather(
+        profile,
+        grade_repo.for_student(student_id, year),
+        attendance_records(),
+        news_repo.published(limit=news_limit, projection=read_layer.projection(read_layer.NEWS_DEFAULT_FIELDS))
+    )
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    return read_layer.json_response({
+        "student": student,
+        "academic_year": year,
+        "grades": semester_grades(grades),
+        "attendance": {"since": since, **summarize(records)},
+        "news": news_list
+    })
+
 # Statistics endpoints
+def overview_stats_key(today):
+    return f"overview:{today}"
+
+async def count_today_scans(today, recorded):
+    """Bump today's cached attendance count for newly recorded QR check-ins"""
+    if recorded:
+        await cache.update(
+            overview_stats_key(today),
+            lambda stats: {**stats, "today_attendance": stats["today_attendance"] + recorded},
+            tags=["stats"]
+        )
+
 @api_router.get("/stats/overview")
-async def get_overview_stats():
-    total_students = await db.students.count_documents({})
-    total_teachers = await db.users.count_documents({"role": {"$in": ["teacher", "admin"]}})
-    total_classes = len(await db.students.distinct("class_name"))
-    
-    # Get today's attendance
+async def get_overview_stats(repositories: Repositories = Depends(get_repositories)):
     today = datetime.now().strftime("%Y-%m-%d")
-    today_attendance = await db.attendance.count_documents({"date": today, "status": "present"})
-    
+    stats = await cache.get_or_load(
+        overview_stats_key(today), lambda: repositories.overview_stats(today), tags=["stats"], ttl=STATS_CACHE_TTL
+    )
     return {
-        "total_students": total_students,
-        "total_teachers": total_teachers,
-        "total_classes": total_classes,
-        "today_attendance": today_attendance
+        "academic_year": academic_years.current_year(),
+        "total_students": stats["total_students"],
+        "total_teachers": stats["total_teachers"],
+        "total_classes": stats["total_classes"],
+        "today_attendance": stats["today_attendance"]
     }
 
 # Initialize data
 @api_router.post("/init-sample-data")
-async def initialize_sample_data():
+async def initialize_sample_data(repositories: Repositories = Depends(get_repositories)):
     # Check if data already exists
-    student_count = await db.students.count_documents({})
+    student_count = await repositories.students.count()
     if student_count > 0:
         return {"message": "Sample data already exists"}
     
-    # Create admin user
-    admin_password_hash = bcrypt.hash("admin123")
-    admin_user = User(
-        username="admin",
-        password_hash=admin_password_hash,
-        full_name="Quản Trị Viên",
-        role="admin"
-    )
-    await db.users.insert_one(admin_user.dict())
-    
-    # Create sample teachers
-    teachers = [
-        {"username": "glv_pedro", "password": "pedro123", "full_name": "Thầy Phêrô Nguyễn", "classes": ["Lớp 1A"]},
-        {"username": "glv_maria", "password": "maria123", "full_name": "Cô Maria Trần", "classes": ["Lớp 2A"]},
-        {"username": "glv_paulo", "password": "paulo123", "full_name": "Thầy Phao-lô Lê", "classes": ["Lớp 3A"]},
+    # Create admin user and sample teachers
+    users = [
+        {"username": "admin", "password": "admin123", "full_name": "Quản Trị Viên", "role": "admin", "classes": []},
+        {"username": "glv_pedro", "password": "pedro123", "full_name": "Thầy Phêrô Nguyễn", "role": "teacher", "classes": ["Lớp 1A"]},
+        {"username": "glv_maria", "password": "maria123", "full_name": "Cô Maria Trần", "role": "teacher", "classes": ["Lớp 2A"]},
+        {"username": "glv_paulo", "password": "paulo123", "full_name": "Thầy Phao-lô Lê", "role": "teacher", "classes": ["Lớp 3A"]},
     ]
     
-    for teacher_data in teachers:
-        password_hash = bcrypt.hash(teacher_data["password"])
-        teacher = User(
-            username=teacher_data["username"],
+    # Hash concurrently; the password pool bounds how many run at once
+    password_hashes = await asyncio.gather(*(passwords.hash(user_data["password"]) for user_data in users))
+    
+    for user_data, password_hash in zip(users, password_hashes):
+        user = User(
+            username=user_data["username"],
             password_hash=password_hash,
-            full_name=teacher_data["full_name"],
-            role="teacher",
-            classes=teacher_data["classes"]
+            full_name=user_data["full_name"],
+            role=user_data["role"],
+            classes=user_data["classes"]
         )
-        await db.users.insert_one(teacher.dict())
+        await repositories.users.insert(user.dict())
     
     # Create sample students with parent passwords
     students = [
@@ -683,23 +1367,35 @@ async def initialize_sample_data():
         {"name": "Hoàng Văn Em", "class_name": "Lớp 3A", "parent_name": "Hoàng Thị Hoa", "parent_phone": "0123456987"},
     ]
     
+    student_ids = []
+    parent_logins = []
     for student_data in students:
-        parent_password = generate_password()
-        student_data["parent_password"] = parent_password
         student_obj = Student(**student_data)
-        await db.students.insert_one(student_obj.dict())
+        student_obj.parent_password = await parent_accounts.attach_student(
+            repositories.users, passwords,
+            student_obj.id, student_obj.parent_phone, student_obj.parent_name, generate_password()
+        )
+        if student_obj.parent_password:
+            parent_logins.append({"parent_phone": student_obj.parent_phone, "parent_password": student_obj.parent_password})
+        await repositories.students.insert(student_document(student_obj))
+        student_ids.append(student_obj.id)
         
         # Create sample grades for both semesters
-        for semester in [1, 2]:
-            grade_obj = Grade(
+        await repositories.grades.insert_many([
+            Grade(
                 student_id=student_obj.id,
                 student_name=student_obj.name,
                 class_name=student_obj.class_name,
                 semester=semester,
                 tx1=7.5, tx2=8.0, tx3=7.0, tx4=8.5,
                 gk=8.0, ck=7.5
-            )
-            await db.grades.insert_one(grade_obj.dict())
+            ).dict()
+            for semester in [1, 2]
+        ])
+    
+    await repositories.grades.recompute_averages(student_ids)
+    
+    await cache.invalidate("stats", *{class_tag(student["class_name"]) for student in students})
     
     # Create sample news
     news_items = [
@@ -717,9 +1413,11 @@ async def initialize_sample_data():
     
     for news_data in news_items:
         news_obj = News(**news_data)
-        await db.news.insert_one(news_obj.dict())
+        await repositories.news.insert(news_obj.dict())
+    await cache.invalidate("news")
     
-    return {"message": "Sample data initialized successfully"}
+    # The generated passwords are only stored hashed, so this is the one chance to see them
+    return {"message": "Sample data initialized successfully", "parent_logins": parent_logins}
 
 # Root endpoint
 @api_router.get("/")
@@ -737,9 +1435,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request count, in-flight and latency per route template, served at /metrics
+app.add_middleware(metrics.PrometheusMiddleware)
+if query_debugger:
+    app.add_middleware(querydebug.QueryDebugMiddleware, debugger=query_debugger)
+
+# Probes: liveness only needs the process; readiness needs MongoDB and a free pool slot
+async def mongo_status():
+    if client is None:
+        return {"ping_ms": None, "error": None}
+    try:
+        return {"ping_ms": await mongo.ping(client), "error": None}
+    except Exception as e:
+        return {"ping_ms": None, "error": str(e) or type(e).__name__}
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {
+        "status": "ok",
+        "mongo": await mongo_status(),
+        "pool": mongo_pool.stats(MONGO_OPTIONS["maxPoolSize"])
+    }
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    status = await mongo_status()
+    pool = mongo_pool.stats(MONGO_OPTIONS["maxPoolSize"])
+    saturated = pool["waiting"] > 0 and pool["in_use"] >= pool["max_pool_size"]
+    ready = app.state.ready and status["error"] is None and not saturated
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "mongo": status, "pool": pool}
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+@app.exception_handler(PasswordServiceBusy)
+async def password_service_busy(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please try again"},
+        headers={"Retry-After": "1"}
+    )
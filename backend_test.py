@@ -309,23 +309,32 @@ def main():
     if not teacher_login_success:
         print("❌ Teacher login failed, cannot proceed with teacher-only tests")
     
-    # Get students to find parent credentials
+    # Get students and reset a parent password for the parent login test
     if teacher_login_success:
         success, students = tester.run_test(
             "Get Students for Parent Login",
             "GET",
             "api/students",
             200,
+            params={"fields": "id,parent_phone"},
             auth=True
         )
         
         if success and len(students) > 0:
-            # Save the first student's parent credentials for testing
+            # Passwords are only stored hashed, so give the first student's parent a new one
             student = students[0]
             tester.student_id = student['id']
-            tester.parent_phone = student['parent_phone']
-            tester.parent_password = student['parent_password']
-            print(f"Found parent credentials - Phone: {tester.parent_phone}, Password: {tester.parent_password}")
+            success, credentials = tester.run_test(
+                "Reset Parent Password",
+                "POST",
+                f"api/students/{student['id']}/parent-password",
+                200,
+                auth=True
+            )
+            if success:
+                tester.parent_phone = credentials['parent_phone']
+                tester.parent_password = credentials['parent_password']
+                print(f"Reset parent credentials - Phone: {tester.parent_phone}, Password: {tester.parent_password}")
     
     # Test grade management
     print("\n🔍 TESTING GRADE MANAGEMENT:")
@@ -0,0 +1,58 @@
+"""Behavioral tests of the backend against mongomock-motor; no MongoDB server is needed.
+
+Tests are plain functions running their scenario with asyncio.run, like the
+benchmark fixtures. From the repository root:
+
+    pytest tests
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test")
+
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+from indexes import ensure_indexes  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """Empty database with the app's indexes, unique ones included"""
+    database = AsyncMongoMockClient()["test"]
+    asyncio.run(ensure_indexes(database))
+    return database
+
+
+@pytest.fixture
+def app_client(monkeypatch):
+    """The app on the in-memory repositories, with sample data and a teacher token"""
+    from fastapi.testclient import TestClient
+
+    import server
+    monkeypatch.setattr(server, "STORAGE_ENGINE", "memory")
+    monkeypatch.setenv("ACADEMIC_YEAR", "2025-2026")
+    with TestClient(server.app) as client:
+        client.post("/api/init-sample-data")
+        token = client.post("/api/auth/teacher-login", json={"username": "admin", "password": "admin123"}).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
+
+
+def student(student_id, name, class_name, parent_phone="0900000000"):
+    """A stored student document"""
+    import search
+    document = {
+        "id": student_id,
+        "name": name,
+        "class_name": class_name,
+        "parent_name": "Phụ Huynh",
+        "parent_phone": parent_phone
+    }
+    document["search_key"] = search.build_search_key(document)
+    return document
@@ -0,0 +1,115 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+import academic_years
+import propagation
+from repositories import MotorRepositories
+from tests.conftest import student
+
+CLOSED_YEAR = "2024-2025"
+
+
+def grade(student_id, class_name, year, semester, score):
+    return {
+        "id": f"{student_id}-{year}-{semester}", "student_id": student_id, "student_name": student_id,
+        "class_name": class_name, "year": year, "semester": semester, "gk": score, "ck": score
+    }
+
+
+async def seed(db):
+    await db.students.insert_many([
+        student("pass", "Nguyễn Văn An", "Lớp 1A"),
+        student("fail", "Trần Thị Bình", "Lớp 1A"),
+        student("moved", "Lê Văn Cường", "Lớp 3B"),
+    ])
+    await db.grades.insert_many([
+        grade("pass", "Lớp 1A", CLOSED_YEAR, 1, 8.0),
+        grade("pass", "Lớp 1A", CLOSED_YEAR, 2, 7.0),
+        grade("fail", "Lớp 1A", CLOSED_YEAR, 1, 4.0),
+        grade("fail", "Lớp 1A", CLOSED_YEAR, 2, 5.0),
+        # Passed in Lớp 2A but has changed class since: not promoted again
+        grade("moved", "Lớp 2A", CLOSED_YEAR, 2, 9.0),
+        grade("pass", "Lớp 1A", "2025-2026", 1, 6.0),
+    ])
+    await db.attendance.insert_many([
+        {"student_id": "pass", "class_name": "Lớp 1A", "date": "2025-05-04", "status": "present"},
+        {"student_id": "pass", "class_name": "Lớp 1A", "date": "2025-09-07", "status": "present"},
+    ])
+
+
+@pytest.fixture(autouse=True)
+def current_year(monkeypatch):
+    monkeypatch.setenv("ACADEMIC_YEAR", "2025-2026")
+    monkeypatch.delenv("ACADEMIC_YEAR_START", raising=False)
+
+
+def test_year_boundaries():
+    assert academic_years.year_of(date(2025, 8, 31)) == "2024-2025"
+    assert academic_years.year_of(date(2025, 9, 1)) == "2025-2026"
+    assert academic_years.date_range("2024-2025") == ("2024-09-01", "2025-08-31")
+    assert academic_years.next_class_name("Lớp 1A") == "Lớp 2A"
+    assert academic_years.next_class_name("Lớp Thêm Sức") == "Lớp Thêm Sức"
+    with pytest.raises(ValueError):
+        academic_years.parse_year("2024-2026")
+
+
+def test_rollover_archives_the_year_and_promotes_passing_students(db):
+    async def scenario():
+        await seed(db)
+        counts = await academic_years.rollover(db, CLOSED_YEAR, batch_size=2)
+        assert counts == {"grades": 5, "attendance": 1, "promoted": 1}
+
+        assert await db.grades.distinct("year") == ["2025-2026"]
+        assert await db.grades_archive.count_documents({"year": CLOSED_YEAR}) == 5
+        assert [record["date"] for record in await db.attendance.find().to_list(None)] == ["2025-09-07"]
+        assert await db.attendance_archive.count_documents({}) == 1
+
+        classes = {document["id"]: document["class_name"] async for document in db.students.find()}
+        assert classes == {"pass": "Lớp 2A", "fail": "Lớp 1A", "moved": "Lớp 3B"}
+        promoted = await db.students.find_one({"id": "pass"})
+        assert "2a" in promoted["search_key"]
+        # The class change is queued so current-year copies follow the student
+        entry = await db.student_outbox.find_one({})
+        assert (entry["student_id"], entry["previous_class_names"]) == ("pass", ["Lớp 1A"])
+
+    asyncio.run(scenario())
+
+
+def test_class_change_before_rollover_is_not_promoted_again(db):
+    async def scenario():
+        await seed(db)
+        # Moved to Lớp 2A early in the new year, before the rollover ran
+        await db.students.update_one({"id": "pass"}, {"$set": {"class_name": "Lớp 2A"}})
+        repositories = MotorRepositories(db)
+        await repositories.outbox.enqueue(propagation.change_entry("pass", ["Lớp 1A"]))
+        await propagation.PropagationWorker(repositories).drain()
+
+        counts = await academic_years.rollover(db, CLOSED_YEAR)
+        assert counts["promoted"] == 0
+        assert (await db.students.find_one({"id": "pass"}))["class_name"] == "Lớp 2A"
+        archived = await db.grades_archive.find({"student_id": "pass"}).to_list(None)
+        assert {record["class_name"] for record in archived} == {"Lớp 1A"}
+        assert (await db.grades.find_one({"student_id": "pass"}))["class_name"] == "Lớp 2A"
+        attendance = await db.attendance_archive.find_one({"student_id": "pass"})
+        assert attendance["class_name"] == "Lớp 1A"
+
+    asyncio.run(scenario())
+
+
+def test_rollover_is_safe_to_rerun(db):
+    async def scenario():
+        await seed(db)
+        await academic_years.rollover(db, CLOSED_YEAR)
+        counts = await academic_years.rollover(db, CLOSED_YEAR)
+        assert counts == {"grades": 0, "attendance": 0, "promoted": 0}
+        assert await db.grades_archive.count_documents({}) == 5
+        assert (await db.students.find_one({"id": "pass"}))["class_name"] == "Lớp 2A"
+
+    asyncio.run(scenario())
+
+
+def test_rollover_refuses_the_current_year(db):
+    with pytest.raises(ValueError):
+        asyncio.run(academic_years.rollover(db, "2025-2026"))
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from attendance_store import ATTENDANCE_CODES, NO_RECORD_CODE, new_record
+from repositories import MotorRepositories
+from tests.conftest import student
+
+DATES = ["2025-10-05", "2025-10-12", "2025-10-19"]
+STATUSES = ["present", "absent_with_permission", "absent_without_permission"]
+
+
+def expected_matrix(records, roster):
+    """The grid class_matrix() should build from a class's class_records() and roster"""
+    names = {record["student_id"]: record["student_name"] for record in records}
+    names.update((student["id"], student["name"]) for student in roster)
+    dates = sorted({record["date"] for record in records})
+    codes = {(record["student_id"], record["date"]): ATTENDANCE_CODES[record["status"]] for record in records}
+    student_ids = sorted(names, key=lambda student_id: (names[student_id] or "", student_id))
+    return {
+        "dates": dates,
+        "student_ids": student_ids,
+        "student_names": [names[student_id] for student_id in student_ids],
+        "grid": ["".join(codes.get((student_id, day), NO_RECORD_CODE) for day in dates) for student_id in student_ids]
+    }
+
+
+def test_matrix_endpoint_matches_the_class_records(app_client):
+    students = app_client.get("/api/students", params={"class_name": "Lớp 1A", "fields": "id,name,class_name"}).json()
+    # The last student has no record in the range and still gets a row
+    for number, marked in enumerate(students[:-1]):
+        for day, status in zip(DATES[number % 2:], STATUSES):
+            response = app_client.post("/api/attendance", json={"student_id": marked["id"], "date": day, "status": status})
+            assert response.status_code == 200
+
+    response = app_client.get(
+        "/api/attendance/class/Lớp 1A/matrix", params={"from": DATES[0], "to": DATES[-1]}
+    )
+    assert response.status_code == 200
+    matrix = response.json()
+    repositories = app_client.app.state.repositories
+    records = asyncio.run(repositories.attendance.class_records("Lớp 1A", date_range=(DATES[0], DATES[-1])))
+    expected = expected_matrix(records, students)
+    assert {key: matrix[key] for key in expected} == expected
+    assert matrix["grid"][matrix["student_ids"].index(students[-1]["id"])] == NO_RECORD_CODE * len(DATES)
+
+
+@pytest.fixture
+def mongo_url():
+    """MONGO_URL when a MongoDB server answers there; mongomock has no $unionWith, $facet or $reduce"""
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    url = os.environ["MONGO_URL"]
+    client = MongoClient(url, serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command("ping")
+    except PyMongoError:
+        pytest.skip(f"no MongoDB server at {url}")
+    finally:
+        client.close()
+    return url
+
+
+@pytest.mark.parametrize("layout", ["per_student", "class_day"])
+def test_motor_matrix_matches_the_class_records(mongo_url, layout):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from indexes import ensure_indexes
+
+    async def scenario():
+        client = AsyncIOMotorClient(mongo_url)
+        db_name = f"test_matrix_{uuid.uuid4().hex[:8]}"
+        db = client[db_name]
+        try:
+            await ensure_indexes(db)
+            roster = [student(f"s{number}", name, "Lớp 1A") for number, name in enumerate(["Bình", "An", "Cường"])]
+            await db.students.insert_many([dict(document) for document in roster])
+            repositories = MotorRepositories(db, layout)
+            await repositories.attendance.record([
+                new_record(document, day, status, "manual", None, "admin")
+                for number, document in enumerate(roster[:-1])
+                for day, status in zip(DATES[number:], STATUSES)
+            ])
+            # A former member with records in the range keeps a row
+            former = student("s9", "Dũng", "Lớp 1A")
+            await repositories.attendance.record([new_record(former, DATES[1], "present", "manual", None, "admin")])
+
+            matrix = await repositories.attendance.class_matrix("Lớp 1A", DATES[0], DATES[-1])
+            records = await repositories.attendance.class_records("Lớp 1A", date_range=(DATES[0], DATES[-1]))
+            # Names of former members come from the records (class_day keeps none for them)
+            assert matrix == expected_matrix(records, roster)
+        finally:
+            await client.drop_database(db_name)
+            client.close()
+
+    asyncio.run(scenario())
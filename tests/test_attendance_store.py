@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from attendance_store import ClassDayAttendanceStore, PerStudentAttendanceStore, migrate_attendance, new_record
+from tests.conftest import student
+
+SUNDAY = "2025-10-05"
+STORES = [PerStudentAttendanceStore, ClassDayAttendanceStore]
+
+
+def scan(student_id, status="present", class_name="Lớp 1A", date=SUNDAY):
+    return new_record(student(student_id, student_id, class_name), date, status, "qr", None, "admin")
+
+
+async def statuses(store, date=SUNDAY):
+    return {record["student_id"]: record["status"] for record in await store.class_records("Lớp 1A", date)}
+
+
+# mongomock numbers the upserts of a bulk_write among upserts only, not among
+# all operations, so the per_student store's indexes are only checked by count
+
+
+@pytest.mark.parametrize("store_class", STORES)
+def test_first_scan_wins_and_duplicates_are_not_counted(db, store_class):
+    async def scenario():
+        store = store_class(db)
+        created, errors = await store.record([scan("a"), scan("b")], overwrite=False)
+        assert (len(created), errors) == (2, {})
+
+        created, errors = await store.record([scan("a", "absent_without_permission"), scan("c")], overwrite=False)
+        assert (len(created), errors) == (1, {})
+        assert await statuses(store) == {"a": "present", "b": "present", "c": "present"}
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("store_class", STORES)
+def test_overwrite_counts_only_new_records(db, store_class):
+    async def scenario():
+        store = store_class(db)
+        await store.record([scan("a")])
+        created, errors = await store.record([scan("a", "absent_with_permission"), scan("b")])
+        assert (len(created), errors) == (1, {})
+        assert await statuses(store) == {"a": "absent_with_permission", "b": "present"}
+
+    asyncio.run(scenario())
+
+
+def test_class_day_reports_which_records_were_created(db):
+    async def scenario():
+        store = ClassDayAttendanceStore(db)
+        created, errors = await store.record([scan("a"), scan("b"), scan("a", "absent_with_permission")], overwrite=False)
+        assert (created, errors) == ({0, 1}, {})
+        created, errors = await store.record([scan("a"), scan("c")], overwrite=False)
+        assert (created, errors) == ({1}, {})
+        created, errors = await store.record([scan("c", "absent_with_permission"), scan("d")])
+        assert (created, errors) == ({1}, {})
+
+    asyncio.run(scenario())
+
+
+def test_class_day_entry_written_since_the_existence_check_is_not_counted(db):
+    async def scenario():
+        store = ClassDayAttendanceStore(db)
+        await store.record([scan("a")])
+        find = store.collection.find
+
+        class NoDays:
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                raise StopAsyncIteration
+
+        # As if another request marked "a" right after this one looked
+        store.collection.find = lambda *args, **kwargs: NoDays()
+        created, errors = await store.record(
+            [scan("a", "absent_with_permission"), scan("b"), scan("c", date="2025-10-12")], overwrite=False
+        )
+        store.collection.find = find
+        assert (created, errors) == ({1, 2}, {})
+        assert await statuses(store) == {"a": "present", "b": "present"}
+        assert await db.attendance_days.count_documents({}) == 2
+
+    asyncio.run(scenario())
+
+
+def test_class_day_overwrite_reads_creation_from_the_write(db):
+    async def scenario():
+        store = ClassDayAttendanceStore(db)
+        # The same student twice in one request: created once, then updated
+        created, errors = await store.record([scan("a"), scan("a", "absent_with_permission")])
+        assert (created, errors) == ({0}, {})
+        assert await statuses(store) == {"a": "absent_with_permission"}
+
+        find = store.collection.find
+        # As if "b" was marked by another request right after this one looked
+        store.collection.find = lambda *args, **kwargs: find({"date": "none"})
+        await store.collection.update_one({"class_name": "Lớp 1A", "date": SUNDAY}, {"$set": {"entries.b": {"s": "present"}}})
+        created, errors = await store.record([scan("b", "absent_without_permission"), scan("c")])
+        store.collection.find = find
+        assert (created, errors) == ({1}, {})
+        assert await statuses(store) == {"a": "absent_with_permission", "b": "absent_without_permission", "c": "present"}
+
+    asyncio.run(scenario())
+
+
+def test_migration_reports_records_it_could_not_write(db, monkeypatch):
+    record = ClassDayAttendanceStore.record
+
+    async def rejecting_second(self, records, overwrite=True):
+        created, _ = await record(self, records[:1], overwrite)
+        return created, {1: "write rejected"}
+
+    async def scenario():
+        await PerStudentAttendanceStore(db).record([scan("a"), scan("b", date="2025-10-12")])
+        monkeypatch.setattr(ClassDayAttendanceStore, "record", rejecting_second)
+        copied, failed = await migrate_attendance(db, "per_student", "class_day")
+        assert copied == 1
+        assert failed == [{"student_id": "b", "date": "2025-10-12", "error": "write rejected"}]
+        assert await statuses(ClassDayAttendanceStore(db)) == {"a": "present"}
+
+    asyncio.run(scenario())
+
+
+def test_class_day_failed_entries_are_reported_not_created(db):
+    async def scenario():
+        store = ClassDayAttendanceStore(db)
+        await store.record([scan("z")])
+        bulk_write = store.collection.bulk_write
+
+        async def failing_second(operations, ordered):
+            # The server rejects one entry and, unordered, still applies the rest
+            await bulk_write([operations[0], *operations[2:]], ordered=ordered)
+            raise BulkWriteError({
+                "writeErrors": [{"index": 1, "code": 2, "errmsg": "write rejected"}], "upserted": []
+            })
+
+        store.collection.bulk_write = failing_second
+        created, errors = await store.record([scan("a"), scan("b"), scan("c")], overwrite=False)
+        assert (created, errors) == ({0, 2}, {1: "write rejected"})
+        assert await statuses(store) == {"z": "present", "a": "present", "c": "present"}
+
+    asyncio.run(scenario())
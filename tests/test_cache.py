@@ -0,0 +1,143 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from cache import Cache, MemoryCacheBackend, RedisCacheBackend
+
+
+def memory_cache():
+    return Cache(MemoryCacheBackend())
+
+
+def redis_cache():
+    return Cache(RedisCacheBackend(fakeredis.FakeAsyncRedis()), prefix="test:")
+
+
+BACKENDS = [memory_cache, redis_cache]
+
+
+class Source:
+    """Loader over a value that changes, counting loads"""
+
+    def __init__(self, value):
+        self.value = value
+        self.loads = 0
+        self.started = asyncio.Event()
+        self.release = None
+
+    async def load(self):
+        self.loads += 1
+        value = self.value
+        self.started.set()
+        if self.release:
+            await self.release.wait()
+        return value
+
+
+@pytest.mark.parametrize("make_cache", BACKENDS)
+def test_concurrent_misses_share_one_load(make_cache):
+    async def scenario():
+        cache = make_cache()
+        source = Source("roster")
+        values = await asyncio.gather(*(cache.get_or_load("key", source.load, tags=["class:1A"]) for _ in range(5)))
+        assert values == ["roster"] * 5
+        assert await cache.get_or_load("key", source.load, tags=["class:1A"]) == "roster"
+        assert source.loads == 1
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_cache", BACKENDS)
+def test_invalidate_makes_tagged_entries_miss(make_cache):
+    async def scenario():
+        cache = make_cache()
+        source = Source("old")
+        await cache.get_or_load("roster", source.load, tags=["class:1A"])
+        await cache.get_or_load("other", source.load, tags=["class:2A"])
+        source.value = "new"
+        await cache.invalidate("class:1A")
+        assert await cache.get_or_load("roster", source.load, tags=["class:1A"]) == "new"
+        assert await cache.get_or_load("other", source.load, tags=["class:2A"]) == "old"
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_cache", BACKENDS)
+def test_load_racing_an_invalidation_is_not_served_afterwards(make_cache):
+    async def scenario():
+        cache = make_cache()
+        source = Source("before write")
+        source.release = asyncio.Event()
+        in_flight = asyncio.ensure_future(cache.get_or_load("roster", source.load, tags=["class:1A"]))
+        await source.started.wait()
+
+        # A write lands while the load still holds the old value
+        source.value = "after write"
+        await cache.invalidate("class:1A")
+        source.release.set()
+        assert await in_flight == "before write"
+
+        # Neither the stored stale value nor the detached load is reused
+        assert await cache.get_or_load("roster", source.load, tags=["class:1A"]) == "after write"
+        assert source.loads == 2
+
+    asyncio.run(scenario())
+
+
+def test_workers_sharing_redis_see_each_others_invalidations():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        first = Cache(RedisCacheBackend(fakeredis.FakeAsyncRedis(server=server)), prefix="test:")
+        second = Cache(RedisCacheBackend(fakeredis.FakeAsyncRedis(server=server)), prefix="test:")
+        source = Source("old")
+        await first.get_or_load("roster", source.load, tags=["class:1A"])
+        assert await second.get_or_load("roster", source.load, tags=["class:1A"]) == "old"
+        source.value = "new"
+        await second.invalidate("class:1A")
+        assert await first.get_or_load("roster", source.load, tags=["class:1A"]) == "new"
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("make_cache", BACKENDS)
+def test_update_changes_a_cached_value_and_skips_a_miss(make_cache):
+    async def scenario():
+        cache = make_cache()
+        await cache.update("count", lambda count: count + 1, tags=["stats"])
+        assert await cache.get_or_load("count", Source(1).load, tags=["stats"]) == 1
+        await cache.update("count", lambda count: count + 1, tags=["stats"])
+        assert await cache.get_or_load("count", Source(0).load, tags=["stats"]) == 2
+
+    asyncio.run(scenario())
+
+
+def test_memory_backend_evicts_least_recently_used_and_sweeps_expired():
+    async def scenario():
+        backend = MemoryCacheBackend(max_entries=2, sweep_interval=0)
+        await backend.set("a", b"1", ttl=60)
+        await backend.set("b", b"2", ttl=60)
+        assert await backend.get_many(["a"]) == [b"1"]
+        await backend.set("c", b"3", ttl=60)
+        assert await backend.get_many(["a", "b", "c"]) == [b"1", None, b"3"]
+
+        await backend.set("short", b"4", ttl=0.01)
+        await backend.set_tokens(["tag"], ttl=0.01)
+        await asyncio.sleep(0.02)
+        await backend.set("d", b"5", ttl=60)
+        assert len(backend) == 2
+
+    asyncio.run(scenario())
+
+
+def test_backend_failure_falls_back_to_the_loader():
+    class Broken(MemoryCacheBackend):
+        async def get_many(self, keys):
+            raise ConnectionError("cache down")
+
+    async def scenario():
+        cache = Cache(Broken())
+        assert await cache.get_or_load("key", Source("direct").load) == "direct"
+        await cache.invalidate("class:1A")
+
+    asyncio.run(scenario())
@@ -0,0 +1,119 @@
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+
+import gradebook_files
+
+YEAR = "2025-2026"
+
+
+def sheet(text):
+    return gradebook_files.read_sheet(text.encode("utf-8-sig"), "grades.csv")
+
+
+def test_valid_rows_keep_blank_scores_unchanged():
+    rows, errors = gradebook_files.validate_rows(sheet(
+        "Student_ID,Semester,TX1,GK,CK\n"
+        "s1,1,\"8,5\",,9\n"
+        "s2,2,,7,\n"
+    ), YEAR)
+    assert errors == []
+    assert rows == [
+        {"row": 2, "student_id": "s1", "semester": 1, "class_name": None, "scores": {"tx1": 8.5, "ck": 9.0}},
+        {"row": 3, "student_id": "s2", "semester": 2, "class_name": None, "scores": {"gk": 7.0}},
+    ]
+
+
+def test_invalid_rows_are_reported_with_their_sheet_row():
+    rows, errors = gradebook_files.validate_rows(sheet(
+        "student_id,semester,tx1,ck\n"
+        ",1,5,5\n"
+        "s2,3,5,5\n"
+        "s3,1,abc,11\n"
+        "s4,1,5,5\n"
+        "s4,1,6,6\n"
+    ), YEAR)
+    assert [row["row"] for row in rows] == [5]
+    assert errors == [
+        {"row": 2, "student_id": "", "error": "student_id is required"},
+        {"row": 3, "student_id": "s2", "error": "semester must be 1 or 2"},
+        {"row": 4, "student_id": "s3", "error": "tx1 is not a number; ck must be between 0 and 10"},
+        {"row": 6, "student_id": "s4", "error": "duplicate student_id and semester"},
+    ]
+
+
+def test_rows_of_another_year_are_rejected():
+    rows, errors = gradebook_files.validate_rows(sheet(
+        "student_id,class_name,year,semester,tx1\n"
+        f"s1,Lớp 1A,{YEAR},1,8\n"
+        "s2,Lớp 1A,2024-2025,1,8\n"
+        "s3,,,1,8\n"
+    ), YEAR)
+    assert [(row["student_id"], row["class_name"]) for row in rows] == [("s1", "Lớp 1A"), ("s3", None)]
+    assert errors == [{"row": 3, "student_id": "s2", "error": f"year is 2024-2025, not the imported year {YEAR}"}]
+
+
+def test_sheet_without_required_columns_or_over_the_row_limit_is_refused(monkeypatch):
+    with pytest.raises(ValueError, match="semester"):
+        gradebook_files.validate_rows(sheet("student_id,tx1\ns1,5\n"), YEAR)
+    monkeypatch.setattr(gradebook_files, "MAX_IMPORT_ROWS", 1)
+    with pytest.raises(ValueError, match="At most 1 rows"):
+        gradebook_files.validate_rows(sheet("student_id,semester\ns1,1\ns2,1\n"), YEAR)
+
+
+async def records():
+    yield {"student_id": "s1", "student_name": "Nguyễn Văn An", "class_name": "Lớp 1A", "year": YEAR,
+           "semester": 1, "tx1": 8.0, "semester_average": 8.0}
+
+
+def export(export_format):
+    import asyncio
+
+    async def collect():
+        return b"".join([chunk async for chunk in gradebook_files.export_chunks(records(), export_format)])
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("export_format", ["csv", "xlsx"])
+def test_export_reimports_into_the_same_year(export_format):
+    content = export(export_format)
+    if export_format == "xlsx":
+        assert "xl/worksheets/sheet1.xml" in zipfile.ZipFile(io.BytesIO(content)).namelist()
+    frame = gradebook_files.read_sheet(content, f"grades.{export_format}")
+    assert isinstance(frame, pd.DataFrame)
+    rows, errors = gradebook_files.validate_rows(frame, YEAR)
+    assert errors == []
+    assert rows == [{"row": 2, "student_id": "s1", "semester": 1, "class_name": "Lớp 1A", "scores": {"tx1": 8.0}}]
+    _, errors = gradebook_files.validate_rows(frame, "2026-2027")
+    assert [error["row"] for error in errors] == [2]
+
+
+def test_import_rejects_rows_of_another_class_and_oversized_files(app_client, monkeypatch):
+    students = app_client.get("/api/students", params={"class_name": "Lớp 1A", "fields": "id"}).json()
+    content = (
+        "student_id,class_name,year,semester,tx1\n"
+        f"{students[0]['id']},Lớp 1A,,1,8\n"
+        f"{students[1]['id']},Lớp 9Z,,1,8\n"
+    )
+    response = app_client.post("/api/grades/import", files={"file": ("grades.csv", content.encode())})
+    assert response.status_code == 200
+    assert response.json()["applied"] == 1
+    assert response.json()["errors"] == [
+        {"row": 3, "student_id": students[1]["id"], "error": "class_name is Lớp 9Z, the student is in Lớp 1A"}
+    ]
+
+    monkeypatch.setattr(gradebook_files, "MAX_IMPORT_BYTES", 10)
+    response = app_client.post("/api/grades/import", files={"file": ("grades.csv", content.encode())})
+    assert response.status_code == 413
+
+
+@pytest.mark.parametrize("year", ["2025", "2024-2026", "năm nay"])
+def test_malformed_year_is_refused(app_client, year):
+    content = b"student_id,class_name,year,semester,tx1\n"
+    response = app_client.post("/api/grades/import", params={"year": year}, files={"file": ("grades.csv", content)})
+    assert response.status_code == 400
+    assert app_client.get("/api/grades/export", params={"year": year, "format": "csv"}).status_code == 400
+    assert app_client.get("/api/grades/class/Lớp 1A", params={"year": year}).status_code == 400
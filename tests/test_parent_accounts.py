@@ -0,0 +1,69 @@
+import asyncio
+
+from passlib.hash import bcrypt
+
+import parent_accounts
+from passwords import PasswordService
+from tests.conftest import student
+
+
+def test_sync_hashes_plaintext_passwords_and_removes_them(db):
+    async def scenario():
+        await db.students.insert_many([
+            {**student("an", "Nguyễn Văn An", "Lớp 1A", "0901"), "parent_password": "an-pass"},
+            {**student("binh", "Nguyễn Thị Bình", "Lớp 3A", "0901"), "parent_password": "binh-pass"},
+            {**student("cuong", "Lê Văn Cường", "Lớp 2A", "0902"), "parent_password": "cuong-pass"},
+        ])
+        passwords = PasswordService(workers=1)
+        try:
+            assert await parent_accounts.sync_parent_accounts(db, passwords) == 2
+            # Safe to re-run: nothing left to migrate
+            assert await parent_accounts.sync_parent_accounts(db, passwords) == 0
+        finally:
+            passwords.shutdown()
+
+        assert await db.students.count_documents({"parent_password": {"$exists": True}}) == 0
+        accounts = {account["phone"]: account async for account in db.parent_accounts.find()}
+        assert sorted(accounts["0901"]["student_ids"]) == ["an", "binh"]
+        assert accounts["0902"]["student_ids"] == ["cuong"]
+        assert "an-pass" not in accounts["0901"]["password_hash"]
+        assert bcrypt.verify("an-pass", accounts["0901"]["password_hash"])
+        assert bcrypt.verify("cuong-pass", accounts["0902"]["password_hash"])
+
+    asyncio.run(scenario())
+
+
+def create_student(client, name, class_name, phone):
+    response = client.post("/api/students", json={
+        "name": name, "class_name": class_name, "parent_name": "Phụ Huynh", "parent_phone": phone
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+def parent_login(client, phone, password):
+    return client.post("/api/auth/parent-login", json={"phone": phone, "password": password})
+
+
+def test_siblings_share_one_parent_login(app_client):
+    first = create_student(app_client, "Phạm Văn Đức", "Lớp 1A", "0911000111")
+    second = create_student(app_client, "Phạm Thị Hoa", "Lớp 3A", "0911000111")
+    # The password is handed out once, with the first child
+    assert first["parent_password"]
+    assert second["parent_password"] is None
+
+    response = parent_login(app_client, "0911000111", first["parent_password"])
+    assert response.status_code == 200
+    children = response.json()["user_info"]["students"]
+    assert sorted(child["id"] for child in children) == sorted([first["id"], second["id"]])
+    assert all("parent_password" not in child for child in children)
+
+
+def test_parent_token_is_limited_to_its_children(app_client):
+    own = create_student(app_client, "Phạm Văn Đức", "Lớp 1A", "0911000111")
+    other = create_student(app_client, "Võ Thị Lan", "Lớp 1A", "0922000222")
+    token = parent_login(app_client, "0911000111", own["parent_password"]).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert app_client.get(f"/api/grades/student/{own['id']}", headers=headers).status_code == 200
+    assert app_client.get(f"/api/grades/student/{other['id']}", headers=headers).status_code == 403
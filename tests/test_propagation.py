@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import propagation
+from attendance_store import new_record
+from cache import Cache, MemoryCacheBackend, class_tag
+from repositories import MotorRepositories
+from tests.conftest import student
+
+
+@pytest.fixture(autouse=True)
+def current_year(monkeypatch):
+    monkeypatch.setenv("ACADEMIC_YEAR", "2025-2026")
+
+
+async def seed(repositories, db):
+    """One student with a grade and an attendance record, then renamed and moved to Lớp 2A"""
+    an = student("s1", "Nguyễn Văn An", "Lớp 1A")
+    await db.students.insert_one(dict(an))
+    await repositories.grades.insert_many([{
+        "id": "g1", "student_id": "s1", "student_name": an["name"], "class_name": "Lớp 1A",
+        "year": "2025-2026", "semester": 1, "tx1": 8.0
+    }])
+    await repositories.attendance.record([new_record(an, "2025-10-05", "present", "manual", None, "admin")])
+    await db.students.update_one({"id": "s1"}, {"$set": {"name": "Nguyễn Văn Ân", "class_name": "Lớp 2A"}})
+    await repositories.outbox.enqueue(propagation.change_entry("s1", ["Lớp 1A"]))
+
+
+@pytest.mark.parametrize("layout", ["per_student", "class_day"])
+def test_worker_rewrites_copies_and_invalidates_classes(db, layout):
+    async def scenario():
+        repositories = MotorRepositories(db, layout)
+        await seed(repositories, db)
+        cache = Cache(MemoryCacheBackend())
+        await cache.get_or_load("gradebook", lambda: asyncio.sleep(0, "old"), tags=[class_tag("Lớp 1A")])
+
+        worker = propagation.PropagationWorker(repositories, cache=cache)
+        assert await worker.drain() == 1
+
+        grade = await db.grades.find_one({"id": "g1"})
+        assert (grade["student_name"], grade["class_name"]) == ("Nguyễn Văn Ân", "Lớp 2A")
+        records = await repositories.attendance.class_records("Lớp 2A", "2025-10-05")
+        assert [(record["student_id"], record["student_name"]) for record in records] == [("s1", "Nguyễn Văn Ân")]
+        assert await repositories.attendance.class_records("Lớp 1A", "2025-10-05") == []
+        assert await repositories.outbox.pending() == 0
+        assert await propagation.find_stale_copies(db, layout) == ({}, {})
+        assert await cache.get_or_load("gradebook", lambda: asyncio.sleep(0, "new"), tags=[class_tag("Lớp 1A")]) == "new"
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_is_retried_after_the_delay(db):
+    async def scenario():
+        repositories = MotorRepositories(db)
+        await seed(repositories, db)
+        apply_student_changes = repositories.grades.apply_student_changes
+
+        async def failing(changes, year):
+            raise RuntimeError("write failed")
+
+        repositories.grades.apply_student_changes = failing
+        worker = propagation.PropagationWorker(repositories, retry_delay=60)
+        assert await worker.run_once() == 1
+        entry = await db.student_outbox.find_one({})
+        assert entry["attempts"] == 1
+        assert entry["available_at"] > datetime.utcnow()
+        # Not due again before the retry delay
+        assert await worker.run_once() == 0
+
+        repositories.grades.apply_student_changes = apply_student_changes
+        await db.student_outbox.update_one({}, {"$set": {"available_at": datetime.utcnow()}})
+        assert await worker.drain() == 1
+        assert await repositories.outbox.pending() == 0
+        assert (await db.grades.find_one({"id": "g1"}))["class_name"] == "Lớp 2A"
+
+    asyncio.run(scenario())
+
+
+def test_claimed_entries_are_not_claimed_twice(db):
+    async def scenario():
+        repositories = MotorRepositories(db)
+        for number in range(3):
+            await repositories.outbox.enqueue(propagation.change_entry(f"s{number}", ["Lớp 1A"]))
+        first = await repositories.outbox.claim(2, lease=60)
+        second = await repositories.outbox.claim(2, lease=60)
+        assert len(first) == 2 and len(second) == 1
+        assert not {entry["id"] for entry in first} & {entry["id"] for entry in second}
+        assert await repositories.outbox.claim(2, lease=60) == []
+
+    asyncio.run(scenario())
@@ -0,0 +1,17 @@
+import asyncio
+
+from qr_codes import QRCodeService
+
+
+def test_service_renders_again_after_shutdown(tmp_path):
+    service = QRCodeService(tmp_path, workers=1)
+
+    async def scenario():
+        first = await service.png("student-1")
+        service.shutdown()
+        second = await service.png("student-2")
+        service.shutdown()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.startswith(b"\x89PNG") and second.startswith(b"\x89PNG")
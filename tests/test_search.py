@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+import search
+from memory_repositories import MemoryRepositories
+from repositories import MotorStudentRepo
+from tests.conftest import student
+
+STUDENTS = [
+    student("tran", "Trần Văn An", "Lớp 1A"),
+    student("an", "An Nguyễn", "Lớp 2A"),
+    student("anh", "Lê Thị Anh", "Lớp 1A"),
+    {**student("minh", "Phạm Minh", "Lớp 3A"), "parent_name": "Nguyễn Văn An"},
+    student("bao", "Hoàng Bảo", "Lớp 1A"),
+    student("duc", "Đặng Đức", "Lớp 2A"),
+]
+
+
+def test_fold_strips_diacritics_and_case():
+    assert search.fold("Nguyễn Văn An") == "nguyen van an"
+    assert search.fold("ĐẶNG Đức") == "dang duc"
+    assert search.tokenize("Lớp 1A - Nguyễn") == ["lop", "1a", "nguyen"]
+
+
+@pytest.fixture(params=["mongo", "memory"])
+def student_repo(request, db):
+    repo = MemoryRepositories().students if request.param == "memory" else MotorStudentRepo(db)
+
+    async def seed():
+        for document in STUDENTS:
+            await repo.insert({**document, "search_key": search.build_search_key(document)})
+
+    asyncio.run(seed())
+    return repo
+
+
+def ranked(repo, query, limit=search.MAX_CANDIDATES):
+    """Ids of the students found for `query`, in the order the search endpoint returns them"""
+    return [found["id"] for found in search.rank_students(asyncio.run(repo.search(query, limit=limit)), query)]
+
+
+def test_search_ignores_diacritics_and_case(student_repo):
+    assert ranked(student_repo, "nguyen van an") == ["minh"]
+    assert ranked(student_repo, "dang duc") == ["duc"]
+    assert ranked(student_repo, "NGUYỄN") == ["an", "minh"]
+
+
+def test_name_start_then_exact_then_prefix_matches(student_repo):
+    assert ranked(student_repo, "an") == ["an", "tran", "anh", "minh"]
+
+
+def test_limit_keeps_the_strongest_kind_of_match(student_repo):
+    assert ranked(student_repo, "an", limit=1) == ["an"]
+
+
+def test_backfill_adds_missing_search_keys_only(db):
+    async def scenario():
+        legacy = {key: value for key, value in student("old", "Võ Thị Lan", "Lớp 1A").items() if key != "search_key"}
+        await db.students.insert_many([legacy, student("new", "Ngô Văn Lâm", "Lớp 1A")])
+        assert await search.backfill_search_keys(db, missing_only=True) == 1
+        # Already backfilled: nothing left to do at the next startup
+        assert await search.backfill_search_keys(db, missing_only=True) == 0
+        assert [found["id"] for found in await MotorStudentRepo(db).search("vo lan")] == ["old"]
+
+    asyncio.run(scenario())
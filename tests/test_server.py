@@ -0,0 +1,82 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+def test_app_restarts_in_the_same_process(monkeypatch):
+    monkeypatch.setattr(server, "STORAGE_ENGINE", "memory")
+    # The lifespan exit shuts the password and QR pools down; a second start must get new ones
+    for _ in range(2):
+        with TestClient(server.app) as client:
+            assert client.post("/api/init-sample-data").status_code == 200
+            response = client.post("/api/auth/teacher-login", json={"username": "admin", "password": "admin123"})
+            assert response.status_code == 200
+
+
+def test_news_cache_holds_one_entry_per_field_set(app_client):
+    for params in [{}, {"fields": "title,id"}, {"fields": "id,title"}, {"fields": "id, title,id"}, {"limit": 5}, {"limit": 7}]:
+        assert app_client.get("/api/news", params=params).status_code == 200
+    news_entries = [key for key in server.cache.backend._values if ":news:" in key]
+    assert len(news_entries) == 2
+
+    # An uncached size still sees the same feed
+    first = app_client.get("/api/news", params={"fields": "id"}).json()
+    assert app_client.get("/api/news", params={"fields": "id", "limit": 1}).json() == first[:1]
+
+
+@pytest.fixture
+def vietnam_time():
+    """Local time UTC+7, so local and UTC dates differ around midnight"""
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = "Asia/Ho_Chi_Minh"
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = previous
+    time.tzset()
+
+
+def scan_batch(client, *scans):
+    response = client.post("/api/scan-qr/batch", json=[{"device_id": "phone", **scan} for scan in scans])
+    assert response.status_code == 200
+    return [(result["status"], result.get("date")) for result in response.json()["results"]]
+
+
+def test_scan_batch_statuses(app_client, vietnam_time):
+    students = app_client.get("/api/students", params={"class_name": "Lớp 1A", "fields": "id,name"}).json()
+    payload = f"STUDENT:{students[0]['id']}:{students[0]['name']}"
+    # No offset: the device's local time, 06:30 in Vietnam is 23:30 UTC the day before
+    local_morning = {"data": payload, "scanned_at": "2025-10-05T06:30:00"}
+    assert scan_batch(
+        app_client,
+        local_morning,
+        {"data": payload, "scanned_at": "2025-10-05T09:00:00+07:00"},
+        {"data": payload, "scanned_at": "2025-10-05T23:30:00Z"},
+        {"data": "STUDENT:nobody:Ai Đó", "scanned_at": "2025-10-05T06:30:00"},
+        {"data": "not a student badge"},
+    ) == [
+        ("recorded", "2025-10-05"),
+        ("duplicate", "2025-10-05"),
+        ("recorded", "2025-10-06"),
+        ("not_found", "2025-10-05"),
+        ("invalid", None),
+    ]
+    assert scan_batch(app_client, local_morning) == [("already_marked", "2025-10-05")]
+
+    repositories = app_client.app.state.repositories
+    records = asyncio.run(repositories.attendance.class_records("Lớp 1A", "2025-10-05"))
+    assert [record["created_at"] for record in records] == [datetime(2025, 10, 4, 23, 30)]
+
+
+def test_scan_batch_size_is_capped(app_client, monkeypatch):
+    monkeypatch.setattr(server, "MAX_SCAN_BATCH", 2)
+    response = app_client.post("/api/scan-qr/batch", json=[{"data": "STUDENT:a:A"}] * 3)
+    assert response.status_code == 413